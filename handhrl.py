@@ -18,15 +18,34 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import math
+import collections
 import textwrap
 import shelve
 import os
-import operator
 import random
+import pickle
+import zlib
+import time
+
+try:
+    import cPickle
+except ImportError:
+    import pickle as cPickle
 
 import hhmessage
 import libtcodpy as libtcod
 import hhtable
+import hhodds
+import hhgrid
+import hhpack
+import hhstore
+import hhsave
+import hhjournal
+import hhscore
+import hhleader
+import hhsched
+import hhtimer
+import hhpath
 
 
 SCREEN_WIDTH = 80
@@ -37,9 +56,33 @@ LIMIT_FPS = 20
 ROOM_MAX_SIZE = 10
 ROOM_MIN_SIZE = 6
 MAX_ROOMS = 30
+MAP_ATTEMPTS = 10
+MAP_GENERATOR = 'rooms'  # 'rooms' (random rectangles), 'bsp' (binary space partition) or 'caves'
+BSP_DEPTH = 16
+CAVE_SMOOTHING = 4
+CAVE_ZONE_SIZE = 10
+TERRAIN_LAYER = False
+TERRAIN_FEATURE_SIZE = 12  # rough width in tiles of a terrain feature
+TERRAIN_OCTAVES = 4
+RUBBLE_LEVEL = 0.75  # floor above this terrain height is rubble
+RUBBLE_COST = 3  # what monsters reckon a step onto rubble costs when finding their way, against 1 for floor
+CROWD_COST = 4  # likewise a step onto a tile another creature is standing on, on levels with rubble
+CAVE_RIDGE_LEVEL = 0.85  # in caves, terrain above this height starts out as rock
+TINT_LEVELS = 4
+LEVEL_PACK = 'levels.hhp'  # prebaked levels (see hhpack), used instead of the generator when present
+LEVEL_STORE = 'levels'  # directory where departed levels are spilled (see hhstore)
+LEVEL_STORE_BUDGET = 64 * 1024  # bytes of compressed departed levels kept in memory
+SAVE_ENCODING = 'delta'  # 'delta' (level seed plus changes since generation) or 'full' (whole level)
+AUTOSAVE_TURNS = 50  # player turns between autosaves
+JOURNAL_FILE = 'savegame.journal'  # actions since the last save, replayed after a crash (see hhjournal)
+JOURNAL_SKIP_KEYS = 'ch?'  # keys that only show a screen, left out of the journal
 FOV_ALGO = 0
 FOV_LIGHT_WALLS = True
 TORCH_RADIUS = 10
+LOD_DISTANCE = 20  # monsters further than this from the player are simulated coarsely (see far_turn)
+LOD_INTERVAL = 4  # a distant monster acts once every this many turns, making up the moves it skipped
+PATH_BATCH = 4  # routes needed in a turn before they are worked out together on the pathfinding threads
+AI_FRAME_BUDGET = 0.025  # seconds of monster turns per frame; a longer monster phase is drawn as it goes
 BAR_WIDTH = 20
 PANEL_HEIGHT = 7
 PANEL_Y = SCREEN_HEIGHT - PANEL_HEIGHT
@@ -61,10 +104,75 @@ color_dark_wall = libtcod.Color(128, 128, 128)
 color_light_wall = libtcod.Color(130, 110, 50)
 color_dark_ground = libtcod.Color(192, 192, 192)
 color_light_ground = libtcod.Color(200, 180, 50)
+color_dark_rubble = libtcod.Color(150, 140, 130)
+color_light_rubble = libtcod.Color(160, 130, 60)
+color_tint = libtcod.Color(90, 120, 140)
+
+
+def tint_color(color, level):
+    # shade a colour towards color_tint by a terrain tint level (level 0 leaves it unchanged)
+    t = 0.4 * level / TINT_LEVELS
+    return libtcod.Color(int(color.r + (color_tint.r - color.r) * t), int(color.g + (color_tint.g - color.g) * t),
+                         int(color.b + (color_tint.b - color.b) * t))
+
+# (dark, light) ground colours for each terrain tint level
+tint_ground_colors = [(tint_color(color_dark_ground, level), tint_color(color_light_ground, level))
+                      for level in range(TINT_LEVELS)]
+
+# the current level's terrain field from make_terrain, or None when the terrain layer is off
+terrain = None
+
+# the current level's rooms (none for a level saved before they were kept)
+rooms = []
+
+# the open level pack: None until first looked for, False if there isn't one
+level_pack = None
+
+# levels the player has left, and where the player entered the current level
+level_store = None
+level_start = None
+
+# player turns taken this game
+game_turn = 0
+
+# the actors on the current level, by when they next act, and the timed effects on it by when they
+# wear off
+scheduler = None
+timers = None
+
+# monsters left unscheduled until the player comes near, by the index of the room they wait in
+dormant = {}
+
+# the rest of the monster phase still to run, if it overran a frame
+ai_work = None
+
+# the libtcod path every route is worked out with, and the fov_map it was made for; likewise the
+# pathfinding threads
+path_finder = None
+path_pool = None
+
+# the fov_map and the (cost, mask) classes of its terrain, then the fov_map and turn, the classes with
+# this turn's crowd and the distance fields asked for this turn (see cost_field)
+terrain_costs = None
+turn_costs = (None, None, {})
+
+# the journal being written, and the entries still to play back while recovering from a crash
+journal = None
+replay_queue = None
+
+# the seed the current level was generated from (None if unknown), and the cached level_baseline()
+level_seed = None
+baseline_cache = None
 
 
 class Tile:
     # a tile of the map and its properties
+
+    # terrain layer features (see make_terrain). kept on the class too, for tiles saved before there was
+    # a terrain layer
+    rubble = False
+    tint = 0
+
     def __init__(self, blocked, block_sight=None):
         self.blocked = blocked
 
@@ -98,6 +206,16 @@ class Rect:
 class Object:
     # this is a generic object: the player, a monster, an item, the stairs...
     # it's always represented by a character on the screen.
+
+    # how often it acts, if it has an ai: twice as often at double the normal speed
+    speed = hhsched.NORMAL_SPEED
+
+    # timed effects on it (see add_effect)
+    effects = ()
+
+    # the rest of the route move_towards is following, next step last
+    route = None
+
     def __init__(self, x, y, char, name, color, blocks=False, always_visible=False, fighter=None, ai=None, item=None,
                  equipment=None, placeable=None, seen_player=False, killed_by=None):
         self.x = x
@@ -134,6 +252,9 @@ class Object:
         self.seen_player = seen_player
         self.killed_by = killed_by
 
+        # position in the level's spawns when generated, for seed-plus-delta saves
+        self.spawn_id = None
+
 
     def move(self, dx, dy):
         # move by the given amount
@@ -151,21 +272,29 @@ class Object:
         # erase the character that represents this object
         libtcod.console_put_char(con, self.x, self.y, ' ', libtcod.BKGND_NONE)
 
+    def route_usable(self, target_x, target_y):
+        # whether the route kept from before still leads to the target from here
+        route = self.route
+        return bool(route) and (target_x, target_y) in route and libtcod.map_is_walkable(fov_map, *route[-1]) and \
+            max(abs(route[-1][0] - self.x), abs(route[-1][1] - self.y)) == 1
+
     def move_towards(self, target_x, target_y):
-        # create and compute a path for the object to the target
-        path = libtcod.path_new_using_map(fov_map)
-        libtcod.path_compute(path, self.x, self.y, target_x, target_y)
-
-        # get the target coords of the next spot on the path
-        mx, my, = libtcod.path_walk(path, True)
-        if mx is not None:
-            dx = mx - self.x
-            dy = my - self.y
-            self.move(dx, dy)
-            libtcod.path_delete(path)
+        # take the next step of a route to the target. the route is kept between steps, and only
+        # worked out again if the target has moved off it or the object is no longer next to it
+        route = self.route
+        if self.route_usable(target_x, target_y):
+            # (the target may have come part of the way along it)
+            del route[:route.index((target_x, target_y))]
         else:
-            libtcod.path_delete(path)
-            return
+            route = self.route = find_route(self.x, self.y, target_x, target_y)
+            if not route:
+                return
+
+        # step onto the next spot, unless something is in the way
+        (mx, my) = route[-1]
+        self.move(mx - self.x, my - self.y)
+        if (self.x, self.y) == (mx, my):
+            route.pop()
 
     def distance(self, x, y):
         # return the distance to some coordinates
@@ -178,9 +307,14 @@ class Object:
         return math.sqrt(dx ** 2 + dy ** 2)
 
     def send_to_back(self):
-        # make this object be drawn first, so all others appear above it if they're in the same tile
+        # make this object be drawn first, so all others appear above it if they're in the same tile.
+        # it is looked for by identity from the end, where a newly placed item is: objects.remove() would
+        # compare it with every object before it, which is slow for these classes on a crowded level
         global objects
-        objects.remove(self)
+        for i in range(len(objects) - 1, -1, -1):
+            if objects[i] is self:
+                del objects[i]
+                break
         objects.insert(0, self)
 
 
@@ -364,11 +498,7 @@ class Fighter:
 
     def attack(self, target):
         # first check for to hit target, capped at 2 to 20
-        to_hit_target = self.to_hit + target.fighter.armor_class + 5
-        if to_hit_target > 20:
-            to_hit_target = 20
-        elif to_hit_target == 1:
-            to_hit_target = 2
+        to_hit_target = hhodds.to_hit_target(self.to_hit, target.fighter.armor_class)
 
         # check of the target is attacking with a gun
         has_gun = False
@@ -408,6 +538,15 @@ class Fighter:
             message(self.owner.name.title() + ' hits ' + pronoun + target.name + ' but it has no effect!',
                     libtcod.grey)
 
+    def odds_against(self, target):
+        # exact odds of this fighter's attacks against the target, looked up from the odds tables.
+        # returns the get_odds() dict plus 'kill', the get_kill_odds() dict for the target's current hp
+        odds = hhodds.get_odds(self.to_hit, target.fighter.armor_class, self.damage_roll, self.damage,
+                               target.fighter.damage_resistance)
+        result = dict(odds)
+        result['kill'] = hhodds.get_kill_odds(odds, target.fighter.hp)
+        return result
+
     def shoot(self):
         # first check if the character is equipped with a ranged weapon
         has_gun = False
@@ -432,11 +571,7 @@ class Fighter:
             return
 
         # calculate to-hit
-        to_hit_target = self.to_hit + target.fighter.armor_class + 5
-        if to_hit_target > 20:
-            to_hit_target = 20
-        elif to_hit_target == 1:
-            to_hit_target = 2
+        to_hit_target = hhodds.to_hit_target(self.to_hit, target.fighter.armor_class)
 
         # deduct ammo
         gun.ammo -= 1
@@ -479,6 +614,14 @@ class BasicMonster:
             elif player.fighter.hp > 0:
                 monster.fighter.attack(player)
 
+    def path_target(self):
+        # where take_turn will move_towards, if anywhere, as things stand
+        monster = self.owner
+        if (monster.seen_player or libtcod.map_is_in_fov(fov_map, monster.x, monster.y)) and \
+                2 <= monster.distance_to(player) <= 10:
+            return player.x, player.y
+        return None
+
 
 class FriendlyMonster:
     def __init__(self, max_range=10):
@@ -486,34 +629,41 @@ class FriendlyMonster:
 
 
     def take_turn(self):
-        # a monster that protects the player and attacks other monsters
+        # a monster that protects the player and attacks other monsters. it goes for the nearest
+        # hostile monster in the player's view within max_range steps, otherwise follows the player,
+        # down distance fields that every summon shares (see summon_fields)
         monster = self.owner
+        (hostiles, hostile_rings, player_rings) = summon_fields()
+        costs = field_costs()
 
-        enemy = closest_monster(self.max_range, (monster, player))
-
-        if enemy is not None:
+        route = hhgrid.downhill(hostile_rings, costs, monster.x, monster.y, MAP_WIDTH, MAP_HEIGHT, self.max_range)
+        enemy = hostiles.get(route[0]) if route else None
+        if enemy is not None and enemy.fighter:
             message(self.owner.name + ' is targeting ' + enemy.name)
-            if 2 <= monster.distance_to(enemy) <= self.max_range:
-                monster.move_towards(enemy.x, enemy.y)
+            if len(route) >= 2:
+                monster.move(route[-1][0] - monster.x, route[-1][1] - monster.y)
 
-            elif enemy.fighter.hp > 0:
+            elif enemy.fighter.hp > 0 and (enemy.x, enemy.y) == route[0]:
                 monster.fighter.attack(enemy)
         else:
-            monster.move_towards(player.x, player.y)
+            route = hhgrid.downhill(player_rings, costs, monster.x, monster.y, MAP_WIDTH, MAP_HEIGHT, 1)
+            if route:
+                monster.move(route[-1][0] - monster.x, route[-1][1] - monster.y)
 
 
 class ConfusedMonster:
-    # AI for a temporarily confused monster (reverts to normal AI after a while)
+    # AI for a temporarily confused monster. also the timed effect that restores the normal AI
     def __init__(self, old_ai, num_turns=CONFUSE_NUM_TURNS):
         self.old_ai = old_ai
         self.num_turns = num_turns
 
     def take_turn(self):
-        if self.num_turns > 0:  # still confused
-            # move in random direction and decrease confuse duration
-            self.owner.move(libtcod.random_get_int(0, -1, 1), libtcod.random_get_int(0, -1, 1))
-            self.num_turns -= 1
-        else:  # restore previous AI
+        # move in random direction
+        self.owner.move(libtcod.random_get_int(0, -1, 1), libtcod.random_get_int(0, -1, 1))
+
+    def expire(self):
+        # restore previous AI, unless the monster died in the meantime
+        if self.owner.ai is self:
             self.owner.ai = self.old_ai
             message('The ' + self.owner.name + ' is no longer confused!', libtcod.red)
 
@@ -633,8 +783,12 @@ class Confuse:
         if monster is None:
             return 'cancelled'
         old_ai = monster.ai
+        if isinstance(old_ai, ConfusedMonster):
+            # confused all over again: the new confusion replaces the old
+            remove_effect(old_ai)
+            old_ai = old_ai.old_ai
         monster.ai = ConfusedMonster(old_ai, num_turns=self.duration)
-        monster.ai.owner = monster  # tell the new component who owns it
+        add_effect(monster, monster.ai, self.duration)  # also tells the new component who owns it
         message('The eyes of the ' + monster.name + ' look vacant, as he starts to stumble around!', libtcod.light_green)
 
 
@@ -665,6 +819,7 @@ class Summon:
         y = player.y
         summon = get_monster_from_hitdice(x, y, self.name, self.hitdice, self.color, friendly=True)
         objects.append(summon)
+        scheduler.add(summon)
 
 
 class Terminal:
@@ -707,10 +862,13 @@ class Teleporter:
     def use(self):
         global dungeon_level
         message('You feel a sudden jolt and find yourself staring at a completely different room.', libtcod.red)
+        store_level()
         dungeon_level = self.new_level
 
-        make_map()
+        enter_level()
         initialize_fov()
+        if journal is not None:
+            journal.sync()
 
 
 def main_menu(firstrun=False):
@@ -761,7 +919,7 @@ def main_menu(firstrun=False):
 
 
 def new_game(firstrun=False):
-    global player, inventory, game_msgs, game_state, dungeon_level
+    global player, inventory, game_msgs, game_state, dungeon_level, level_store, game_turn
 
     # play intro sequence if starting up
     if firstrun:
@@ -778,9 +936,12 @@ def new_game(firstrun=False):
                     libtcod.white, blocks=True, fighter=fighter_component)
     player.level = 1
 
-    # generate map
+    # generate map, forgetting the levels of any previous game. their files stay until the first save
+    # of this one replaces the save they go with
+    level_store = hhstore.LevelStore(LEVEL_STORE, LEVEL_STORE_BUDGET, {})
     dungeon_level = 1
-    make_map()
+    game_turn = 0
+    enter_level()
     initialize_fov()
 
     game_state = 'playing'
@@ -814,8 +975,12 @@ def initialize_fov():
 
 
 def play_game():
+    global game_turn, ai_work
     player_action = None
 
+    # start the journal from a fresh save
+    save_due = True
+
     mouse = libtcod.Mouse()
     key = libtcod.Key()
     while not libtcod.console_is_window_closed():
@@ -826,74 +991,307 @@ def play_game():
         libtcod.console_flush()
         check_level_up()
 
+        # save once the turn is over and on screen. the save is built and written in the background
+        if save_due:
+            save_game()
+            save_due = False
+
         # erase all objects at old locations before they move
         for object in objects:
             object.clear()
 
         # handle keys and exit game if needed
-        player_action = handle_keys(key, mouse)
+        journal_key(key)
+        player_action = play_turn(key, mouse, AI_FRAME_BUDGET)
+        while ai_work is not None:
+            # a big fight: show it so far, then give the monsters another frame. the key queue is
+            # left alone, and FOV is kept as the monsters are seeing it, so the turn comes out the
+            # same as it would all at once
+            render_all(fov=False)
+            libtcod.console_flush()
+            if libtcod.console_is_window_closed():
+                # (the journal has the key, so the whole turn is played again when the game is loaded)
+                ai_work = None
+                break
+            for object in objects:
+                object.clear()
+            run_ai(AI_FRAME_BUDGET)
+        error = hhsave.pop_error()
+        if error:
+            message('Save failed (' + error + ')', libtcod.red)
         if game_state == 'dead':
             try:
-                os.remove('savegame')
+                delete_save()
             except:
                 break
         elif player_action == 'exit':
             save_game()
+            close_journal()
+            # (on disk before the menu can start another game)
+            hhsave.wait()
             break
+        elif game_state == 'playing' and player_action != 'didnt-take-turn':
+            if journal is not None:
+                journal.flush()
+
+            # autosave every so often
+            if game_turn % AUTOSAVE_TURNS == 0:
+                save_due = True
+
+
+def play_turn(key, mouse, budget=None):
+    # the player acts on a key press, then the monsters take their turn. returns the player's action.
+    # with a budget, the monster phase stops after that many seconds and the rest is left in ai_work
+    # for run_ai() to finish
+    global ai_work
+    player_action = handle_keys(key, mouse)
+
+    # let the monsters that are due take their turn
+    if game_state == 'playing' and player_action not in ('didnt-take-turn', 'exit'):
+        ai_work = monster_phase()
+        run_ai(budget)
+
+    return player_action
+
+
+def monster_phase():
+    # the monsters' turns, one at a time: a generator that yields after each monster
+    global game_turn
+    wake_rooms()
+    actors = list(scheduler.advance())
+    plan_routes(actors)
+    for object in actors:
+        if object.ai is None:
+            # (killed earlier in the phase)
+            continue
+        if object.distance_to(player) > LOD_DISTANCE:
+            far_turn(object)
+        else:
+            object.ai.take_turn()
+        yield
+    game_turn += 1
+    expire_effects()
+
+
+def run_ai(budget=None):
+    # carry on with the monster phase for up to budget seconds (or to the end). returns True once the
+    # phase is over
+    global ai_work
+    deadline = None if budget is None else time.time() + budget
+    try:
+        while True:
+            next(ai_work)
+            if deadline is not None and time.time() >= deadline:
+                return False
+    except StopIteration:
+        ai_work = None
+        return True
+
+
+def journal_key(key):
+    # reset the dice to a new seed and journal it with the key press, so the turn can be played back
+    if journal is None or key.vk == libtcod.KEY_NONE or key.vk == libtcod.KEY_ESCAPE or key.lalt:
+        return
+    if key.vk == libtcod.KEY_CHAR and chr(key.c) in JOURNAL_SKIP_KEYS:
+        return
+    seed = random.getrandbits(32)
+    hhtable.seed_rng(seed)
+    journal.record_key(seed, key)
+
+
+def start_journal(save_id):
+    # begin a new journal following on from a save, with the dice reset to a seed it records
+    global journal
+    close_journal()
+    seed = random.getrandbits(32)
+    hhtable.seed_rng(seed)
+    journal = hhjournal.Journal(JOURNAL_FILE, save_id, seed)
+
+
+def close_journal():
+    global journal
+    if journal is not None:
+        journal.close()
+        journal = None
+
+
+def replay_journal(save_id):
+    # play back the journal written after save `save_id`, if there is one, to recover from a crash.
+    # stops early if the game no longer asks for what the journal recorded
+    global replay_queue
+    found = hhjournal.read_journal(JOURNAL_FILE, save_id)
+    if found is None:
+        return
+    (seed, entries) = found
+
+    hhtable.seed_rng(seed)
+    hhmessage.quiet = True
+    replay_queue = collections.deque(entries)
+    mouse = libtcod.Mouse()
+    try:
+        while replay_queue and game_state == 'playing':
+            # (drawn off screen, but this is also where FOV and explored tiles are updated)
+            render_all()
+            check_level_up()
+            (tag, values) = replay_queue.popleft()
+            if tag != b'K':
+                break
+            (seed, vk, c, lalt) = values
+            key = libtcod.Key()
+            (key.vk, key.c, key.lalt) = (vk, c, bool(lalt))
+            hhtable.seed_rng(seed)
+            play_turn(key, mouse)
+        if game_state == 'playing':
+            render_all()
+            check_level_up()
+    except ReplayMismatch:
+        pass
+    finally:
+        replay_queue = None
+        hhmessage.quiet = False
 
-        # let monsters take their turn
-        if game_state == 'playing' and player_action != 'didnt-take-turn':
-            for object in objects:
-                if object.ai:
-                    object.ai.take_turn()
+
+class ReplayMismatch(Exception):
+    # the game asked for a different kind of input than the journal has next
+    pass
+
+
+def replay_input(tag):
+    # the next recorded menu choice ('M') or target ('T') while the journal is played back
+    if not replay_queue or replay_queue[0][0] != tag:
+        raise ReplayMismatch()
+    return replay_queue.popleft()[1]
+
+
+def delete_save():
+    # the game is over: remove the save and its journal
+    close_journal()
+    if os.path.isfile(JOURNAL_FILE):
+        os.remove(JOURNAL_FILE)
+    hhsave.remove('savegame')
 
 
 def save_game():
-    # open a new empty shelve (possibly rewriting old one) to write the game data
-    file = shelve.open('savegame', 'n')
-    file['map'] = map
-    file['objects'] = objects
-    file['player_index'] = objects.index(player)
+    # hand a save to the background writer. what it is built from is copied here first (see
+    # copy_game), which takes a few milliseconds, and the writer builds the save from the copy, pickles
+    # and compresses it and replaces the savegame file once the new one is completely written, while the
+    # game carries on
+    save_id = random.SystemRandom().getrandbits(32)
+    state = copy_game()
+
+    # the levels left behind belong with the save: any departed since the last one are written to
+    # files of their own first, and the files only the last save needs go once this one is in place
+    store = level_store
+    (writes, state['level_files'], stale) = store.commit(save_id)
+
+    def done():
+        store.written(writes)
+        hhstore.remove_files(stale)
+
+    hhsave.save('savegame', lambda: (save_entries(save_id, state), writes, done))
+
+    # the journal starts over from this save
+    start_journal(save_id)
+
+
+def copy_game():
+    # everything a save is built from, copied so the game can go on changing while the writer builds
+    # it: the tiles' fields, and the objects in one pickle, so that an object in more than one place
+    # (the player, the stairs, items in the inventory) is still one object in the copy. the rest is
+    # replaced rather than changed in place as the game goes on
+    baseline = None
+    if SAVE_ENCODING == 'delta' and level_seed is not None:
+        baseline = level_baseline()
+    return {'tiles': [[(tile.blocked, tile.block_sight, tile.explored, tile.rubble, tile.tint) for tile in column]
+                      for column in map],
+            'objects': cPickle.dumps((objects, player, stairs, inventory, game_msgs, rooms), 2),
+            'baseline': baseline,
+            'level_seed': level_seed,
+            'game_state': game_state,
+            'dungeon_level': dungeon_level,
+            'level_start': level_start,
+            'game_turn': game_turn,
+            'schedule': scheduler.state(objects)}
+
+
+def save_entries(save_id, state):
+    # the entries of a save, from a copy_game(). runs on the writer thread
+    (objects, player, stairs, inventory, game_msgs, rooms) = cPickle.loads(state['objects'])
+    level_map = [[copy_tile(*fields) for fields in column] for column in state['tiles']]
+    file = {}
+    if state['baseline'] is not None:
+        # the level is generated again from its seed on load, so only the changes are saved
+        file['level'] = encode_level_delta(level_map, objects, player, stairs, rooms, state['level_seed'],
+                                           state['baseline'])
+        file['player'] = player
+    else:
+        file['map'] = level_map
+        file['objects'] = objects
+        file['player_index'] = objects.index(player)
+        file['stairs_index'] = objects.index(stairs)
+        file['rooms'] = rooms
+        file['level_seed'] = state['level_seed']
     file['inventory'] = inventory
     file['game_msgs'] = game_msgs
-    file['game_state'] = game_state
-    file['stairs_index'] = objects.index(stairs)
-    file['dungeon_level'] = dungeon_level
-    file.close()
+    for name in ('game_state', 'dungeon_level', 'level_start', 'game_turn', 'schedule', 'level_files'):
+        file[name] = state[name]
+    file['save_id'] = save_id
+    return file
+
+
+def copy_tile(blocked, block_sight, explored, rubble, tint):
+    tile = Tile(blocked, block_sight)
+    tile.explored = explored
+    (tile.rubble, tile.tint) = (rubble, tint)
+    return tile
 
 
 def load_game():
     # open the previous saved shelve and load the game data
-    global map, objects, player, inventory, game_msgs, game_state, stairs, dungeon_level
+    global map, objects, player, inventory, game_msgs, game_state, stairs, dungeon_level, level_store, level_start
+    global rooms, level_seed, game_turn
 
-    file = shelve.open('savegame', 'r')
-    map = file['map']
-    objects = file['objects']
-    player = objects[file['player_index']]  # get index of player in objects list and access it
+    file = hhsave.open_save('savegame') or shelve.open('savegame', 'r')
+    dungeon_level = file['dungeon_level']
+    if 'level' in file:
+        player = file['player']
+        decode_level_delta(file['level'])
+    else:
+        map = file['map']
+        objects = file['objects']
+        player = objects[file['player_index']]  # get index of player in objects list and access it
+        stairs = objects[file['stairs_index']]
+        rooms = file['rooms'] if 'rooms' in file else []
+        level_seed = file['level_seed'] if 'level_seed' in file else None
+        prepare_baseline()
     inventory = file['inventory']
     game_msgs = file['game_msgs']
     game_state = file['game_state']
-    stairs = objects[file['stairs_index']]
-    dungeon_level = file['dungeon_level']
+    level_start = file['level_start'] if 'level_start' in file else (player.x, player.y)
+    game_turn = file['game_turn'] if 'game_turn' in file else 0
+    schedule_level(file['schedule'] if 'schedule' in file else None)
+    save_id = file['save_id'] if 'save_id' in file else None
+    level_files = file['level_files'] if 'level_files' in file else None
     file.close()
 
+    level_store = hhstore.LevelStore(LEVEL_STORE, LEVEL_STORE_BUDGET, level_files)
+
     initialize_fov()
 
+    # catch up on anything played after the save, if the game crashed
+    if save_id is not None:
+        replay_journal(save_id)
+
 
 def new_score(player):
     # generate a new score from player and dungeon_level, save it to file, then ask to display it.
     score = player.fighter.kills * player.level * dungeon_level
     score_data = [score, player.name.title(), player.killed_by, str(dungeon_level)]
 
-    scores = shelve.open('scorefile', 'c', writeback=True)
-    if 'scores' in scores:
-        list = scores['scores']
-        list.append(score_data)
-        scores['scores'] = list
-    else:
-        new_list = [score_data]
-        scores['scores'] = new_list
-    scores.close()
+    error = hhleader.record(score_data)
+    if error:
+        message('Could not record the run: ' + error, libtcod.red)
+    hhscore.add_score(score_data)
 
     choice = menu('Game Over\n', ['See your score', 'Return to main menu'], 22)
     if choice == 0:
@@ -901,10 +1299,10 @@ def new_score(player):
 
 
 def show_scores():
-    # load the score file, sort the list by score, then display
-    score_file = shelve.open('scorefile', 'r')
-    scores = score_file['scores']
-    scores.sort(key=operator.itemgetter(0), reverse=True)
+    # load the best scores from the score index, then display
+    scores = hhscore.top_scores(11)
+    if not scores:
+        raise ValueError('no high scores')
     score_list = ['High Scores']
     c = 0
     for i in scores:
@@ -915,8 +1313,6 @@ def show_scores():
         if c > 10:
             break
 
-    score_file.close()
-
     hhmessage.show_text_log(score_list, hhmessage.generate_starpic(), delay=False, center_first_line=True)
 
 
@@ -935,7 +1331,7 @@ def end_game():
     ]
 
     hhmessage.show_text_log(ending, hhmessage.generate_starpic())
-    os.remove('savegame')
+    delete_save()
     main_menu()
 
 
@@ -1041,6 +1437,18 @@ def handle_keys(key, mouse):
 def target_tile(max_range=None):
     # return the position of a tile left-clicked in player FOV (optionally in a range)
     # or return (None,None) if right clicked
+    if replay_queue is not None:
+        (x, y) = replay_input(b'T')
+        return (None, None) if x < 0 else (x, y)
+
+    (x, y) = pick_tile(max_range)
+    if journal is not None:
+        journal.record_target(x, y)
+    return x, y
+
+
+def pick_tile(max_range=None):
+    # let the player click a tile for target_tile
     key = libtcod.Key()
     mouse = libtcod.Mouse()
     while True:
@@ -1420,8 +1828,557 @@ def place_objects(room):
             item.send_to_back()  # items appear below other objects
 
 
-def make_map():
-    global map, objects, stairs
+def store_level():
+    # keep the level the player is leaving in the level store, for when they come back
+    if level_store is None:
+        return
+    level_store.put(dungeon_level, hhpack.encode_level(level_seed, dungeon_level, map, objects, player, stairs,
+                                                       rooms, start=level_start))
+
+
+def enter_level():
+    # set up the level for dungeon_level: restored from the level store if the player has been here
+    # before, loaded from the level pack if it has one, otherwise generated
+    global level_pack, level_start, level_seed, baseline_cache
+    if level_store is not None:
+        data = level_store.take(dungeon_level)
+        if data is not None and load_pack_level(hhpack.decode_level(data, globals())):
+            level_start = (player.x, player.y)
+            schedule_level()
+            prepare_baseline()
+            return
+
+    if level_pack is None:
+        level_pack = False
+        if os.path.isfile(LEVEL_PACK):
+            try:
+                level_pack = hhpack.LevelPack(LEVEL_PACK)
+            except (IOError, ValueError):
+                pass
+
+    if not level_pack or not load_pack_level(level_pack.read(dungeon_level, globals())):
+        level_seed = random.getrandbits(31)
+        make_seeded_map(level_seed)
+        # measured now, while it's at hand, rather than generated again on the first save
+        baseline_cache = ((level_seed, dungeon_level), measure_baseline())
+    else:
+        prepare_baseline()
+    level_start = (player.x, player.y)
+    schedule_level()
+
+
+def schedule_level(state=None):
+    # start scheduling the actors on the level, from a saved scheduler state if there is one, and the
+    # timed effects on everything in it. monsters that haven't seen the player yet lie dormant in
+    # their rooms, costing nothing, until wake_rooms() finds the player near
+    global scheduler, timers, dormant
+    if state is not None:
+        scheduler = hhsched.restore(state, objects)
+    else:
+        scheduler = hhsched.Scheduler()
+
+    dormant = {}
+    for object in objects:
+        if not object.ai or object in scheduler:
+            continue
+        # (a saved scheduler already holds every monster that was awake)
+        room = None
+        if state is not None or (isinstance(object.ai, BasicMonster) and not object.seen_player):
+            room = room_at(object.x, object.y)
+        if room is None:
+            scheduler.add(object)
+        else:
+            dormant.setdefault(room, []).append(object)
+
+    timers = hhtimer.TimerWheel(game_turn)
+    for object in objects:
+        if isinstance(object.ai, ConfusedMonster) and object.ai not in object.effects:
+            # (confused in a game saved before confusion was a timed effect)
+            add_effect(object, object.ai, object.ai.num_turns)
+        for effect in object.effects:
+            timers.schedule(effect.expires, effect)
+
+
+def room_at(x, y):
+    # index of the room whose floor x, y is on, or None
+    for (index, room) in enumerate(rooms):
+        if room.x1 < x < room.x2 and room.y1 < y < room.y2:
+            return index
+    return None
+
+
+def wake_rooms():
+    # schedule the dormant monsters of every room the player is in or can see into. only rooms in
+    # torch range can be, so the rest cost a distance check
+    for index in list(dormant):
+        room = rooms[index]
+        dx = max(room.x1 - player.x, 0, player.x - room.x2)
+        dy = max(room.y1 - player.y, 0, player.y - room.y2)
+        if dx > TORCH_RADIUS or dy > TORCH_RADIUS:
+            continue
+        monsters = dormant[index]
+        if not (dx == 0 and dy == 0) and not libtcod.map_is_in_fov(fov_map, *room.center()) and \
+                not any(libtcod.map_is_in_fov(fov_map, monster.x, monster.y) for monster in monsters):
+            continue
+        del dormant[index]
+        for monster in monsters:
+            if monster.ai:
+                scheduler.add(monster)
+
+
+def find_route(x, y, target_x, target_y):
+    # the A* route from x, y to the target as a list of steps, next step last (empty if there isn't
+    # one). one path object is kept for the level and used for every route
+    global path_finder
+    costs = movement_costs()
+    if costs is not None:
+        rings = cost_field((target_x, target_y), hhgrid.bit(MAP_WIDTH, target_x, target_y))
+        return hhgrid.downhill(rings, costs, x, y, MAP_WIDTH, MAP_HEIGHT)
+
+    if path_finder is None or path_finder[0] is not fov_map:
+        if path_finder is not None:
+            libtcod.path_delete(path_finder[1])
+        path_finder = (fov_map, libtcod.path_new_using_map(fov_map))
+    return hhpath.route(path_finder[1], x, y, target_x, target_y)
+
+
+def field_costs():
+    # this turn's (cost, mask) classes for finding a way across the level: every floor tile costs 1,
+    # unless the level has rubble, which costs RUBBLE_COST, along with the tiles creatures stood on
+    # at the start of the turn costing CROWD_COST
+    global terrain_costs, turn_costs
+    if terrain_costs is None or terrain_costs[0] is not fov_map:
+        floor = hhgrid.full(MAP_WIDTH, MAP_HEIGHT) & ~tile_mask('blocked')
+        rubble = tile_mask('rubble')
+        if rubble:
+            terrain_costs = (fov_map, [(1, floor & ~rubble), (RUBBLE_COST, floor & rubble)])
+        else:
+            terrain_costs = (fov_map, [(1, floor)])
+
+    if turn_costs[0] != (fov_map, game_turn):
+        costs = terrain_costs[1]
+        if len(costs) > 1:
+            crowd = 0
+            for object in objects:
+                if object.blocks:
+                    crowd |= hhgrid.bit(MAP_WIDTH, object.x, object.y)
+            crowd &= costs[0][1] | costs[1][1]
+            costs = [(cost, mask & ~crowd) for (cost, mask) in costs] + [(CROWD_COST, crowd)]
+        turn_costs = ((fov_map, game_turn), costs, {})
+    return turn_costs[1]
+
+
+def movement_costs():
+    # field_costs(), or None if every step costs the same and libtcod's A* will do
+    costs = field_costs()
+    if len(costs) == 1:
+        return None
+    return costs
+
+
+def cost_field(key, start):
+    # hhgrid.weighted_distance() rings to the start tiles over field_costs(). worked out once a turn
+    # per key and shared by everything heading there, so a crowd chasing the player costs one search
+    # between them
+    costs = field_costs()
+    fields = turn_costs[2]
+    if key not in fields:
+        fields[key] = hhgrid.weighted_distance(costs, start, MAP_WIDTH, MAP_HEIGHT)
+    return fields[key]
+
+
+def summon_fields():
+    # (hostile monsters in the player's view by tile, cost_field() rings to the nearest of them, rings
+    # to the player) for this turn. worked out for the first summon to act and read by the rest
+    costs = field_costs()
+    fields = turn_costs[2]
+    if 'hostiles' not in fields:
+        hostiles = {}
+        start = 0
+        for object in objects:
+            ai = object.ai
+            if isinstance(ai, ConfusedMonster):
+                ai = ai.old_ai
+            if object.fighter and object is not player and not isinstance(ai, FriendlyMonster) and \
+                    libtcod.map_is_in_fov(fov_map, object.x, object.y):
+                hostiles[(object.x, object.y)] = object
+                start |= hhgrid.bit(MAP_WIDTH, object.x, object.y)
+        fields['hostiles'] = (hostiles, hhgrid.weighted_distance(costs, start, MAP_WIDTH, MAP_HEIGHT))
+    (hostiles, rings) = fields['hostiles']
+    return hostiles, rings, cost_field((player.x, player.y), hhgrid.bit(MAP_WIDTH, player.x, player.y))
+
+
+def plan_routes(actors):
+    # work out the routes the monsters about to act will want, all at once (on the pathfinding threads
+    # if there are enough of them), so each finds its route already there when it moves, then plan
+    # their steps around each other. a monster whose plans change by the time it acts just works its
+    # route out again
+    global path_pool
+    # (a fast monster acting twice is planned for its first action)
+    planned = set()
+    movers = []
+    wanted = []
+    for object in actors:
+        path_target = getattr(object.ai, 'path_target', None)
+        if path_target is None or object.distance_to(player) > LOD_DISTANCE:
+            continue
+        target = path_target()
+        if target is None or object in planned:
+            continue
+        planned.add(object)
+        movers.append(object)
+        if not object.route_usable(*target):
+            wanted.append((object, target))
+
+    requests = [(object.x, object.y) + target for (object, target) in wanted]
+    if len(wanted) < PATH_BATCH or hhpath.WORKERS < 2 or movement_costs() is not None:
+        # (weighted routes come from the shared cost fields instead)
+        routes = [find_route(*request) for request in requests]
+    else:
+        if path_pool is None or path_pool[0] is not fov_map:
+            if path_pool is not None:
+                path_pool[1].close()
+            path_pool = (fov_map, hhpath.PathPool(fov_map, MAP_WIDTH, MAP_HEIGHT))
+        routes = path_pool[1].routes(requests)
+    for ((object, target), route) in zip(wanted, routes):
+        object.route = route
+
+    plan_steps(movers)
+
+
+# the eight steps a monster can take, in the order plan_steps tries them
+STEPS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+
+
+def plan_steps(movers):
+    # reserve the tiles the monsters with routes will step onto, in the order they act, so that none
+    # plans a step onto a tile another is still standing on at that point in the turn, or will have
+    # moved onto by then. a monster whose next step is taken sidesteps to a free tile that is just as
+    # far along its route, rather than bumping into the other and wasting its turn; failing that it
+    # waits, as it would have anyway
+    taken = set((object.x, object.y) for object in objects if object.blocks)
+    for object in movers:
+        route = object.route
+        if not route:
+            continue
+        (x, y) = route[-1]
+        if (x, y) in taken and len(route) >= 2:
+            (after_x, after_y) = route[-2]
+            for (dx, dy) in STEPS:
+                (side_x, side_y) = (object.x + dx, object.y + dy)
+                if (side_x, side_y) not in taken and max(abs(side_x - after_x), abs(side_y - after_y)) == 1 and \
+                        0 <= side_x < MAP_WIDTH and 0 <= side_y < MAP_HEIGHT and not map[side_x][side_y].blocked:
+                    (x, y) = (side_x, side_y)
+                    route[-1] = (x, y)
+                    break
+        if (x, y) not in taken and object.blocks:
+            taken.discard((object.x, object.y))
+            taken.add((x, y))
+
+
+def far_turn(monster):
+    # the coarse turn of a monster far from the player: instead of its full take_turn it acts once
+    # every LOD_INTERVAL turns, and anything heading for the player walks that many steps of the
+    # shared route. the player can't close LOD_INTERVAL turns' worth of distance quickly enough to
+    # see it happen, since LOD_DISTANCE is twice the torch radius
+    scheduler.add(monster, hhsched.action_delay(monster) * LOD_INTERVAL)
+    if isinstance(monster.ai, BasicMonster):
+        # it can't see the player from there, so only one that already has comes closer
+        if monster.seen_player:
+            walk_route(monster, LOD_INTERVAL)
+    elif isinstance(monster.ai, FriendlyMonster):
+        # no enemy is in the player's view that far off, so it catches up with the player
+        walk_route(monster, LOD_INTERVAL)
+    else:
+        monster.ai.take_turn()
+
+
+def walk_route(monster, steps):
+    # move a monster up to `steps` steps towards the player down this turn's cost_field() to the
+    # player, which everything heading for the player shares
+    rings = cost_field((player.x, player.y), hhgrid.bit(MAP_WIDTH, player.x, player.y))
+    for (x, y) in reversed(hhgrid.downhill(rings, field_costs(), monster.x, monster.y, MAP_WIDTH, MAP_HEIGHT,
+                                           steps)):
+        if is_blocked(x, y):
+            return
+        monster.move(x - monster.x, y - monster.y)
+
+
+def add_effect(object, effect, turns):
+    # put a timed effect on an object. an effect is a component with an expire() method, which is
+    # called once `turns` turns have passed
+    effect.owner = object
+    effect.expires = game_turn + turns
+    if not object.effects:
+        object.effects = []
+    object.effects.append(effect)
+    timers.schedule(effect.expires, effect)
+
+
+def remove_effect(effect):
+    # take an effect off before it wears off; it is never expired
+    if effect in effect.owner.effects:
+        effect.owner.effects.remove(effect)
+
+
+def expire_effects():
+    # wear off the effects that are due this turn
+    for effect in timers.advance(game_turn):
+        if effect in effect.owner.effects:
+            effect.owner.effects.remove(effect)
+            effect.expire()
+
+
+def make_seeded_map(seed, validate=True):
+    # generate the level for dungeon_level from a seed, the same way every time, and number its spawns.
+    # the game's own dice carry on afterwards from a seed drawn beforehand, not from the level's seed
+    next_seed = random.getrandbits(32)
+    (player.x, player.y) = (0, 0)  # keep the player's last position from blocking a spawn
+    hhtable.seed_rng(seed)
+    make_map(validate)
+    for (spawn_id, obj) in enumerate(obj for obj in objects if obj is not player):
+        obj.spawn_id = spawn_id
+    hhtable.seed_rng(next_seed)
+
+
+def tile_mask(attribute, level_map=None):
+    # hhgrid bitmask of the tiles where a Tile attribute is set, in the current map or level_map
+    if level_map is None:
+        level_map = map
+    return hhgrid.pack([[getattr(level_map[x][y], attribute) for x in range(MAP_WIDTH)] for y in range(MAP_HEIGHT)],
+                       MAP_WIDTH)
+
+
+def tile_tints(level_map=None):
+    # every tile's terrain tint, a byte each, row by row (as hhpack stores them)
+    if level_map is None:
+        level_map = map
+    return bytes(bytearray(level_map[x][y].tint for y in range(MAP_HEIGHT) for x in range(MAP_WIDTH)))
+
+
+def measure_baseline():
+    # the current level's (blocked, block_sight, rubble) masks and tints, copies of its spawns by
+    # spawn_id, and a checksum of both. taken straight after generation, this is what a seed-plus-delta
+    # save is relative to
+    tiles = (tile_mask('blocked'), tile_mask('block_sight'), tile_mask('rubble'), tile_tints())
+    spawns = [obj for obj in objects if obj is not player]
+    return tiles, pickle.loads(pickle.dumps(spawns, 2)), level_checksum(tiles, spawns)
+
+
+def level_checksum(tiles, spawns):
+    # crc32 of measure_baseline()'s tiles and the name, position and hit points of each spawn. (not of
+    # a pickle of the spawns, which can change without the level changing)
+    fields = [(obj.name, obj.x, obj.y, obj.fighter and obj.fighter.hp) for obj in spawns]
+    return zlib.crc32(tiles[3], zlib.crc32(repr((tiles[:3], fields)).encode('ascii'))) & 0xffffffff
+
+
+def same_state(a, b, seen=None):
+    # deep comparison of two objects' attributes, components included, for telling spawns that are
+    # still as generated from ones that changed. (pickles can't be compared: loading one changes
+    # which strings are shared, so an unchanged object can pickle differently)
+    if seen is None:
+        seen = set()
+    if isinstance(a, libtcod.Color) or not hasattr(a, '__dict__') or callable(a):
+        if isinstance(a, (list, tuple)):
+            return (type(a) is type(b) and len(a) == len(b) and
+                    all(same_state(x, y, seen) for (x, y) in zip(a, b)))
+        return type(a) is type(b) and a == b
+
+    if a.__class__ is not b.__class__:
+        return False
+    if (id(a), id(b)) in seen:
+        return True  # (back references from components to their owner)
+    seen.add((id(a), id(b)))
+    (da, db) = (vars(a), vars(b))
+    return sorted(da) == sorted(db) and all(same_state(da[k], db[k], seen) for k in da)
+
+
+def prepare_baseline():
+    # work out level_baseline() for a level that wasn't just generated, if saves will need it. it
+    # generates the level again, so it is done here, at a level change, rather than holding up the
+    # first save
+    if SAVE_ENCODING == 'delta' and level_seed is not None:
+        level_baseline()
+
+
+def level_baseline():
+    # measure_baseline() for the current level as generated from level_seed. the level is generated
+    # again off to the side, leaving the level in play and the game's dice as they were
+    global map, objects, stairs, rooms, terrain, baseline_cache
+    key = (level_seed, dungeon_level)
+    if baseline_cache is not None and baseline_cache[0] == key:
+        return baseline_cache[1]
+
+    saved = (map, objects, stairs, rooms, terrain, player.x, player.y)
+    rng = hhtable.save_rng()
+    try:
+        make_seeded_map(level_seed)
+        baseline = measure_baseline()
+    finally:
+        (map, objects, stairs, rooms, terrain, player.x, player.y) = saved
+        hhtable.restore_rng(rng)
+
+    baseline_cache = (key, baseline)
+    return baseline
+
+
+def encode_level_delta(level_map, objects, player, stairs, rooms, seed, baseline):
+    # a level as its seed plus what changed since it was generated, which gave the level_baseline()
+    # `baseline`
+    ((blocked, opaque, rubble, tints), spawns, checksum) = baseline
+    level_tints = tile_tints(level_map)
+
+    # objects in drawing order: a spawn_id for a spawn that is still as generated, -1 for the player,
+    # or -2 for the next object in `changed` (spawns that moved, were hurt and so on, and new objects)
+    order = []
+    changed = []
+    for obj in objects:
+        if obj is player:
+            order.append(-1)
+            continue
+        spawn_id = getattr(obj, 'spawn_id', None)
+        if spawn_id is not None and spawn_id < len(spawns) and same_state(obj, spawns[spawn_id]):
+            order.append(spawn_id)
+        else:
+            order.append(-2)
+            changed.append(obj)
+
+    return {'seed': seed,
+            'checksum': checksum,
+            'blocked': blocked ^ tile_mask('blocked', level_map),
+            'opaque': opaque ^ tile_mask('block_sight', level_map),
+            'rubble': rubble ^ tile_mask('rubble', level_map),
+            'tints': None if level_tints == tints else level_tints,
+            'explored': tile_mask('explored', level_map),
+            'order': order,
+            'changed': changed,
+            'stairs_index': objects.index(stairs),
+            'rooms': [(room.x1, room.y1, room.x2 - room.x1, room.y2 - room.y1) for room in rooms]}
+
+
+def decode_level_delta(delta):
+    # generate the level again from a saved seed and apply encode_level_delta()'s changes to it.
+    # raises ValueError if the level generated doesn't match the one that was saved
+    global objects, stairs, rooms, level_seed, baseline_cache
+    (x, y) = (player.x, player.y)
+    level_seed = delta['seed']
+    make_seeded_map(level_seed)
+    (player.x, player.y) = (x, y)
+
+    baseline = measure_baseline()
+    checksum = baseline[2]
+    if 'tints' not in delta:
+        # (saves from before tints were saved have a checksum of the masks and a pickle of the spawns)
+        spawns = [obj for obj in objects if obj is not player]
+        checksum = zlib.crc32(repr(baseline[0][:3]).encode('ascii') + pickle.dumps(spawns, 2)) & 0xffffffff
+    if checksum != delta['checksum']:
+        raise ValueError('saved level does not match the level generated from its seed')
+    baseline_cache = ((level_seed, dungeon_level), baseline)
+
+    for (attribute, key) in (('blocked', 'blocked'), ('block_sight', 'opaque'), ('rubble', 'rubble')):
+        for (tx, ty) in hhgrid.tiles(delta[key], MAP_WIDTH):
+            setattr(map[tx][ty], attribute, not getattr(map[tx][ty], attribute))
+    if delta.get('tints') is not None:
+        tints = bytearray(delta['tints'])
+        for tx in range(MAP_WIDTH):
+            for ty in range(MAP_HEIGHT):
+                map[tx][ty].tint = tints[ty * MAP_WIDTH + tx]
+    for (tx, ty) in hhgrid.tiles(delta['explored'], MAP_WIDTH):
+        map[tx][ty].explored = True
+
+    spawned = dict((obj.spawn_id, obj) for obj in objects if obj is not player)
+    changed = iter(delta['changed'])
+    objects = []
+    for entry in delta['order']:
+        if entry == -1:
+            objects.append(player)
+        elif entry == -2:
+            objects.append(next(changed))
+        else:
+            objects.append(spawned[entry])
+    stairs = objects[delta['stairs_index']]
+    rooms = [Rect(*room) for room in delta['rooms']]
+
+
+def load_pack_level(record):
+    # put a level pack record in place of a generated level. returns False if it can't be used
+    global map, objects, stairs, rooms, terrain, level_seed
+    if record is None or record['size'] != (MAP_WIDTH, MAP_HEIGHT):
+        return False
+    level_seed = record['seed']
+
+    (blocked, opaque, tints) = hhpack.level_rows(record)
+    map = [[Tile(blocked[y][x], opaque[y][x]) for y in range(MAP_HEIGHT)] for x in range(MAP_WIDTH)]
+    if tints is not None:
+        for x in range(MAP_WIDTH):
+            for y in range(MAP_HEIGHT):
+                map[x][y].tint = tints[y][x]
+    for (x, y) in hhgrid.tiles(record['rubble'], MAP_WIDTH):
+        map[x][y].rubble = True
+    for (x, y) in hhgrid.tiles(record.get('explored', 0), MAP_WIDTH):
+        map[x][y].explored = True
+    terrain = None
+
+    rooms = [Rect(*room) for room in record['rooms']]
+    (player.x, player.y) = record['start']
+    objects = [player] + record['objects']
+    stairs = record['objects'][record['stairs_index']]
+    return True
+
+
+def make_map(validate=True):
+    # generate a new level. unless validate is off, levels where a room is cut off are repaired, and
+    # levels where the stairs still can't be reached are thrown away and generated again
+    global terrain
+    for attempt in range(MAP_ATTEMPTS):
+        terrain = make_terrain() if TERRAIN_LAYER else None
+        if MAP_GENERATOR == 'bsp':
+            make_bsp_map()
+        elif MAP_GENERATOR == 'caves':
+            make_cave_map()
+        else:
+            make_room_map()
+        if terrain is not None:
+            apply_terrain(terrain)
+        if not validate or not check_map(repair=True):
+            return
+
+
+def make_terrain():
+    # precompute this level's terrain field, heights from 0 to 1 stored row by row (index y * width + x).
+    # the fractal noise is summed into a libtcod heightmap by a single call, and the whole field is then
+    # copied out of the heightmap's value array at once, so no python code runs per tile
+    noise = libtcod.noise_new(2)
+    hm = libtcod.heightmap_new(MAP_WIDTH, MAP_HEIGHT)
+    libtcod.heightmap_add_fbm(hm, noise, float(MAP_WIDTH) / TERRAIN_FEATURE_SIZE,
+                              float(MAP_HEIGHT) / TERRAIN_FEATURE_SIZE, 0, 0, TERRAIN_OCTAVES, 0, 1)
+    libtcod.heightmap_normalize(hm)
+    field = hm.p.contents.values[0:MAP_WIDTH * MAP_HEIGHT]
+    libtcod.heightmap_delete(hm)
+    libtcod.noise_delete(noise)
+    return field
+
+
+def terrain_mask(field, level):
+    # hhgrid bitmask of the tiles whose terrain height is above level
+    return hhgrid.pack([[v > level for v in field[y * MAP_WIDTH:(y + 1) * MAP_WIDTH]] for y in range(MAP_HEIGHT)],
+                       MAP_WIDTH)
+
+
+def apply_terrain(field):
+    # set every tile's lighting tint from the terrain field and mark rubble on high floor
+    top = TINT_LEVELS - 1
+    tints = [min(int(v * TINT_LEVELS), top) for v in field]
+    for x in range(MAP_WIDTH):
+        column = map[x]
+        for y in range(MAP_HEIGHT):
+            column[y].tint = tints[y * MAP_WIDTH + x]
+    for (x, y) in hhgrid.tiles(terrain_mask(field, RUBBLE_LEVEL) & map_mask(), MAP_WIDTH):
+        map[x][y].rubble = True
+
+
+def make_room_map():
+    global map, objects, stairs, rooms
 
     # the list of objects with just the player
     objects = [player]
@@ -1431,7 +2388,7 @@ def make_map():
             for y in range(MAP_HEIGHT)]
            for x in range(MAP_WIDTH)]
 
-    # create two rooms
+    # the rooms carved so far, kept after generation for level analysis
     rooms = []
     num_rooms = 0
 
@@ -1498,6 +2455,188 @@ def make_map():
     stairs.send_to_back()  # so it draws below monsters
 
 
+def make_bsp_map():
+    # generate a level by splitting the map into a BSP tree, putting one room in every leaf and joining
+    # sibling subtrees with tunnels. every room fits its leaf, so there is no trial and rejection
+    global map, objects, stairs, rooms
+
+    # the list of objects with just the player
+    objects = [player]
+
+    # fill map with "blocked" tiles
+    map = [[Tile(True)
+            for y in range(MAP_HEIGHT)]
+           for x in range(MAP_WIDTH)]
+
+    rooms = []
+    subtree_rooms = {}  # rooms in each node's subtree, keyed by the node's rectangle
+
+    def node_key(node):
+        return node.x, node.y, node.w, node.h
+
+    def carve_node(node, data):
+        if libtcod.bsp_is_leaf(node):
+            # a random room that fits inside the leaf
+            w = libtcod.random_get_int(0, ROOM_MIN_SIZE, min(ROOM_MAX_SIZE, node.w))
+            h = libtcod.random_get_int(0, ROOM_MIN_SIZE, min(ROOM_MAX_SIZE, node.h))
+            x = libtcod.random_get_int(0, node.x, node.x + node.w - w)
+            y = libtcod.random_get_int(0, node.y, node.y + node.h - h)
+            new_room = Rect(x, y, w, h)
+
+            create_room(new_room)
+            place_objects(new_room)
+            rooms.append(new_room)
+            subtree_rooms[node_key(node)] = [new_room]
+        else:
+            # children are visited first, so join the subtrees through the left room nearest the
+            # middle of the node and the right room nearest that one
+            left = subtree_rooms.pop(node_key(libtcod.bsp_left(node)))
+            right = subtree_rooms.pop(node_key(libtcod.bsp_right(node)))
+            (mid_x, mid_y) = (node.x + node.w / 2, node.y + node.h / 2)
+            (prev_x, prev_y) = min((room.center() for room in left),
+                                   key=lambda c: (c[0] - mid_x) ** 2 + (c[1] - mid_y) ** 2)
+            (new_x, new_y) = min((room.center() for room in right),
+                                 key=lambda c: (c[0] - prev_x) ** 2 + (c[1] - prev_y) ** 2)
+            if libtcod.random_get_int(0, 0, 1) == 1:
+                create_h_tunnel(prev_x, new_x, prev_y)
+                create_v_tunnel(prev_y, new_y, new_x)
+            else:
+                create_v_tunnel(prev_y, new_y, prev_x)
+                create_h_tunnel(prev_x, new_x, new_y)
+            subtree_rooms[node_key(node)] = left + right
+        return True
+
+    # leave the outer edge of the map as wall
+    root = libtcod.bsp_new_with_size(0, 0, MAP_WIDTH - 1, MAP_HEIGHT - 1)
+    libtcod.bsp_split_recursive(root, 0, BSP_DEPTH, ROOM_MAX_SIZE + 1, ROOM_MAX_SIZE + 1, 1.5, 1.5)
+    libtcod.bsp_traverse_inverted_level_order(root, carve_node)
+    libtcod.bsp_delete(root)
+
+    # the player starts in the first room, the stairs go in the last, as in make_room_map
+    (player.x, player.y) = rooms[0].center()
+    (new_x, new_y) = rooms[-1].center()
+    stairs = Object(new_x, new_y, '<', 'stairs', libtcod.white, always_visible=True)
+    objects.append(stairs)
+    stairs.send_to_back()  # so it draws below monsters
+
+
+def make_cave_map():
+    # generate a natural cave with cellular automata. the automaton runs on hhgrid bitmasks, so each
+    # smoothing pass counts the neighbours of every tile at once rather than looping over tiles
+    global map, objects, stairs, rooms
+
+    # the list of objects with just the player
+    objects = [player]
+
+    width, height = MAP_WIDTH, MAP_HEIGHT
+    inside = hhgrid.full(width, height) & ~hhgrid.border(width, height)
+
+    # random fill, about 56% floor: a | (b & c & d) over four random bit strings
+    bits = hhgrid.stride(width) * height
+    floor = random.getrandbits(bits) | (random.getrandbits(bits) & random.getrandbits(bits) &
+                                        random.getrandbits(bits))
+    floor &= inside
+
+    # the terrain layer's high ground starts out as rock, carving the cave around ridges and pillars
+    if terrain is not None:
+        floor &= ~terrain_mask(terrain, CAVE_RIDGE_LEVEL)
+
+    # smoothing (4-5 rule): a floor tile with 5 or more wall neighbours closes in, and a wall with 5 or
+    # more floor neighbours (3 or fewer walls) opens up. the outside of the map counts as wall
+    for i in range(CAVE_SMOOTHING):
+        planes = hhgrid.neighbours(floor, width, height)
+        floor = ((floor & hhgrid.at_least(planes, 4, width, height)) |
+                 (~floor & hhgrid.at_least(planes, 5, width, height))) & inside
+
+    # keep only the largest open region, so the whole cave is reachable
+    floor = hhgrid.components(floor, width, height)[0]
+
+    rows = hhgrid.unpack(floor, width, height)
+    map = [[Tile(not rows[y][x]) for y in range(height)] for x in range(width)]
+
+    # populate the cave zone by zone; place_objects already skips spots that land in rock. each band of
+    # zone rows is cut out of the floor mask once, and its zones are tested against that slice with one
+    # zone-sized box shifted along it, so no zone costs a mask the size of the whole map
+    step = hhgrid.stride(width)
+    bands = []
+    for y in range(0, height - 2, CAVE_ZONE_SIZE):
+        h = min(CAVE_ZONE_SIZE, height - 1 - y)
+        bands.append((y, h, (floor >> ((y + 1) * step)) & hhgrid.full(width, h - 1)))
+    zone_box = hhgrid.box(width, 1, 0, CAVE_ZONE_SIZE - 1, CAVE_ZONE_SIZE - 1)
+    rooms = []
+    for x in range(0, width - 2, CAVE_ZONE_SIZE):
+        w = min(CAVE_ZONE_SIZE, width - 1 - x)
+        if w == CAVE_ZONE_SIZE:
+            inside_zone = zone_box << x
+        else:
+            # (the last column of zones is cut short by the edge of the map)
+            inside_zone = hhgrid.box(width, x + 1, 0, w - 1, CAVE_ZONE_SIZE - 1)
+        for (y, h, band) in bands:
+            if band & inside_zone:
+                zone = Rect(x, y, w, h)
+                place_objects(zone)
+                rooms.append(zone)
+
+    # the player starts on a random open floor tile, and the stairs go as far away as the cave allows
+    while True:
+        x = libtcod.random_get_int(0, 1, width - 2)
+        y = libtcod.random_get_int(0, 1, height - 2)
+        if floor & hhgrid.bit(width, x, y) and not is_blocked(x, y):
+            break
+    (player.x, player.y) = (x, y)
+    far = hhgrid.farthest(floor, hhgrid.bit(width, player.x, player.y), width, height)
+    (new_x, new_y) = random.choice(list(hhgrid.tiles(far, width)))
+    stairs = Object(new_x, new_y, '<', 'stairs', libtcod.white, always_visible=True)
+    objects.append(stairs)
+    stairs.send_to_back()  # so it draws below monsters
+
+
+def map_mask(blockers=False):
+    # bitmask (see hhgrid) of the walkable tiles, optionally without the tiles held by blocking objects
+    mask = hhgrid.pack([[not map[x][y].blocked for x in range(MAP_WIDTH)] for y in range(MAP_HEIGHT)], MAP_WIDTH)
+    if blockers:
+        for obj in objects:
+            if obj.blocks and obj != player:
+                mask &= ~hhgrid.bit(MAP_WIDTH, obj.x, obj.y)
+    return mask
+
+
+def check_map(repair=False):
+    # flood-fill the level from the player's start to check that every room is connected and that the
+    # stairs can be reached past the blocking objects. returns a list of problems, empty if the level
+    # passes. with repair, rooms that are cut off are tunnelled back to the nearest connected room
+    problems = []
+    open_mask = map_mask()
+    start = hhgrid.bit(MAP_WIDTH, player.x, player.y)
+    reached = hhgrid.flood(open_mask, start, MAP_WIDTH, MAP_HEIGHT)
+
+    for room in rooms:
+        (x, y) = room.center()
+        if reached & hhgrid.bit(MAP_WIDTH, x, y) or map[x][y].blocked:
+            # (cave zones can have rock at their centre)
+            continue
+        if not repair:
+            problems.append('room at ' + str(x) + ',' + str(y) + ' is cut off')
+            continue
+
+        # dig towards the closest room that is connected
+        connected = [other for other in rooms if reached & hhgrid.bit(MAP_WIDTH, *other.center())]
+        (other_x, other_y) = min((other.center() for other in connected),
+                                 key=lambda c: (c[0] - x) ** 2 + (c[1] - y) ** 2)
+        create_h_tunnel(x, other_x, y)
+        create_v_tunnel(y, other_y, other_x)
+        open_mask = map_mask()
+        reached = hhgrid.flood(open_mask, start, MAP_WIDTH, MAP_HEIGHT)
+
+    # the stairs tile itself counts as open: anything standing on it can be fought off
+    goal = hhgrid.bit(MAP_WIDTH, stairs.x, stairs.y)
+    open_mask = map_mask(blockers=True) | goal | start
+    if not hhgrid.flood(open_mask, start, MAP_WIDTH, MAP_HEIGHT) & goal:
+        problems.append('stairs cannot be reached')
+
+    return problems
+
+
 def next_level():
     global dungeon_level
 
@@ -1511,16 +2650,23 @@ def next_level():
     player.fighter.heal(player.fighter.max_hp / 2)  # heal player by 50%
 
     message('After a rare moment of peace, you descend further into the cave.', libtcod.red)
+    store_level()
     dungeon_level += 1
 
-    make_map()
+    enter_level()
     initialize_fov()
+    if journal is not None:
+        journal.sync()
 
 
 def menu(header, options, width):
     if len(options) > 26:
         raise ValueError('Cannot have a menu with more than 26 options.')
 
+    if replay_queue is not None:
+        (index,) = replay_input(b'M')
+        return None if index < 0 else index
+
     # calculate total height for the header (after auto wrap) and one line per option
     header_height = libtcod.console_get_height_rect(con, 0, 0, width, SCREEN_HEIGHT, header)
     if header == '':
@@ -1563,9 +2709,11 @@ def menu(header, options, width):
 
     # convert the ASCII code to an index; if it corresponds to an option, return it
     index = key.c - ord('a')
-    if 0 <= index < len(options):
-        return index
-    return None
+    if not 0 <= index < len(options):
+        index = None
+    if journal is not None:
+        journal.record_menu(index)
+    return index
 
 
 def msgbox(text, width=50):
@@ -1593,12 +2741,14 @@ def inventory_menu(header):
     return inventory[index].item
 
 
-def render_all():
+def render_all(fov=True):
+    # draw the map, objects and panel. with fov False, FOV is left as it is and the map's tiles are
+    # neither redrawn nor marked explored, which waits for the next render with fov
     global color_light_wall
     global color_light_ground
     global fov_recompute
 
-    if fov_recompute:
+    if fov_recompute and fov:
         # recompute FOV if needed
         fov_recompute = False
         libtcod.map_compute_fov(fov_map, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
@@ -1607,23 +2757,28 @@ def render_all():
         for y in range(MAP_HEIGHT):
             for x in range(MAP_WIDTH):
                 visible = libtcod.map_is_in_fov(fov_map, x, y)
-                wall = map[x][y].block_sight
+                tile = map[x][y]
+                wall = tile.block_sight
+                if tile.rubble:
+                    (dark_ground, light_ground) = (color_dark_rubble, color_light_rubble)
+                else:
+                    (dark_ground, light_ground) = tint_ground_colors[tile.tint]
                 if not visible:
                     # if it's not visible right now, the player can only see it if it's explored
-                    if map[x][y].explored:
+                    if tile.explored:
                         # it's out of the player FOV
                         if wall:
                             libtcod.console_set_char_background(con, x, y, color_dark_wall, libtcod.BKGND_SET)
                         else:
-                            libtcod.console_set_char_background(con, x, y, color_dark_ground, libtcod.BKGND_SET)
+                            libtcod.console_set_char_background(con, x, y, dark_ground, libtcod.BKGND_SET)
 
                 else:
                     # it's visible
                     if wall:
                         libtcod.console_set_char_background(con, x, y, color_light_wall, libtcod.BKGND_SET)
                     else:
-                        libtcod.console_set_char_background(con, x, y, color_light_ground, libtcod.BKGND_SET)
-                    map[x][y].explored = True
+                        libtcod.console_set_char_background(con, x, y, light_ground, libtcod.BKGND_SET)
+                    tile.explored = True
 
                     # draw all objects in the list
     for object in objects:
@@ -1766,6 +2921,7 @@ def monster_death(monster):
     monster.blocks = False
     monster.fighter = None
     monster.ai = None
+    monster.route = None
     monster.name = 'remains of ' + monster.name
     monster.send_to_back()
 
@@ -1816,11 +2972,14 @@ def check_level_up():
 # ############################################
 # Initialization & Main Loop
 # ############################################
-libtcod.console_set_custom_font('terminal16x16_gs_ro.png',
-                                libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_ASCII_INROW)
-libtcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT, 'Hulks and Horrors', False)
-libtcod.sys_set_fps(LIMIT_FPS)
-panel = libtcod.console_new(SCREEN_WIDTH, PANEL_HEIGHT)
-con = libtcod.console_new(MAP_WIDTH, MAP_HEIGHT)
-
-main_menu(firstrun=True)
\ No newline at end of file
+# (only when run as the game, so tools can import the game rules without opening a window)
+if __name__ == '__main__':
+    libtcod.console_set_custom_font('terminal16x16_gs_ro.png',
+                                    libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_ASCII_INROW)
+    libtcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT, 'Hulks and Horrors', False)
+    libtcod.sys_set_fps(LIMIT_FPS)
+    panel = libtcod.console_new(SCREEN_WIDTH, PANEL_HEIGHT)
+    con = libtcod.console_new(MAP_WIDTH, MAP_HEIGHT)
+
+    main_menu(firstrun=True)
+    hhsave.stop()
\ No newline at end of file
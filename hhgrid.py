@@ -0,0 +1,220 @@
+"""
+handhRL - bitmask grids
+
+Whole-map operations on tile masks. A mask packs one bit per tile into a single python int, row by
+row, with one spare bit at the end of every row so that shifting a row sideways never spills into
+the next. Growing, flooding and counting a mask are then a handful of big-integer operations over
+the entire map instead of a python loop per tile.
+"""
+
+
+def stride(width):
+    # bits per row, including the spare bit
+    return width + 1
+
+
+def bit(width, x, y):
+    # the mask bit for one tile
+    return 1 << (y * stride(width) + x)
+
+
+def is_set(mask, width, x, y):
+    return (mask >> (y * stride(width) + x)) & 1 == 1
+
+
+_full_masks = {}
+
+
+def full(width, height):
+    # every tile on the map, with the spare bits left clear
+    if (width, height) not in _full_masks:
+        _full_masks[(width, height)] = int(('0' + '1' * width) * height, 2)
+    return _full_masks[(width, height)]
+
+
+def box(width, x, y, w, h):
+    # the tiles of a w by h rectangle with its top left corner at x, y
+    row = '0' * (stride(width) - x - w) + '1' * w + '0' * x
+    return int(row * h, 2) << (y * stride(width))
+
+
+def pack(rows, width):
+    # build a mask from rows of true/false values, one row per y
+    bits = ''.join('0' + ''.join('1' if value else '0' for value in reversed(row)) for row in reversed(rows))
+    return int(bits or '0', 2)
+
+
+def unpack(mask, width, height):
+    # rows of true/false values back out of a mask
+    step = stride(width)
+    bits = bin(mask)[:1:-1].ljust(step * height, '0')
+    return [[b == '1' for b in bits[y * step:y * step + width]] for y in range(height)]
+
+
+def count(mask):
+    # number of tiles in a mask
+    return bin(mask).count('1')
+
+
+def tiles(mask, width):
+    # (x, y) of every tile in a mask, lowest bit first
+    step = stride(width)
+    bits = bin(mask)[:1:-1]
+    index = bits.find('1')
+    while index != -1:
+        yield index % step, index // step
+        index = bits.find('1', index + 1)
+
+
+def grow(mask, width, height, limit=None):
+    # every tile in the mask plus its 8 neighbours, kept inside `limit` (default: the whole map)
+    if limit is None:
+        limit = full(width, height)
+    step = stride(width)
+    row = mask | (mask << 1) | (mask >> 1)
+    return (row | (row << step) | (row >> step)) & limit
+
+
+def flood(open_mask, seed, width, height):
+    # every tile of open_mask that can be reached from the seed tiles by 8-way steps
+    region = seed & open_mask
+    frontier = region
+    while frontier:
+        grown = grow(frontier, width, height, open_mask)
+        frontier = grown & ~region
+        region |= frontier
+    return region
+
+
+def distance(open_mask, start, goal, width, height):
+    # fewest 8-way steps from the start tiles to any goal tile over open_mask, or -1 if unreachable
+    region = start & open_mask
+    frontier = region
+    steps = 0
+    while frontier:
+        if frontier & goal:
+            return steps
+        grown = grow(frontier, width, height, open_mask)
+        frontier = grown & ~region
+        region |= frontier
+        steps += 1
+    return -1
+
+
+def components(open_mask, width, height):
+    # split open_mask into its separately reachable regions, largest first
+    regions = []
+    remaining = open_mask
+    while remaining:
+        region = flood(open_mask, remaining & -remaining, width, height)
+        regions.append(region)
+        remaining &= ~region
+    regions.sort(key=count, reverse=True)
+    return regions
+
+
+def neighbours(mask, width, height):
+    # how many of each tile's 8 neighbours are in the mask, as four bit planes (1s, 2s, 4s, 8s).
+    # the eight shifted copies of the mask are summed with a bitwise adder, all tiles at once
+    limit = full(width, height)
+    step = stride(width)
+    planes = [0, 0, 0, 0]
+    for shift in (1, -1, step, -step, step + 1, step - 1, -step + 1, -step - 1):
+        if shift > 0:
+            carry = (mask << shift) & limit
+        else:
+            carry = (mask >> -shift) & limit
+        for i in range(4):
+            planes[i], carry = planes[i] ^ carry, planes[i] & carry
+    return planes
+
+
+def at_least(planes, n, width, height):
+    # tiles whose neighbours() count is n or more
+    limit = full(width, height)
+    result = 0
+    for value in range(n, 9):
+        match = limit
+        for i in range(4):
+            if value >> i & 1:
+                match &= planes[i]
+            else:
+                match &= ~planes[i]
+        result |= match
+    return result & limit
+
+
+def border(width, height):
+    # the outermost ring of tiles
+    return full(width, height) & ~box(width, 1, 1, width - 2, height - 2)
+
+
+def farthest(open_mask, start, width, height):
+    # the tiles of open_mask that take the most 8-way steps to reach from the start tiles
+    region = start & open_mask
+    frontier = region
+    last = frontier
+    while frontier:
+        last = frontier
+        grown = grow(frontier, width, height, open_mask)
+        frontier = grown & ~region
+        region |= frontier
+    return last
+
+
+def lowest(mask, width):
+    # (x, y) of the lowest tile in a mask
+    index = (mask & -mask).bit_length() - 1
+    return index % stride(width), index // stride(width)
+
+
+def weighted_distance(costs, start, width, height):
+    # cheapest cost from every reachable tile to the start tiles, by Dial's algorithm. costs is a list
+    # of (cost, mask): what stepping onto each tile costs, tiles in no mask being impassable. returns
+    # rings, where rings[d] is the mask of tiles whose cheapest way to a start tile costs d. each ring
+    # is settled and spread to its neighbours a cost class at a time, whole map at once
+    open_mask = 0
+    for (cost, mask) in costs:
+        open_mask |= mask
+    buckets = {0: start}
+    settled = 0
+    rings = []
+    while buckets:
+        ring = buckets.pop(len(rings), 0) & ~settled
+        rings.append(ring)
+        if not ring:
+            continue
+        settled |= ring
+        for (cost, mask) in costs:
+            if ring & mask:
+                reached = grow(ring & mask, width, height, open_mask) & ~settled
+                if reached:
+                    d = len(rings) - 1 + cost
+                    buckets[d] = buckets.get(d, 0) | reached
+    return rings
+
+
+def downhill(rings, costs, x, y, width, height, limit=None):
+    # the cheapest route from x, y to the start of weighted_distance() rings, as a list of steps with
+    # the next step last (empty if it can't be reached), or just its first `limit` steps. each step is
+    # to a neighbour whose distance plus its cost to step onto comes to this tile's distance
+    here = bit(width, x, y)
+    d = 0
+    while d < len(rings) and not rings[d] & here:
+        d += 1
+    if d == len(rings):
+        return []
+    steps = []
+    while d > 0 and len(steps) != limit:
+        near = grow(here, width, height)
+        for (cost, mask) in costs:
+            if cost <= d and rings[d - cost] & mask & near:
+                (x, y) = lowest(rings[d - cost] & mask & near, width)
+                d -= cost
+                break
+        else:
+            return []
+        here = bit(width, x, y)
+        steps.append((x, y))
+    steps.reverse()
+    return steps
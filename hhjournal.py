@@ -0,0 +1,81 @@
+"""
+handhRL - action journal
+
+An append-only log of everything the player did since the last save: each key press with the seed
+the dice were reset to before it, and the answers to any menus and targeting prompts it opened. A
+turn costs a few bytes instead of a whole save. After a crash the game loads the last save and plays
+the journal back on top of it to get to exactly where it stopped.
+
+Entries go through a buffered file. It is flushed every turn and synced to disk at level boundaries.
+"""
+
+import os
+import struct
+
+
+JOURNAL_MAGIC = b'HHJ1'
+
+# header: magic, id of the save the journal follows on from, seed the dice were reset to at that save
+HEADER = struct.Struct('<4sII')
+
+# one entry per record: a tag byte, then the tag's fields
+ENTRIES = {b'K': struct.Struct('<IHHB'),  # key press: seed, vk, c, lalt
+           b'M': struct.Struct('<b'),  # menu choice (-1 for none)
+           b'T': struct.Struct('<hh')}  # target tile (-1, -1 for cancelled)
+
+
+class Journal:
+    # a journal being written, following on from save `save_id`
+    def __init__(self, path, save_id, seed):
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(JOURNAL_MAGIC, save_id, seed))
+
+    def write(self, tag, *values):
+        self.file.write(tag + ENTRIES[tag].pack(*values))
+
+    def record_key(self, seed, key):
+        self.write(b'K', seed, key.vk, key.c, 1 if key.lalt else 0)
+
+    def record_menu(self, index):
+        self.write(b'M', -1 if index is None else index)
+
+    def record_target(self, x, y):
+        if x is None:
+            (x, y) = (-1, -1)
+        self.write(b'T', x, y)
+
+    def flush(self):
+        self.file.flush()
+
+    def sync(self):
+        # make sure everything so far survives a power cut, not just a crash
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def read_journal(path, save_id):
+    # (seed, entries) of the journal at path if it follows on from save `save_id`, else None.
+    # entries are (tag, values) tuples; a torn entry at the end (from a crash mid-write) is dropped
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except IOError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    (magic, journal_save_id, seed) = HEADER.unpack_from(data)
+    if magic != JOURNAL_MAGIC or journal_save_id != save_id:
+        return None
+
+    entries = []
+    offset = HEADER.size
+    while offset < len(data):
+        tag = data[offset:offset + 1]
+        if tag not in ENTRIES or offset + 1 + ENTRIES[tag].size > len(data):
+            break
+        entries.append((tag, ENTRIES[tag].unpack_from(data, offset + 1)))
+        offset += 1 + ENTRIES[tag].size
+    return seed, entries
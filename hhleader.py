@@ -0,0 +1,201 @@
+"""
+handhRL - leaderboard database
+
+A local SQLite database of every finished run, fed from the same score_data as the score ledger
+(see hhscore), for the statistics the top-11 list can't show: deaths per dungeon level, the most
+common causes of death and each player's best run.
+
+Triggers keep one row of running totals per level, per cause of death and per player as runs are
+recorded, so the dashboards read a few small indexed tables instead of aggregating every run.
+
+    python hhleader.py levels
+    python hhleader.py killers --limit 10
+    python hhleader.py players --limit 10
+    python hhleader.py player Berry
+"""
+
+import argparse
+import atexit
+import os
+import sqlite3
+
+import hhscore
+
+
+DATABASE_FILE = 'scores.db'
+
+# open databases by absolute path, each with its schema already set up. one connection is kept for the
+# life of the game, so the schema script runs once and sqlite's cache of prepared statements (see below)
+# lasts from one run to the next
+_databases = {}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    score INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    killed_by TEXT,
+    dungeon_level INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_score ON runs (score DESC);
+CREATE INDEX IF NOT EXISTS runs_by_name ON runs (name, score DESC);
+
+CREATE TABLE IF NOT EXISTS level_stats (
+    dungeon_level INTEGER PRIMARY KEY,
+    deaths INTEGER NOT NULL,
+    total_score INTEGER NOT NULL,
+    best_score INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS killer_stats (
+    killed_by TEXT PRIMARY KEY,
+    deaths INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS killers_by_deaths ON killer_stats (deaths DESC);
+CREATE TABLE IF NOT EXISTS player_stats (
+    name TEXT PRIMARY KEY,
+    runs INTEGER NOT NULL,
+    best_score INTEGER NOT NULL,
+    best_level INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS players_by_best ON player_stats (best_score DESC);
+
+CREATE TRIGGER IF NOT EXISTS count_run AFTER INSERT ON runs
+BEGIN
+    INSERT OR IGNORE INTO level_stats VALUES (NEW.dungeon_level, 0, 0, NEW.score);
+    UPDATE level_stats SET deaths = deaths + 1, total_score = total_score + NEW.score,
+                           best_score = MAX(best_score, NEW.score)
+        WHERE dungeon_level = NEW.dungeon_level;
+
+    INSERT OR IGNORE INTO killer_stats VALUES (COALESCE(NEW.killed_by, 'unknown'), 0);
+    UPDATE killer_stats SET deaths = deaths + 1 WHERE killed_by = COALESCE(NEW.killed_by, 'unknown');
+
+    INSERT OR IGNORE INTO player_stats VALUES (NEW.name, 0, NEW.score, NEW.dungeon_level);
+    UPDATE player_stats SET runs = runs + 1,
+                            best_level = CASE WHEN NEW.score > best_score THEN NEW.dungeon_level
+                                              ELSE best_level END,
+                            best_score = MAX(best_score, NEW.score)
+        WHERE name = NEW.name;
+END;
+"""
+
+# the dashboard queries. the same SQL text is always used, so sqlite keeps each one prepared
+INSERT_RUN = 'INSERT INTO runs (score, name, killed_by, dungeon_level) VALUES (?, ?, ?, ?)'
+LEVEL_QUERY = ('SELECT dungeon_level, deaths, total_score * 1.0 / deaths, best_score FROM level_stats '
+               'ORDER BY dungeon_level')
+KILLER_QUERY = 'SELECT killed_by, deaths FROM killer_stats ORDER BY deaths DESC LIMIT ?'
+PLAYER_QUERY = 'SELECT name, runs, best_score, best_level FROM player_stats ORDER BY best_score DESC LIMIT ?'
+PLAYER_RUNS_QUERY = ('SELECT score, killed_by, dungeon_level FROM runs WHERE name = ? '
+                     'ORDER BY score DESC LIMIT ?')
+TOP_QUERY = 'SELECT score, name, killed_by, dungeon_level FROM runs ORDER BY score DESC LIMIT ?'
+
+
+def connect(path=DATABASE_FILE):
+    # the open database, creating it (with every run already in the score ledger) if it isn't there.
+    # the connection is shared: leave it open, and close() them all when done
+    key = os.path.abspath(path)
+    if key not in _databases:
+        new = not os.path.isfile(path)
+        db = sqlite3.connect(path)
+        try:
+            db.executescript(SCHEMA)
+            if new:
+                with db:
+                    db.executemany(INSERT_RUN, (run_row(score_data) for score_data in hhscore.all_scores()))
+        except:
+            db.close()
+            raise
+        _databases[key] = db
+    return _databases[key]
+
+
+def close():
+    # close every open database
+    while _databases:
+        _databases.popitem()[1].close()
+
+
+atexit.register(close)
+
+
+def run_row(score_data):
+    (score, name, killed_by, dungeon_level) = score_data
+    return score, text(name), text(killed_by), int(dungeon_level)
+
+
+def text(value):
+    # (python 2 hands round utf-8 byte strings, which sqlite won't take)
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def record(score_data):
+    # add a finished run (a new_score score_data list). call before the run goes into the score
+    # ledger, since a new database is filled from the ledger. the statistics are extras, so a
+    # database that can't be written is reported and otherwise ignored
+    try:
+        db = connect()
+        with db:
+            db.execute(INSERT_RUN, run_row(score_data))
+    except sqlite3.Error as e:
+        return DATABASE_FILE + ': ' + str(e)
+    return None
+
+
+def deaths_by_level(db):
+    # [(dungeon level, deaths, mean score, best score), ...] by level
+    return db.execute(LEVEL_QUERY).fetchall()
+
+
+def common_killers(db, limit=10):
+    # [(killed by, deaths), ...], most deaths first
+    return db.execute(KILLER_QUERY, (limit,)).fetchall()
+
+
+def player_bests(db, limit=10):
+    # [(name, runs, best score, level of the best run), ...], best first
+    return db.execute(PLAYER_QUERY, (limit,)).fetchall()
+
+
+def player_runs(db, name, limit=10):
+    # [(score, killed by, dungeon level), ...] of one player's best runs
+    return db.execute(PLAYER_RUNS_QUERY, (name, limit)).fetchall()
+
+
+def top_runs(db, limit=10):
+    # [(score, name, killed by, dungeon level), ...], best first
+    return db.execute(TOP_QUERY, (limit,)).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='handhRL leaderboard statistics.')
+    parser.add_argument('report', choices=['levels', 'killers', 'players', 'player', 'top'])
+    parser.add_argument('name', nargs='?', help='player name, for the player report')
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--database', default=DATABASE_FILE)
+    args = parser.parse_args()
+
+    db = connect(args.database)
+    if args.report == 'levels':
+        print('level  deaths  mean score  best')
+        for row in deaths_by_level(db):
+            print('{0: >5} {1: >7} {2: >11.1f} {3: >5}'.format(*row))
+    elif args.report == 'killers':
+        for (killed_by, deaths) in common_killers(db, args.limit):
+            print('{0: >7}  {1}'.format(deaths, killed_by))
+    elif args.report == 'players':
+        print('best  level  runs  name')
+        for (name, runs, best, level) in player_bests(db, args.limit):
+            print('{0: >4} {1: >6} {2: >5}  {3}'.format(best, level, runs, name))
+    elif args.report == 'player':
+        if not args.name:
+            parser.error('the player report needs a name')
+        for (score, killed_by, level) in player_runs(db, args.name, args.limit):
+            print('{0: >5}  killed by {1} on level {2}'.format(score, killed_by, level))
+    elif args.report == 'top':
+        for (score, name, killed_by, level) in top_runs(db, args.limit):
+            print('{0: >5}  {1}, killed by {2} on level {3}'.format(score, name, killed_by, level))
+
+
+if __name__ == '__main__':
+    main()
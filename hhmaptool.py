@@ -0,0 +1,348 @@
+"""
+handhRL - level generation tools
+
+Headless batch runner for the level generator. Builds thousands of seeded levels with make_map and
+place_objects across worker processes, measures each one, and writes the measurements to a compact
+columnar file so generator changes can be judged on statistics.
+
+Run from the game directory (libtcod is loaded from there):
+
+    python hhmaptool.py stats --levels 1-13 --count 1000 --out levels.hhc
+    python hhmaptool.py check --levels 1-13 --count 1000
+    python hhmaptool.py bench --sizes 80x43,160x86 --count 100
+    python hhmaptool.py pack --levels 1-13 --count 20 --out levels.hhp
+"""
+
+import argparse
+import array
+import collections
+import json
+import multiprocessing
+import struct
+import sys
+import time
+
+import libtcodpy as libtcod
+import hhtable
+import hhgrid
+import hhpack
+import hhsim
+import handhrl
+
+
+# seeds handed to a worker at a time
+CHUNK_SIZE = 50
+
+# columnar file layout: magic, header length, JSON header, then each column's raw array in header order
+COLUMNS_MAGIC = 'HHC1'
+
+# name and array typecode of each measurement column
+STATS_COLUMNS = [('seed', 'I'),
+                 ('dungeon_level', 'B'),
+                 ('floor', 'H'),
+                 ('coverage', 'f'),
+                 ('rooms', 'H'),
+                 ('corridor', 'H'),
+                 ('stairs_distance', 'h'),
+                 ('monsters', 'H'),
+                 ('items', 'H'),
+                 ('placeables', 'H'),
+                 ('monster_density', 'f'),
+                 ('item_density', 'f'),
+                 ('generate_ms', 'f')]
+
+
+def generate_level(seed, dungeon_level, validate=True):
+    # build one level exactly as the game would for this seed, leaving it in handhrl's globals
+    handhrl.dungeon_level = dungeon_level
+    handhrl.player = handhrl.Object(0, 0, chr(1), 'player', libtcod.white, blocks=True)
+    handhrl.player.level = 1
+    handhrl.make_seeded_map(seed, validate)
+
+
+def walk_distance(start, goal):
+    # number of 8-way steps from start to goal over unblocked tiles, or -1 if there is no way through
+    width = handhrl.MAP_WIDTH
+    return hhgrid.distance(handhrl.map_mask(), hhgrid.bit(width, *start), hhgrid.bit(width, *goal), width,
+                           handhrl.MAP_HEIGHT)
+
+
+def measure_level():
+    # measurements of the level currently in handhrl's globals
+    level_map = handhrl.map
+    width = len(level_map)
+    height = len(level_map[0])
+
+    floor = sum(1 for column in level_map for tile in column if not tile.blocked)
+
+    # every floor tile that isn't inside a room was dug as a corridor
+    in_rooms = set()
+    for room in handhrl.rooms:
+        for x in range(room.x1 + 1, room.x2):
+            for y in range(room.y1 + 1, room.y2):
+                in_rooms.add((x, y))
+    corridor = sum(1 for x in range(width) for y in range(height)
+                   if not level_map[x][y].blocked and (x, y) not in in_rooms)
+
+    monsters = sum(1 for obj in handhrl.objects if obj.fighter and obj is not handhrl.player)
+    items = sum(1 for obj in handhrl.objects if obj.item)
+    placeables = sum(1 for obj in handhrl.objects if obj.placeable)
+
+    stairs = handhrl.stairs
+    player = handhrl.player
+
+    return {'floor': floor,
+            'coverage': floor / float(width * height),
+            'rooms': len(handhrl.rooms),
+            'corridor': corridor,
+            'stairs_distance': walk_distance((player.x, player.y), (stairs.x, stairs.y)),
+            'monsters': monsters,
+            'items': items,
+            'placeables': placeables,
+            'monster_density': monsters / float(floor),
+            'item_density': (items + placeables) / float(floor)}
+
+
+def stats_chunk(task):
+    # worker entry point: generate and measure a batch of seeds for one level, returning columns
+    dungeon_level, seeds = task
+    columns = dict((name, []) for name, typecode in STATS_COLUMNS)
+    for seed in seeds:
+        start = time.time()
+        generate_level(seed, dungeon_level)
+        elapsed = (time.time() - start) * 1000.0
+
+        row = measure_level()
+        row['seed'] = seed
+        row['dungeon_level'] = dungeon_level
+        row['generate_ms'] = elapsed
+        for name, typecode in STATS_COLUMNS:
+            columns[name].append(row[name])
+    return columns
+
+
+def check_chunk(task):
+    # worker entry point: generate a batch of seeds for one level without the in-game check, then
+    # check each level. returns (seed, problems) for every level that failed
+    dungeon_level, seeds = task
+    failures = []
+    for seed in seeds:
+        generate_level(seed, dungeon_level, validate=False)
+        problems = handhrl.check_map()
+        if problems:
+            failures.append((seed, problems))
+    return dungeon_level, len(seeds), failures
+
+
+def check_levels(levels, count, seed=0, processes=None):
+    # connectivity check over a corpus of seeded levels. returns {dungeon_level: (levels, failures)}
+    results = {}
+    for dungeon_level, checked, failures in run_pool(check_chunk, make_tasks(levels, count, seed), processes):
+        total, failed = results.get(dungeon_level, (0, []))
+        results[dungeon_level] = (total + checked, failed + failures)
+    return results
+
+
+def pack_chunk(task):
+    # worker entry point: generate a batch of seeds for one level and encode each as a level pack record
+    dungeon_level, seeds = task
+    records = []
+    for seed in seeds:
+        generate_level(seed, dungeon_level)
+        records.append((dungeon_level, seed, hhpack.encode_level(seed, dungeon_level, handhrl.map, handhrl.objects,
+                                                                 handhrl.player, handhrl.stairs, handhrl.rooms)))
+    return records
+
+
+def build_pack(path, levels, count, seed=0, processes=None):
+    # generate `count` seeded levels for each dungeon level into a level pack. returns the number written
+    chunks = run_pool(pack_chunk, make_tasks(levels, count, seed), processes)
+    return hhpack.write_pack(path, (record for chunk in chunks for record in chunk))
+
+
+def bench_generator(generator, width, height, count, seed=0, dungeon_level=1):
+    # time `count` seeded levels from one generator at one map size and average their measurements
+    saved = handhrl.MAP_GENERATOR, handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT
+    handhrl.MAP_GENERATOR, handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT = generator, width, height
+    try:
+        totals = collections.defaultdict(float)
+        failed = 0
+        elapsed = 0.0
+        for s in range(seed, seed + count):
+            start = time.time()
+            generate_level(s, dungeon_level, validate=False)
+            elapsed += time.time() - start
+
+            failed += bool(handhrl.check_map())
+            for name, value in measure_level().items():
+                totals[name] += value
+    finally:
+        handhrl.MAP_GENERATOR, handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT = saved
+
+    result = dict((name, value / count) for name, value in totals.items())
+    result['generate_ms'] = elapsed * 1000.0 / count
+    result['failed'] = failed
+    return result
+
+
+def bench(sizes, count, seed=0, generators=('rooms', 'bsp', 'caves')):
+    # compare generators on speed and layout quality at several map sizes
+    lines = ['size      generator   ms/level  ms/room  cover  rooms   corr  stairs  failed']
+    row = '{0: <9} {1: <10} {2: >9.2f} {3: >8.3f} {4: >6.1%} {5: >6.1f} {6: >6.0f} {7: >7.1f} {8: >7}'
+    for width, height in sizes:
+        for generator in generators:
+            r = bench_generator(generator, width, height, count, seed)
+            lines.append(row.format(str(width) + 'x' + str(height), generator, r['generate_ms'],
+                                    r['generate_ms'] / max(r['rooms'], 1), r['coverage'], r['rooms'], r['corridor'],
+                                    r['stairs_distance'], r['failed']))
+    return '\n'.join(lines)
+
+
+def make_tasks(levels, count, seed):
+    tasks = []
+    for dungeon_level in levels:
+        for first in range(seed, seed + count, CHUNK_SIZE):
+            tasks.append((dungeon_level, range(first, min(first + CHUNK_SIZE, seed + count))))
+    return tasks
+
+
+def run_pool(function, tasks, processes=None):
+    # map a worker function over tasks on a process pool, yielding results in task order
+    pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+    try:
+        for result in pool.imap(function, tasks):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def collect_stats(levels, count, seed=0, processes=None):
+    # generate `count` seeded levels for each dungeon level and return the measurements as arrays
+    columns = collections.OrderedDict((name, array.array(typecode)) for name, typecode in STATS_COLUMNS)
+    for chunk in run_pool(stats_chunk, make_tasks(levels, count, seed), processes):
+        for name in columns:
+            columns[name].extend(chunk[name])
+    return columns
+
+
+def write_columns(path, columns):
+    # write an ordered dict of name: array to a columnar file
+    header = {'rows': len(next(iter(columns.values()))) if columns else 0,
+              'byteorder': sys.byteorder,
+              'columns': [[name, values.typecode] for name, values in columns.items()]}
+    header = json.dumps(header)
+    with open(path, 'wb') as f:
+        f.write(COLUMNS_MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for values in columns.values():
+            values.tofile(f)
+
+
+def read_columns(path, names=None):
+    # read a columnar file back into an ordered dict of name: array, optionally only some columns
+    with open(path, 'rb') as f:
+        if f.read(4) != COLUMNS_MAGIC:
+            raise ValueError(path + ' is not a handhRL columnar file.')
+        header = json.loads(f.read(struct.unpack('<I', f.read(4))[0]))
+        rows = header['rows']
+
+        columns = collections.OrderedDict()
+        for name, typecode in header['columns']:
+            values = array.array(str(typecode))
+            if names is None or name in names:
+                values.fromfile(f, rows)
+                if header['byteorder'] != sys.byteorder:
+                    values.byteswap()
+                columns[name] = values
+            else:
+                f.seek(rows * values.itemsize, 1)
+    return columns
+
+
+def summarize_stats(columns):
+    # mean of every measurement, per dungeon level
+    lines = ['level  levels  cover  rooms  corr  stairs  mons  items  mons/100  items/100    ms']
+    row = '{0: >5} {1: >7} {2: >6.1%} {3: >6.1f} {4: >5.0f} {5: >7.1f} {6: >5.1f} {7: >6.1f} {8: >9.2f} ' \
+          '{9: >10.2f} {10: >5.2f}'
+    by_level = collections.defaultdict(list)
+    for i, dungeon_level in enumerate(columns['dungeon_level']):
+        by_level[dungeon_level].append(i)
+
+    for dungeon_level in sorted(by_level):
+        rows = by_level[dungeon_level]
+
+        def mean(name):
+            return sum(columns[name][i] for i in rows) / float(len(rows))
+
+        lines.append(row.format(dungeon_level, len(rows), mean('coverage'), mean('rooms'), mean('corridor'),
+                                mean('stairs_distance'), mean('monsters'), mean('items') + mean('placeables'),
+                                mean('monster_density') * 100, mean('item_density') * 100, mean('generate_ms')))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch level generation tools for handhRL.')
+    commands = parser.add_subparsers(dest='command')
+
+    stats = commands.add_parser('stats', help='generate seeded levels and write their measurements')
+    stats.add_argument('--levels', default='1-13', help="dungeon levels, e.g. '1-13' or '1,5,9'")
+    stats.add_argument('--count', type=int, default=1000, help='seeds per dungeon level')
+    stats.add_argument('--seed', type=int, default=0, help='first seed')
+    stats.add_argument('--processes', type=int, default=None, help='worker processes (default: all cores)')
+    stats.add_argument('--out', default='levels.hhc', help='columnar output file')
+
+    check = commands.add_parser('check', help='check seeded levels for cut-off rooms and unreachable stairs')
+    check.add_argument('--levels', default='1-13', help="dungeon levels, e.g. '1-13' or '1,5,9'")
+    check.add_argument('--count', type=int, default=1000, help='seeds per dungeon level')
+    check.add_argument('--seed', type=int, default=0, help='first seed')
+    check.add_argument('--processes', type=int, default=None, help='worker processes (default: all cores)')
+    check.add_argument('--verbose', action='store_true', help='list every failing seed')
+
+    benchmark = commands.add_parser('bench', help='compare level generators at several map sizes')
+    benchmark.add_argument('--sizes', default='80x43,160x86,320x172', help="map sizes, e.g. '80x43,160x86'")
+    benchmark.add_argument('--count', type=int, default=100, help='levels per generator and size')
+    benchmark.add_argument('--seed', type=int, default=0, help='first seed')
+    benchmark.add_argument('--generators', default='rooms,bsp,caves', help='generators to compare')
+
+    level_pack = commands.add_parser('pack', help='prebake seeded levels into a level pack for the game to load')
+    level_pack.add_argument('--levels', default='1-13', help="dungeon levels, e.g. '1-13' or '1,5,9'")
+    level_pack.add_argument('--count', type=int, default=20, help='levels per dungeon level')
+    level_pack.add_argument('--seed', type=int, default=0, help='first seed')
+    level_pack.add_argument('--processes', type=int, default=None, help='worker processes (default: all cores)')
+    level_pack.add_argument('--out', default=handhrl.LEVEL_PACK, help='pack file')
+
+    show = commands.add_parser('show', help='summarize a columnar measurements file')
+    show.add_argument('path')
+
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        start = time.time()
+        columns = collect_stats(hhsim.parse_levels(args.levels), args.count, args.seed, args.processes)
+        write_columns(args.out, columns)
+        print(summarize_stats(columns))
+        print('{0} levels in {1:.1f}s, written to {2}'.format(len(columns['seed']), time.time() - start, args.out))
+    elif args.command == 'check':
+        results = check_levels(hhsim.parse_levels(args.levels), args.count, args.seed, args.processes)
+        print('level  levels  failed')
+        for dungeon_level in sorted(results):
+            total, failures = results[dungeon_level]
+            print('{0: >5} {1: >7} {2: >7}'.format(dungeon_level, total, len(failures)))
+            if args.verbose:
+                for seed, problems in failures:
+                    print('      seed {0}: {1}'.format(seed, '; '.join(problems)))
+    elif args.command == 'bench':
+        sizes = [tuple(int(n) for n in size.split('x')) for size in args.sizes.split(',')]
+        print(bench(sizes, args.count, args.seed, args.generators.split(',')))
+    elif args.command == 'pack':
+        start = time.time()
+        written = build_pack(args.out, hhsim.parse_levels(args.levels), args.count, args.seed, args.processes)
+        print('{0} levels in {1:.1f}s, written to {2}'.format(written, time.time() - start, args.out))
+    elif args.command == 'show':
+        print(summarize_stats(read_columns(args.path)))
+
+
+if __name__ == '__main__':
+    main()
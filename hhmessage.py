@@ -12,6 +12,9 @@ import time
 SCREEN_WIDTH = 80
 SCREEN_HEIGHT = 50
 
+# set while the game plays back its journal, so text screens don't show or wait for a key
+quiet = False
+
 
 def generate_starpic():
     # Generates a random starfield pattern and stores it in img
@@ -47,6 +50,8 @@ def show_text_log(text, img=None, delay=True, center_first_line=False):
     # takes list of text and displays it line by line against a black screen
     # optional parameters: img = an image based in libtcod.image format, defaults to None (black screen)
     # delay = whether to use the text delay, defaults to True (for cinematic style sequences)
+    if quiet:
+        return
     if img is None:
         img = libtcod.image_new(160, 100)
     libtcod.image_blit_2x(img, 0, 0, 0)
@@ -0,0 +1,151 @@
+"""
+handhRL - combat odds
+
+Exact hit, damage and kill odds for the Fighter combat rules. Each matchup is worked out once and
+kept in a table, so balance tools and monster AI can ask how a fight will go without rolling it.
+"""
+
+import itertools
+
+
+# odds tables, keyed by matchup and by (matchup, hp)
+_roll_table = {}
+_odds_table = {}
+_kill_table = {}
+
+# get_kill_odds stops once the chance of the target still standing drops below this
+KILL_EPSILON = 1e-6
+KILL_MAX_TURNS = 200
+
+
+def to_hit_target(to_hit, armor_class):
+    # the number a 1d20 roll must come in under to hit, capped at 2 to 20 (same rule as Fighter.attack)
+    target = to_hit + armor_class + 5
+    if target > 20:
+        target = 20
+    elif target == 1:
+        target = 2
+    return target
+
+
+def hit_chance(to_hit, armor_class):
+    # chance that a single attack hits: any 1d20 roll below the to-hit target
+    target = to_hit_target(to_hit, armor_class)
+    return max(0, target - 1) / 20.0
+
+
+def roll_distribution(num, sides, highest=0):
+    # exact distribution of hhtable.rolldice(num, sides, highest), as a dict of total: chance
+    key = (num, sides, highest)
+    if key in _roll_table:
+        return _roll_table[key]
+
+    counts = {}
+    if highest != 0:
+        # keep-highest rolls can't be convolved, so count every ordered outcome (at most 12^4 of them)
+        for roll in itertools.product(range(1, sides + 1), repeat=num):
+            total = sum(sorted(roll, reverse=True)[:highest])
+            counts[total] = counts.get(total, 0) + 1
+    else:
+        # plain sums: convolve one die at a time
+        counts = {0: 1}
+        for x in range(num):
+            step = {}
+            for total, count in counts.items():
+                for face in range(1, sides + 1):
+                    step[total + face] = step.get(total + face, 0) + count
+            counts = step
+
+    outcomes = float(sides ** num)
+    distribution = dict((total, count / outcomes) for total, count in counts.items())
+    _roll_table[key] = distribution
+    return distribution
+
+
+def get_odds(to_hit, armor_class, damage_roll, damage=0, damage_resistance=0):
+    # look up (or work out once) the odds of one attack for a matchup
+    # damage_roll is a rolldice argument list: (num, sides) or [num, sides, highest]
+    damage_roll = tuple(damage_roll)
+    key = (to_hit, armor_class, damage_roll, damage, damage_resistance)
+    if key in _odds_table:
+        return _odds_table[key]
+
+    chance = hit_chance(to_hit, armor_class)
+
+    # damage dealt by a hit, as in Fighter.attack: anything below 1 has no effect
+    hit_damage = {}
+    for total, p in roll_distribution(*damage_roll).items():
+        dealt = max(0, total + damage - damage_resistance)
+        hit_damage[dealt] = hit_damage.get(dealt, 0.0) + p
+
+    # damage dealt by an attack, counting misses as 0
+    attack_damage = dict((dealt, p * chance) for dealt, p in hit_damage.items())
+    attack_damage[0] = attack_damage.get(0, 0.0) + (1.0 - chance)
+
+    odds = {'to_hit_target': to_hit_target(to_hit, armor_class),
+            'hit_chance': chance,
+            'hit_damage': hit_damage,
+            'damage': attack_damage,
+            'expected_damage': sum(dealt * p for dealt, p in attack_damage.items()),
+            'key': key}
+
+    _odds_table[key] = odds
+    return odds
+
+
+def get_kill_odds(odds, hp):
+    # chance of bringing hp to 0 or below within each number of attacks, from a get_odds() result.
+    # returns a dict: 'by_turn' (cumulative kill chance after 1, 2, ... attacks), 'expected_turns'
+    # (None if the attacker can't ever do damage) and 'median_turns'
+    key = (odds['key'], hp)
+    if key in _kill_table:
+        return _kill_table[key]
+
+    steps = [(dealt, p) for dealt, p in odds['damage'].items() if p > 0]
+    if hp <= 0:
+        by_turn = []
+    elif not any(dealt > 0 for dealt, p in steps):
+        by_turn = [0.0]
+    else:
+        # chance of the target being alive at each remaining hp, advanced one attack at a time
+        alive = {hp: 1.0}
+        killed = 0.0
+        by_turn = []
+        while len(by_turn) < KILL_MAX_TURNS and 1.0 - killed > KILL_EPSILON:
+            step = {}
+            for remaining, p in alive.items():
+                for dealt, q in steps:
+                    left = remaining - dealt
+                    if left <= 0:
+                        killed += p * q
+                    else:
+                        step[left] = step.get(left, 0.0) + p * q
+            alive = step
+            by_turn.append(killed)
+
+    if not by_turn:
+        expected = 0.0
+        median = 0
+    elif by_turn[-1] == 0.0:
+        expected = None
+        median = None
+    else:
+        # E[turns] = 1 + sum over n of P(still alive after n attacks); the tail past the cut-off is dropped
+        expected = 1.0 + sum(1.0 - k for k in by_turn)
+        median = None
+        for turn, k in enumerate(by_turn):
+            if k >= 0.5:
+                median = turn + 1
+                break
+
+    kill_odds = {'by_turn': by_turn, 'expected_turns': expected, 'median_turns': median}
+    _kill_table[key] = kill_odds
+    return kill_odds
+
+
+def precompute(to_hit_values, armor_class_values, damage_rolls, damage_values=(0,), damage_resistance_values=(0,)):
+    # fill the odds table for every combination given, so later lookups never do any work
+    for matchup in itertools.product(to_hit_values, armor_class_values, damage_rolls, damage_values,
+                                     damage_resistance_values):
+        get_odds(*matchup)
+    return len(_odds_table)
@@ -0,0 +1,145 @@
+"""
+handhRL - level packs
+
+Prebaked levels for machines where running the generator visibly stalls the game. A pack holds any
+number of finished levels per dungeon level: the map as hhgrid bitmasks, the rooms, the player's
+start and the spawned objects. The file is memory-mapped, so opening a pack only reads its index and
+loading a level only touches that level's bytes.
+
+Packs are built offline with hhmaptool:
+
+    python hhmaptool.py pack --levels 1-13 --count 20 --out levels.hhp
+"""
+
+import io
+import mmap
+import pickle
+import random
+import struct
+
+import hhgrid
+
+
+# pack layout: magic, level records, index of (dungeon level, seed, offset, length) entries, then a
+# trailer with the index offset and entry count
+PACK_MAGIC = b'HHP1'
+INDEX_ENTRY = struct.Struct('<IIII')
+TRAILER = struct.Struct('<II')
+
+# objects in a record are pickled from the game module, which is '__main__' when the game is run
+# directly and 'handhrl' when a tool imports it
+GAME_MODULES = ('handhrl', '__main__')
+
+
+def encode_level(seed, dungeon_level, level_map, objects, player, stairs, rooms, start=None):
+    # one pack record for the level in the given game state. start is where the player enters the
+    # level (default: where the player is now)
+    width = len(level_map)
+    height = len(level_map[0])
+    blocked = hhgrid.pack([[level_map[x][y].blocked for x in range(width)] for y in range(height)], width)
+    opaque = hhgrid.pack([[level_map[x][y].block_sight for x in range(width)] for y in range(height)], width)
+    rubble = hhgrid.pack([[level_map[x][y].rubble for x in range(width)] for y in range(height)], width)
+    explored = hhgrid.pack([[level_map[x][y].explored for x in range(width)] for y in range(height)], width)
+    tints = bytearray(level_map[x][y].tint for y in range(height) for x in range(width))
+    spawns = [obj for obj in objects if obj is not player]
+    record = {'seed': seed,
+              'dungeon_level': dungeon_level,
+              'size': (width, height),
+              'blocked': blocked,
+              'opaque': opaque,
+              'rubble': rubble,
+              'explored': explored,
+              'tints': bytes(tints) if any(tints) else None,
+              'start': start or (player.x, player.y),
+              'rooms': [(room.x1, room.y1, room.x2 - room.x1, room.y2 - room.y1) for room in rooms],
+              'objects': spawns,
+              'stairs_index': spawns.index(stairs)}
+    return pickle.dumps(record, 2)
+
+
+class _GameUnpickler(pickle.Unpickler):
+    # resolves the game's classes and functions from the namespace of the running game module
+    def __init__(self, blob, namespace):
+        pickle.Unpickler.__init__(self, io.BytesIO(blob))
+        self.namespace = namespace
+
+    def find_class(self, module, name):
+        if module in GAME_MODULES:
+            return self.namespace[name]
+        return pickle.Unpickler.find_class(self, module, name)
+
+
+def decode_level(blob, namespace):
+    # a record back out of encode_level(). namespace is the game module's globals()
+    return _GameUnpickler(blob, namespace).load()
+
+
+def level_rows(record):
+    # (blocked, block_sight, tint) rows for a record's map, one row per y. tint is None for levels
+    # built without the terrain layer
+    (width, height) = record['size']
+    blocked = hhgrid.unpack(record['blocked'], width, height)
+    opaque = hhgrid.unpack(record['opaque'], width, height)
+    tints = None
+    if record['tints'] is not None:
+        values = bytearray(record['tints'])
+        tints = [values[y * width:(y + 1) * width] for y in range(height)]
+    return blocked, opaque, tints
+
+
+def write_pack(path, records):
+    # write (dungeon level, seed, record) triples to a pack file
+    index = []
+    with open(path, 'wb') as f:
+        f.write(PACK_MAGIC)
+        offset = len(PACK_MAGIC)
+        for dungeon_level, seed, blob in records:
+            f.write(blob)
+            index.append(INDEX_ENTRY.pack(dungeon_level, seed, offset, len(blob)))
+            offset += len(blob)
+        f.write(b''.join(index))
+        f.write(TRAILER.pack(offset, len(index)))
+    return len(index)
+
+
+class LevelPack:
+    # a memory-mapped pack file. levels are decoded on demand, straight from the mapping
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(PACK_MAGIC)] != PACK_MAGIC:
+            self.close()
+            raise ValueError(path + ' is not a level pack')
+
+        (index_offset, entries) = TRAILER.unpack_from(self.data, len(self.data) - TRAILER.size)
+        # dungeon level: [(seed, offset, length), ...]
+        self.index = {}
+        for i in range(entries):
+            (dungeon_level, seed, offset, length) = INDEX_ENTRY.unpack_from(self.data,
+                                                                          index_offset + i * INDEX_ENTRY.size)
+            self.index.setdefault(dungeon_level, []).append((seed, offset, length))
+
+    def levels(self):
+        return sorted(self.index)
+
+    def count(self, dungeon_level):
+        return len(self.index.get(dungeon_level, []))
+
+    def read(self, dungeon_level, namespace, seed=None):
+        # decode one of the stored levels for a dungeon level: the given seed, or a random one.
+        # returns None if the pack has nothing for it
+        entries = self.index.get(dungeon_level)
+        if not entries:
+            return None
+        if seed is None:
+            (seed, offset, length) = random.choice(entries)
+        else:
+            matches = [entry for entry in entries if entry[0] == seed]
+            if not matches:
+                return None
+            (seed, offset, length) = matches[0]
+        return decode_level(self.data[offset:offset + length], namespace)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
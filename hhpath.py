@@ -0,0 +1,90 @@
+"""
+handhRL - pathfinding workers
+
+Works out a batch of A* routes at once on a pool of threads. libtcod does the searching in C, and
+ctypes lets go of the interpreter lock for the length of each call, so the searches really do run side
+by side. Each worker has its own copy of the level's walkability map and its own path object, so no
+two searches ever share libtcod state. Routes come back in the order they were asked for, whichever
+worker finishes first.
+"""
+
+import multiprocessing
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import libtcodpy as libtcod
+
+
+# threads in a pool: one per core, up to four. with a single core there is nothing to gain
+try:
+    WORKERS = min(4, multiprocessing.cpu_count())
+except NotImplementedError:
+    WORKERS = 1
+
+
+def route(path, x, y, target_x, target_y):
+    # the route from x, y to the target with a libtcod path object, as a list of steps with the next
+    # step last (empty if there isn't one)
+    if not libtcod.path_compute(path, x, y, target_x, target_y):
+        return []
+    return [libtcod.path_get(path, i) for i in range(libtcod.path_size(path) - 1, -1, -1)]
+
+
+class PathPool:
+    # worker threads with copies of a libtcod map (width by height), for as long as that map is in use
+    def __init__(self, source_map, width, height, workers=WORKERS):
+        self.requests = queue.Queue()
+        self.done = threading.Condition()
+        self.results = None
+        self.remaining = 0
+        self.maps = []
+        self.threads = []
+        for i in range(workers):
+            worker_map = libtcod.map_new(width, height)
+            libtcod.map_copy(source_map, worker_map)
+            self.maps.append(worker_map)
+            thread = threading.Thread(target=self.run, args=(worker_map,), name='pathfinder ' + str(i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self, worker_map):
+        path = libtcod.path_new_using_map(worker_map)
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            (index, (x, y, target_x, target_y)) = request
+            found = route(path, x, y, target_x, target_y)
+            with self.done:
+                self.results[index] = found
+                self.remaining -= 1
+                if self.remaining == 0:
+                    self.done.notify_all()
+        libtcod.path_delete(path)
+
+    def routes(self, requests):
+        # routes for a list of (x, y, target x, target y) requests, in the same order
+        with self.done:
+            self.results = [None] * len(requests)
+            self.remaining = len(requests)
+        for request in enumerate(requests):
+            self.requests.put(request)
+        with self.done:
+            while self.remaining:
+                self.done.wait()
+            (results, self.results) = (self.results, None)
+        return results
+
+    def close(self):
+        # stop the workers and free their maps
+        for thread in self.threads:
+            self.requests.put(None)
+        for thread in self.threads:
+            thread.join()
+        for worker_map in self.maps:
+            libtcod.map_delete(worker_map)
@@ -0,0 +1,305 @@
+"""
+handhRL - background saving
+
+Saves are made off the main thread. The game copies what the save needs and hands over a function
+that builds the save from the copy, and a writer thread runs it, pickles the result, then compresses
+it and puts it on disk, so play never stops for a save. Every write goes to a temporary file that
+only replaces the save once it is complete, so a crash or power cut mid-write leaves the previous
+save intact.
+
+A save is a stream of separately compressed chunks, one per entry (the map or level, the objects, the
+inventory, the message log and so on). Loading reads the chunk headers and only decompresses the
+chunks that are asked for, so a save can be inspected without loading the whole game:
+
+    python hhsave.py savegame
+    python hhsave.py savegame --show game_msgs
+"""
+
+import atexit
+import os
+import struct
+import threading
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+SAVE_MAGIC = b'HHS2'
+OLD_SAVE_MAGIC = b'HHS1'  # one pickled dict of entries, uncompressed
+
+# each chunk: name length and name, then codec, uncompressed length and compressed length, then the
+# data. a zero name length ends the stream
+CHUNK_NAME = struct.Struct('<H')
+CHUNK_HEADER = struct.Struct('<cII')
+
+# 'zlib', or 'lzma' for smaller saves where the lzma module is available (python 3)
+CODEC = 'zlib'
+COMPRESS_LEVEL = 6
+
+# saves waiting for the writer, newest only (path: build function), and how many it is working on at all
+_lock = threading.Condition()
+_pending = {}
+_busy = 0
+_thread = None
+_stopping = False
+_error = None
+
+
+def snapshot(entries):
+    # pickle each entry of a name: value dict
+    return dict((name, pickle.dumps(value, 2)) for name, value in entries.items())
+
+
+def save(path, build):
+    # queue a save to path. build() is called on the writer thread, while the game carries on, so it
+    # must only use what was copied for it. it returns (entries, files, done): the name: value entries
+    # to save, other files to write before it as [(path, bytes)], and a function to call once it is in
+    # place, or None. a save still waiting replaces the one queued before it
+    global _thread, _stopping
+    with _lock:
+        _pending[path] = build
+        if _thread is None:
+            _stopping = False
+            _thread = threading.Thread(target=_run, name='save writer')
+            _thread.daemon = True
+            _thread.start()
+        _lock.notify_all()
+
+
+def _run():
+    global _busy, _error
+    while True:
+        with _lock:
+            while not _pending and not _stopping:
+                _lock.wait()
+            if not _pending:
+                return
+            (path, build) = _pending.popitem()
+            _busy += 1
+        try:
+            (entries, files, done) = build()
+            data = snapshot(entries)
+            for (file_path, contents) in files:
+                write_file(file_path, contents)
+            write_atomic(path, data)
+            if done is not None:
+                done()
+        except Exception as e:
+            # (kept for the game to report, rather than losing the writer)
+            _error = path + ': ' + str(e)
+        finally:
+            with _lock:
+                _busy -= 1
+                _lock.notify_all()
+
+
+def compress(data):
+    # (codec byte, compressed data). chunks too small to gain anything are stored as they are
+    if CODEC == 'lzma' and lzma is not None:
+        (codec, packed) = (b'x', lzma.compress(data))
+    else:
+        (codec, packed) = (b'z', zlib.compress(data, COMPRESS_LEVEL))
+    if len(packed) >= len(data):
+        return b'-', data
+    return codec, packed
+
+
+def decompress(codec, data):
+    if codec == b'-':
+        return data
+    if codec == b'x':
+        if lzma is None:
+            raise IOError('save chunk is lzma compressed, which needs python 3')
+        return lzma.decompress(data)
+    return zlib.decompress(data)
+
+
+def write_chunks(f, data):
+    # stream a snapshot() to an open file, compressing one chunk at a time
+    f.write(SAVE_MAGIC)
+    for name in sorted(data):
+        raw = data[name]
+        (codec, packed) = compress(raw)
+        encoded_name = name.encode('ascii')
+        f.write(CHUNK_NAME.pack(len(encoded_name)) + encoded_name)
+        f.write(CHUNK_HEADER.pack(codec, len(raw), len(packed)))
+        f.write(packed)
+    f.write(CHUNK_NAME.pack(0))
+
+
+def write_file(path, contents):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as f:
+        f.write(contents)
+
+
+def write_atomic(path, data):
+    # write a snapshot() to a temporary file, then rename it over path
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        write_chunks(f, data)
+        f.flush()
+        os.fsync(f.fileno())
+    if hasattr(os, 'replace'):
+        os.replace(temp, path)
+    else:
+        # (python 2 can't rename over an existing file on Windows)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(temp, path)
+
+
+def wait():
+    # block until every queued save is on disk
+    with _lock:
+        while _pending or _busy:
+            _lock.wait()
+
+
+def stop():
+    # write any queued saves, then stop the writer. called on the way out of the game, so the
+    # writer is never left running while the interpreter shuts down
+    global _thread, _stopping
+    with _lock:
+        (thread, _thread) = (_thread, None)
+        _stopping = True
+        _lock.notify_all()
+    if thread is not None:
+        thread.join()
+
+
+atexit.register(stop)
+
+
+def pop_error():
+    # the last failed write as a message, or None. clears it
+    global _error
+    (error, _error) = (_error, None)
+    return error
+
+
+class SaveFile:
+    # an open save. the chunk headers are read up front; each chunk is read, decompressed and
+    # unpickled only when it is asked for
+    def __init__(self, f):
+        self.file = f
+        # name: (codec, offset, uncompressed length, compressed length)
+        self.chunks = {}
+        while True:
+            (length,) = CHUNK_NAME.unpack(read_exactly(f, CHUNK_NAME.size))
+            if length == 0:
+                break
+            name = read_exactly(f, length).decode('ascii')
+            (codec, raw_length, packed_length) = CHUNK_HEADER.unpack(read_exactly(f, CHUNK_HEADER.size))
+            self.chunks[name] = (codec, f.tell(), raw_length, packed_length)
+            f.seek(packed_length, 1)
+
+    def __contains__(self, name):
+        return name in self.chunks
+
+    def names(self):
+        return sorted(self.chunks)
+
+    def read(self, name):
+        # the pickled bytes of one chunk
+        (codec, offset, raw_length, packed_length) = self.chunks[name]
+        self.file.seek(offset)
+        return decompress(codec, read_exactly(self.file, packed_length))
+
+    def __getitem__(self, name):
+        return pickle.loads(self.read(name))
+
+    def close(self):
+        self.file.close()
+
+
+class OldSaveFile:
+    # the entries of a save in the old single-pickle format
+    def __init__(self, entries):
+        self.entries = entries
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __getitem__(self, name):
+        return pickle.loads(self.entries[name])
+
+    def close(self):
+        pass
+
+
+def read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise IOError('save file is cut short')
+    return data
+
+
+def open_save(path):
+    # a SaveFile for path once any queued save to it is written, or None if there is no such file or
+    # it isn't in this format (older games were saved with shelve)
+    wait()
+    if not os.path.isfile(path):
+        return None
+    f = open(path, 'rb')
+    magic = f.read(len(SAVE_MAGIC))
+    if magic == SAVE_MAGIC:
+        try:
+            return SaveFile(f)
+        except:
+            f.close()
+            raise
+    if magic == OLD_SAVE_MAGIC:
+        entries = pickle.loads(f.read())
+        f.close()
+        return OldSaveFile(entries)
+    f.close()
+    return None
+
+
+def remove(path):
+    # delete a save, once any queued write to it is done
+    with _lock:
+        _pending.pop(path, None)
+    wait()
+    os.remove(path)
+
+
+def main():
+    # list the chunks of a save, or print one of them
+    import argparse
+    parser = argparse.ArgumentParser(description='Inspect a handhRL save file.')
+    parser.add_argument('path', nargs='?', default='savegame')
+    parser.add_argument('--show', help='chunk to print')
+    args = parser.parse_args()
+
+    save = open_save(args.path)
+    if save is None or not isinstance(save, SaveFile):
+        parser.error(args.path + ' is not a chunked save')
+
+    if args.show:
+        # chunks holding game objects refer to the game module's classes
+        import hhpack
+        import handhrl
+        print(repr(hhpack.decode_level(save.read(args.show), vars(handhrl))))
+    else:
+        print('chunk             codec    bytes  compressed')
+        for name in save.names():
+            (codec, offset, raw_length, packed_length) = save.chunks[name]
+            print('{0: <16} {1: >6} {2: >8} {3: >11}'.format(name, codec.decode('ascii'), raw_length,
+                                                              packed_length))
+    save.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+handhRL - turn scheduler
+
+Decides which actors act and when. Every actor waits in a heap keyed on the game time of its next
+action. Each player action moves the clock on by one action's worth of time, and only the actors that
+have come due are popped, given their turn and pushed back for their next one. Speed is how soon that
+is: an actor twice as fast as normal acts twice per player action, one half as fast every other
+action. Actors that aren't scheduled, such as sleeping ones, cost nothing at all.
+"""
+
+import heapq
+
+
+# game time one action takes at normal speed
+ACTION_TIME = 100
+NORMAL_SPEED = 100
+
+
+def action_delay(actor):
+    # how long until an actor acts again, from its speed
+    return ACTION_TIME * NORMAL_SPEED // max(1, actor.speed)
+
+
+class Scheduler:
+    # the actors of one level, by when they act next
+    def __init__(self, now=0):
+        self.now = now
+        # (time, sequence number, actor). the sequence number makes actors due at the same time act in
+        # the order they were scheduled, and keeps the heap from ever comparing actors
+        self.heap = []
+        self.sequence = 0
+        # actor: sequence number of its live heap entry. entries for actors since removed or
+        # rescheduled stay in the heap until they surface, then are skipped
+        self.entries = {}
+
+    def __contains__(self, actor):
+        return actor in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, actor, delay=None):
+        # schedule an actor to act after delay (by default a full action from now), replacing any
+        # time it was scheduled for before
+        if delay is None:
+            delay = action_delay(actor)
+        self.push(self.now + delay, actor)
+
+    def push(self, time, actor):
+        self.sequence += 1
+        self.entries[actor] = self.sequence
+        heapq.heappush(self.heap, (time, self.sequence, actor))
+
+    def remove(self, actor):
+        # stop scheduling an actor
+        self.entries.pop(actor, None)
+
+    def advance(self, time=ACTION_TIME):
+        # move the clock on, then yield each actor that comes due, soonest first. an actor is
+        # scheduled for its next action before it is yielded, so it can remove itself while acting.
+        # actors with no ai left (dead ones) are dropped
+        self.now += time
+        while self.heap and self.heap[0][0] <= self.now:
+            (due, sequence, actor) = heapq.heappop(self.heap)
+            if self.entries.get(actor) != sequence:
+                continue
+            if actor.ai is None:
+                del self.entries[actor]
+                continue
+            self.push(due + action_delay(actor), actor)
+            yield actor
+
+    def state(self, actors):
+        # (clock, [(time, index into actors), ...] in the order they will act) for a save
+        index = dict((id(actor), i) for (i, actor) in enumerate(actors))
+        pending = sorted(entry for entry in self.heap if self.entries.get(entry[2]) == entry[1])
+        return self.now, [(time, index[id(actor)]) for (time, sequence, actor) in pending if id(actor) in index]
+
+
+def restore(state, actors):
+    # a Scheduler from state() and the same list of actors
+    (now, pending) = state
+    scheduler = Scheduler(now)
+    for (time, index) in pending:
+        scheduler.push(time, actors[index])
+    return scheduler
@@ -0,0 +1,250 @@
+"""
+handhRL - high scores
+
+Scores are appended to a ledger file that is never rewritten, and a small index of the best scores
+is kept beside it: each entry's score and where it sits in the ledger. Recording a score is one
+append plus a binary search of the index; showing the leaderboard reads the index and seeks to the
+handful of ledger entries it names. Neither touches the rest of the ledger, however many runs it
+holds.
+
+Games running at the same time can share the files: each score is appended to the ledger with
+O_APPEND, and the index is brought up to date under a lock on the ledger. Nothing is ever cut from
+the ledger. An entry a crash tore short is padded out to its full length by the next run to add a
+score (see pad_torn), and passed over when the ledger is read.
+
+Each entry is a score_data list as built by new_score: [score, name, killed by, dungeon level].
+"""
+
+import bisect
+import os
+import shelve
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+LEDGER_FILE = 'scores.ledger'
+INDEX_FILE = 'scores.top'
+OLD_SCORE_FILE = 'scorefile'  # the shelve scores were kept in before
+
+# scores kept in the index; the leaderboard can show up to this many
+TOP_SCORES = 100
+
+# ledger entry: score, then the lengths of the name, killed-by and level strings that follow (utf-8)
+ENTRY = struct.Struct('<iBBB')
+
+# index: magic, how many bytes of the ledger it covers and its entry count, then (score, offset) pairs
+INDEX_MAGIC = b'HHT1'
+INDEX_HEADER = struct.Struct('<4sII')
+INDEX_ENTRY = struct.Struct('<iI')
+
+# what a run with no cause of death is recorded as killed by (hhleader counts it the same way)
+UNKNOWN_KILLER = 'unknown'
+
+
+def encode_entry(score_data):
+    (score, name, killed_by, level) = score_data
+    if killed_by is None:
+        killed_by = UNKNOWN_KILLER
+    fields = [text_bytes(name), text_bytes(killed_by), text_bytes(level)]
+    return ENTRY.pack(score, *[len(field) for field in fields]) + b''.join(fields)
+
+
+def text_bytes(text):
+    # utf-8, cut to the 255 bytes an entry has room for. never with a zero byte, which only the padding
+    # of a torn entry has
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return text.replace(b'\0', b'')[:255]
+
+
+def read_entry(f):
+    # the score_data at the ledger's current position, None at the end (or at a torn last entry), or
+    # False for a torn entry that was padded out
+    header = f.read(ENTRY.size)
+    if len(header) < ENTRY.size:
+        return None
+    (score, name_length, killed_by_length, level_length) = ENTRY.unpack(header)
+    fields = []
+    for length in (name_length, killed_by_length, level_length):
+        field = f.read(length)
+        if len(field) < length:
+            return None
+        fields.append(field)
+    if any(b'\0' in field for field in fields):
+        return False
+    # (python 2 keeps byte strings, which is what the console prints)
+    return [score] + [field if str is bytes else field.decode('utf-8', 'replace') for field in fields]
+
+
+def pad_torn(fd, torn):
+    # append what a torn last entry (its bytes so far) is missing, so the entries after it can be read.
+    # missing header bytes are 0xff and missing text is zero bytes, so the entry always has a zero byte
+    # in its text and read_entry passes over it
+    header = torn[:ENTRY.size] + b'\xff' * (ENTRY.size - min(len(torn), ENTRY.size))
+    length = ENTRY.size + sum(ENTRY.unpack(header)[1:])
+    os.write(fd, header[len(torn):] + b'\0' * (length - max(len(torn), ENTRY.size)))
+
+
+def lock(fd):
+    # wait for the lock on an open ledger (its first byte, on Windows)
+    if fcntl is not None:
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+
+
+def close_ledger(fd):
+    # unlock and close a ledger from open_ledger
+    if fcntl is None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    os.close(fd)
+
+
+def load_index():
+    # (ledger bytes covered, [(-score, offset), ...] best first) from the index file
+    try:
+        with open(INDEX_FILE, 'rb') as f:
+            data = f.read()
+        (magic, covered, count) = INDEX_HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC or len(data) != INDEX_HEADER.size + count * INDEX_ENTRY.size:
+            raise ValueError('bad score index')
+    except (IOError, struct.error, ValueError):
+        return 0, []
+    top = []
+    for i in range(count):
+        (score, offset) = INDEX_ENTRY.unpack_from(data, INDEX_HEADER.size + i * INDEX_ENTRY.size)
+        top.append((-score, offset))
+    return covered, top
+
+
+def save_index(covered, top):
+    data = [INDEX_HEADER.pack(INDEX_MAGIC, covered, len(top))]
+    data.extend(INDEX_ENTRY.pack(-key, offset) for (key, offset) in top)
+    temp = INDEX_FILE + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(b''.join(data))
+    if os.name == 'nt' and os.path.exists(INDEX_FILE):
+        os.remove(INDEX_FILE)
+    os.rename(temp, INDEX_FILE)
+
+
+def insert_top(top, score, offset):
+    # put a ledger entry into the sorted top list if it makes the cut (ties keep the older run first)
+    entry = (-score, offset)
+    if len(top) >= TOP_SCORES and entry >= top[-1]:
+        return False
+    bisect.insort(top, entry)
+    del top[TOP_SCORES:]
+    return True
+
+
+def catch_up(covered, top):
+    # index any ledger entries past the part the index covers: ones added by a run that stopped before
+    # updating the index, or the whole ledger if the index was lost. returns the new covered length,
+    # which stops short of a torn last entry
+    if not os.path.isfile(LEDGER_FILE) or os.path.getsize(LEDGER_FILE) <= covered:
+        return covered
+    with open(LEDGER_FILE, 'rb') as f:
+        f.seek(covered)
+        while True:
+            offset = f.tell()
+            score_data = read_entry(f)
+            if score_data is None:
+                return offset
+            if score_data is not False:
+                insert_top(top, score_data[0], offset)
+
+
+def migrate(fd):
+    # bring the scores from the old shelve into a new ledger, once. called with the ledger locked
+    if os.fstat(fd).st_size > 0:
+        return
+    try:
+        scores = shelve.open(OLD_SCORE_FILE, 'r')
+    except:
+        return
+    try:
+        old = scores['scores'] if 'scores' in scores else []
+    finally:
+        scores.close()
+    os.write(fd, b''.join(encode_entry(score_data) for score_data in old))
+
+
+def open_ledger():
+    # the ledger, created if need be, opened for appending and locked, with any old scores migrated
+    fd = os.open(LEDGER_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+    try:
+        lock(fd)
+        migrate(fd)
+    except:
+        os.close(fd)
+        raise
+    return fd
+
+
+def update_index(fd):
+    # (covered, top) for the index brought up to date with the ledger, padding out a torn last entry.
+    # called with the ledger locked
+    end = os.fstat(fd).st_size
+    (covered, top) = load_index()
+    if covered > end:
+        # (an index for some other ledger)
+        (covered, top) = (0, [])
+    covered = catch_up(covered, top)
+    if covered < end:
+        with open(LEDGER_FILE, 'rb') as f:
+            f.seek(covered)
+            pad_torn(fd, f.read())
+        covered = os.fstat(fd).st_size
+    return covered, top
+
+
+def add_score(score_data):
+    # append a score to the ledger and update the top index
+    fd = open_ledger()
+    try:
+        (covered, top) = update_index(fd)
+        os.write(fd, encode_entry(score_data))
+        insert_top(top, score_data[0], covered)
+        save_index(os.fstat(fd).st_size, top)
+    finally:
+        close_ledger(fd)
+
+
+def top_scores(count):
+    # the best `count` scores, best first, as score_data lists
+    fd = open_ledger()
+    try:
+        indexed = load_index()[0]
+        (covered, top) = update_index(fd)
+        if covered != indexed:
+            save_index(covered, top)
+    finally:
+        close_ledger(fd)
+
+    scores = []
+    if top:
+        with open(LEDGER_FILE, 'rb') as f:
+            for (key, offset) in top[:count]:
+                f.seek(offset)
+                scores.append(read_entry(f))
+    return scores
+
+
+def all_scores():
+    # every score in the ledger, oldest first
+    close_ledger(open_ledger())
+    with open(LEDGER_FILE, 'rb') as f:
+        while True:
+            score_data = read_entry(f)
+            if score_data is None:
+                return
+            if score_data is not False:
+                yield score_data
@@ -0,0 +1,210 @@
+"""
+handhRL - combat simulator
+
+Headless Monte Carlo balance tool. Pits monsters from the monster table against player builds
+rolled from the weapon and armor tables, resolving every fight with the game's own Fighter.attack,
+and spreads the fights across every CPU core.
+
+Run from the game directory (libtcod is loaded from there):
+
+    python hhsim.py --fights 1000000 --levels 1-13
+"""
+
+import argparse
+import multiprocessing
+import random
+import time
+
+import libtcodpy as libtcod
+import hhtable
+import handhrl
+
+
+# fights handed to a worker at a time, and the round limit before a fight is called a draw
+CHUNK_SIZE = 2000
+MAX_ROUNDS = 500
+
+
+def make_build(player_level):
+    # roll a player the way new_game does, level them up and arm them from the weapon and armor tables
+    fighter_component = handhrl.Fighter(hp=hhtable.rolldice(3, 6) + hhtable.rolldice(1, 10),
+                                        armor_class=10, to_hit=1, damage=1,
+                                        damage_roll=[1, 3], xp=0)
+    player = handhrl.Object(0, 0, chr(1), 'player', libtcod.white, blocks=True, fighter=fighter_component)
+    player.level = player_level
+
+    # same gains as check_level_up (which can't run here, as it redraws the screen)
+    for level in range(2, player_level + 1):
+        if level <= 6:
+            hit_die = hhtable.rolldice(1, 10)
+        else:
+            hit_die = 3
+        fighter_component.base_max_hp += hit_die
+        fighter_component.hp += hit_die
+        if level <= 6 or level % 2 == 0:
+            fighter_component.base_to_hit += 1
+            fighter_component.base_damage += 1
+
+    # the starting knife stays in the pack as a fallback for when a gun runs dry
+    knife = handhrl.Object(0, 0, '-', 'combat knife', libtcod.sky,
+                           equipment=handhrl.Equipment(slot='right hand', damage_roll=[1, 4]))
+    weapon = handhrl.get_weapon(0, 0)
+    armor = handhrl.get_armor(0, 0)
+
+    handhrl.player = player
+    handhrl.inventory = [knife, weapon, armor]
+    weapon.equipment.equip()
+    armor.equipment.equip()
+
+    return player, knife, weapon
+
+
+def fight(dungeon_level, player_level):
+    # one fight to the death against a random monster for this level.
+    # returns (monster name, outcome, rounds) where outcome is 'win', 'loss' or 'draw'
+    player, knife, weapon = make_build(player_level)
+
+    monster_table = hhtable.make_monster_table(dungeon_level)
+    name, hitdice, color = monster_table[random_key(monster_table)][1]
+    monster = handhrl.get_monster_from_hitdice(1, 0, name, hitdice, color)
+
+    handhrl.objects = [player, monster]
+    gun = weapon.equipment if weapon.equipment.ranged else None
+
+    for rounds in range(1, MAX_ROUNDS + 1):
+        # the player swaps to the knife when out of ammo, rather than clicking an empty gun
+        if gun is not None and gun.is_equipped and gun.ammo < 1:
+            knife.equipment.equip()
+
+        player.fighter.attack(monster)
+        if monster.fighter is None:
+            return name, 'win', rounds
+
+        monster.fighter.attack(player)
+        if player.fighter.hp <= 0:
+            return name, 'loss', rounds
+
+    return name, 'draw', MAX_ROUNDS
+
+
+def random_key(table):
+    # pick a key the same way place_objects does, but independent of dict ordering across processes
+    return random.choice(sorted(table.keys()))
+
+
+def run_chunk(task):
+    # worker entry point: run a seeded batch of fights for one level and return the tallies
+    dungeon_level, player_level, seed, count = task
+    hhtable.seed_rng(seed)
+    handhrl.game_msgs = []
+
+    tally = {}
+    for x in range(count):
+        name, outcome, rounds = fight(dungeon_level, player_level)
+        entry = tally.setdefault(name, {'win': 0, 'loss': 0, 'draw': 0, 'rounds': 0, 'win_rounds': 0})
+        entry[outcome] += 1
+        entry['rounds'] += rounds
+        if outcome == 'win':
+            entry['win_rounds'] += rounds
+
+        # keep the message log from growing without bound
+        del handhrl.game_msgs[:]
+
+    return dungeon_level, tally
+
+
+def merge(totals, dungeon_level, tally):
+    level = totals.setdefault(dungeon_level, {})
+    for name, entry in tally.items():
+        merged = level.setdefault(name, {'win': 0, 'loss': 0, 'draw': 0, 'rounds': 0, 'win_rounds': 0})
+        for k, v in entry.items():
+            merged[k] += v
+
+
+def simulate(levels, fights, player_level=None, seed=0, processes=None):
+    # run `fights` fights per dungeon level across a process pool.
+    # player_level=None matches the player's level to the dungeon level.
+    # returns {dungeon_level: {monster name: tallies}}
+    tasks = []
+    for dungeon_level in levels:
+        level_of_player = player_level or dungeon_level
+        remaining = fights
+        while remaining > 0:
+            count = min(CHUNK_SIZE, remaining)
+            tasks.append((dungeon_level, level_of_player, seed + len(tasks), count))
+            remaining -= count
+
+    totals = {}
+    pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+    try:
+        for dungeon_level, tally in pool.imap_unordered(run_chunk, tasks):
+            merge(totals, dungeon_level, tally)
+    finally:
+        pool.close()
+        pool.join()
+
+    return totals
+
+
+def summarize(entries):
+    fought = sum(e['win'] + e['loss'] + e['draw'] for e in entries)
+    wins = sum(e['win'] for e in entries)
+    losses = sum(e['loss'] for e in entries)
+    rounds = sum(e['rounds'] for e in entries)
+    win_rounds = sum(e['win_rounds'] for e in entries)
+    return {'fights': fought,
+            'win_rate': wins / float(fought) if fought else 0.0,
+            'loss_rate': losses / float(fought) if fought else 0.0,
+            'mean_rounds': rounds / float(fought) if fought else 0.0,
+            'mean_win_rounds': win_rounds / float(wins) if wins else 0.0}
+
+
+def report(totals, by_monster=False):
+    lines = ['level    fights    win%   loss%  rounds  rounds-to-win']
+    row = '{0: >5} {1: >9} {2: >7.1%} {3: >7.1%} {4: >7.2f} {5: >14.2f}'
+    for dungeon_level in sorted(totals):
+        s = summarize(totals[dungeon_level].values())
+        lines.append(row.format(dungeon_level, s['fights'], s['win_rate'], s['loss_rate'], s['mean_rounds'],
+                                s['mean_win_rounds']))
+        if by_monster:
+            for name in sorted(totals[dungeon_level]):
+                s = summarize([totals[dungeon_level][name]])
+                lines.append('      {0: <20} {1: >7.1%} {2: >7.1%} {3: >7.2f}'.format(
+                    name, s['win_rate'], s['loss_rate'], s['mean_rounds']))
+    return '\n'.join(lines)
+
+
+def parse_levels(text):
+    # '1-13' or '1,3,5'
+    levels = []
+    for part in text.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            levels.extend(range(int(first), int(last) + 1))
+        else:
+            levels.append(int(part))
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Monte Carlo combat simulator for handhRL balance reviews.')
+    parser.add_argument('--fights', type=int, default=100000, help='fights per dungeon level')
+    parser.add_argument('--levels', default='1-13', help="dungeon levels, e.g. '1-13' or '1,5,9'")
+    parser.add_argument('--player-level', type=int, default=None,
+                        help='player experience level (default: same as the dungeon level)')
+    parser.add_argument('--seed', type=int, default=0, help='base seed; each batch of fights gets its own')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--by-monster', action='store_true', help='break results down by monster')
+    args = parser.parse_args()
+
+    start = time.time()
+    totals = simulate(parse_levels(args.levels), args.fights, args.player_level, args.seed, args.processes)
+    elapsed = time.time() - start
+
+    print(report(totals, args.by_monster))
+    fought = sum(summarize(level.values())['fights'] for level in totals.values())
+    print('{0} fights in {1:.1f}s'.format(fought, elapsed))
+
+
+if __name__ == '__main__':
+    main()
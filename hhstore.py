@@ -0,0 +1,174 @@
+"""
+handhRL - level store
+
+Keeps the levels the player has left so they can be revisited. Departed levels are held as compressed
+blobs; the most recently visited stay in memory up to a byte budget, and the least recently visited
+are spilled to files and read back only when the player returns to them.
+
+Spill files go with a save. Each save lists the files it goes with (see commit), and a file a save
+lists is never overwritten, nor deleted until a later save that no longer lists it is in place. A
+level spilled between saves goes to a new file that no save lists yet, so after a crash the files
+the save lists are exactly the levels as they were when it was made, and any written since are
+ignored.
+
+Levels are written from the main thread when they are spilled, and from the save writer thread (see
+hhsave) when a save is made, so the store is locked while it is used.
+"""
+
+import collections
+import os
+import random
+import threading
+import zlib
+
+import hhsave
+
+
+STORE_SUFFIX = '.hhl'
+COMPRESS_LEVEL = 6
+
+# names for the files of levels spilled between saves
+_names = random.SystemRandom()
+
+
+class LevelStore:
+    # departed levels by dungeon level. `path` is the spill directory, `budget` the most bytes of
+    # compressed levels to keep in memory. `manifest` is the spill files listed by the save being
+    # loaded (see commit), {} for a new game, or None for a save from before they were listed, which
+    # used every untagged spill file in the directory. any other spill file in the directory is
+    # deleted once the next save is in place
+    def __init__(self, path, budget, manifest=None):
+        self.path = path
+        self.budget = budget
+
+        self.lock = threading.RLock()
+
+        # dungeon level: blob, least recently visited first
+        self.memory = collections.OrderedDict()
+        self.used = 0
+
+        # dungeon level: its spill file. a level in memory with no file has been departed since the
+        # last save. files being written for a save (see commit) are in `writing` until written()
+        self.files = {}
+        self.writing = set()
+
+        # spill files the save on disk (or the one being written) lists, which stay until a later save
+        # is in place, and those of them the store no longer needs, to delete once it is
+        self.listed = set()
+        self.stale = []
+
+        names = []
+        if os.path.isdir(path):
+            names = [name for name in os.listdir(path) if name.endswith(STORE_SUFFIX)]
+        if manifest is None:
+            for name in names:
+                if name[:-len(STORE_SUFFIX)].isdigit():
+                    self.files[int(name[:-len(STORE_SUFFIX)])] = name
+        else:
+            self.files = dict(manifest)
+        self.listed = set(self.files.values())
+        # anything else was written after the save, by a game that went on and crashed, is left over
+        # from an earlier one, or belongs to a save a new game is about to replace
+        self.stale = [name for name in names if name not in self.listed]
+
+    def __contains__(self, key):
+        return key in self.memory or key in self.files
+
+    def put(self, key, data):
+        # store a departed level, as the most recently visited
+        with self.lock:
+            self.discard(key)
+            blob = zlib.compress(data, COMPRESS_LEVEL)
+            self.memory[key] = blob
+            self.used += len(blob)
+            self.evict()
+
+    def take(self, key):
+        # the data for a level being re-entered, or None if it was never stored. the level is live
+        # again once taken, so it leaves the store until it is departed and put back
+        with self.lock:
+            if key in self.memory:
+                blob = self.memory.pop(key)
+                self.used -= len(blob)
+            elif key in self.files:
+                with open(os.path.join(self.path, self.files[key]), 'rb') as f:
+                    blob = f.read()
+            else:
+                return None
+            self.forget_file(key)
+            return zlib.decompress(blob)
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.used -= len(self.memory.pop(key))
+            self.forget_file(key)
+
+    def forget_file(self, key):
+        # a file a save lists stays until the next save, which no longer lists it, is in place. one
+        # spilled since then is in no save, and goes now
+        if key in self.files:
+            name = self.files.pop(key)
+            if name in self.listed:
+                self.stale.append(name)
+            else:
+                remove_files([os.path.join(self.path, name)])
+
+    def evict(self):
+        # drop the least recently visited levels from memory until it is back under budget. a level
+        # with no spill file yet is written to a new one first. levels whose files are being written
+        # for a save stay until they are on disk, so memory only runs over budget while one is written
+        with self.lock:
+            for key in list(self.memory):
+                if self.used <= self.budget:
+                    break
+                if key not in self.files:
+                    self.spill(key)
+                elif self.files[key] in self.writing:
+                    continue
+                self.used -= len(self.memory.pop(key))
+
+    def spill(self, key):
+        # write a level in memory to a new file, one no save lists and no file in the directory has
+        while True:
+            name = str(key) + '.spill' + str(_names.getrandbits(32)) + STORE_SUFFIX
+            path = os.path.join(self.path, name)
+            if not os.path.exists(path):
+                break
+        hhsave.write_file(path, self.memory[key])
+        self.files[key] = name
+
+    def commit(self, tag):
+        # the spill files for a save tagged `tag` (a number unique to the save): every level in memory
+        # without one gets a new file named for this save. returns (files to write before the save, as
+        # [(path, blob)], the manifest to save with it, files to delete once it is in place). the
+        # levels stay in memory until written() says their files are on disk
+        with self.lock:
+            writes = []
+            for (key, blob) in list(self.memory.items()):
+                if key in self.files and self.files[key] in self.writing:
+                    # (from a save that never made it to disk)
+                    self.writing.discard(self.files[key])
+                    self.forget_file(key)
+                if key not in self.files:
+                    name = str(key) + '.' + str(tag) + STORE_SUFFIX
+                    writes.append((os.path.join(self.path, name), blob))
+                    self.files[key] = name
+                    self.writing.add(name)
+            self.listed = set(self.files.values())
+            (stale, self.stale) = (self.stale, [])
+            return writes, dict(self.files), [os.path.join(self.path, name) for name in stale]
+
+    def written(self, writes):
+        # the files from commit() are on disk, so their levels can be dropped from memory
+        with self.lock:
+            self.writing.difference_update(os.path.basename(path) for (path, blob) in writes)
+            self.evict()
+
+
+def remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -31,6 +31,27 @@ def rolldice(num, sides, highest=0):
         return total
 
 
+def seed_rng(seed):
+    # reseed both generators the game rolls with (libtcod's default generator and python's random),
+    # so the same seed always gives the same dice and the same levels
+    random.seed(seed)
+    rng = libtcod.random_new_from_seed(seed & 0xffffffff)
+    libtcod.random_restore(0, rng)
+    libtcod.random_delete(rng)
+
+
+def save_rng():
+    # snapshot of both generators, to put back with restore_rng
+    return random.getstate(), libtcod.random_save(0)
+
+
+def restore_rng(state):
+    (python_state, rng) = state
+    random.setstate(python_state)
+    libtcod.random_restore(0, rng)
+    libtcod.random_delete(rng)
+
+
 def make_monster_table(dungeon_level):
     # generate the dict table for the monster generation
 
@@ -0,0 +1,42 @@
+"""
+handhRL - timer wheel
+
+Timed events, such as status effects wearing off, kept on a wheel of slots, one per turn, that goes
+round and round. Scheduling an event drops it into the slot for the turn it is due, and each turn
+only that one slot is looked at. A turn when nothing is due costs a single empty check, however many
+effects are running, and nothing needs counting down while it waits.
+
+Events due more than a full turn of the wheel ahead share a slot with earlier ones and are passed
+over until their own turn comes round.
+"""
+
+
+WHEEL_SLOTS = 64
+
+
+class TimerWheel:
+    # events by the turn they are due. `now` is the last turn advanced to
+    def __init__(self, now=0, slots=WHEEL_SLOTS):
+        self.now = now
+        self.slots = [[] for i in range(slots)]
+
+    def schedule(self, turn, event):
+        # have event come due on turn (or on the next turn, if that has already gone)
+        turn = max(turn, self.now + 1)
+        self.slots[turn % len(self.slots)].append((turn, event))
+
+    def advance(self, turn):
+        # move on to turn, yielding the events that come due on the way, in the order they were
+        # scheduled
+        while self.now < turn:
+            self.now += 1
+            slot = self.slots[self.now % len(self.slots)]
+            if not slot:
+                continue
+            due = [event for (when, event) in slot if when == self.now]
+            if len(due) == len(slot):
+                del slot[:]
+            elif due:
+                slot[:] = [entry for entry in slot if entry[0] != self.now]
+            for event in due:
+                yield event
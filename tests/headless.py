@@ -0,0 +1,122 @@
+"""
+handhRL - headless games for the tests
+
+Plays the game without a window. The map and panel consoles are drawn off screen as usual, and what
+would be blitted to the root console is dropped, so render_all still works out FOV and explored tiles.
+Each test script runs in a fresh python process, the way a saved game is loaded by a game started
+after the one that saved it has quit.
+
+libtcod is loaded from the game directory, so the library for the platform has to be in place there
+(handh.sh links it on Linux).
+"""
+
+import os
+import random
+import subprocess
+import sys
+import textwrap
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+GAME_DIR = os.path.dirname(TESTS_DIR)
+DATA_DIR = os.path.join(TESTS_DIR, 'data')
+
+# run ahead of every test script
+PROLOGUE = """
+import sys
+sys.path[:0] = [{game!r}, {tests!r}]
+import headless
+headless.start({directory!r})
+import handhrl
+import libtcodpy as libtcod
+"""
+
+# the keys play() presses: moves in every direction, waiting, and picking up
+MOVE_KEYS = ['KEY_UP', 'KEY_DOWN', 'KEY_LEFT', 'KEY_RIGHT', 'KEY_KP7', 'KEY_KP9', 'KEY_KP1', 'KEY_KP3', 'KEY_SPACE']
+
+# the test script's own __main__, kept alive once the game stands in for it
+script_main = None
+
+
+def run(script, directory):
+    # run a test script in a fresh python process, with the game's files going to directory. returns
+    # what the script printed
+    code = PROLOGUE.format(game=GAME_DIR, tests=TESTS_DIR, directory=directory) + textwrap.dedent(script)
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=GAME_DIR, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    (output, errors) = (text.decode('utf-8', 'replace') for text in process.communicate())
+    if process.returncode != 0:
+        raise AssertionError('test script failed:\n' + output + errors)
+    return output
+
+
+def start(directory):
+    # (in the test process) import the game and set up its consoles, then move to directory. the game
+    # also stands in for __main__, where saves written by the game itself look for its classes
+    global script_main
+    import libtcodpy as libtcod
+    import handhrl
+
+    script_main = sys.modules['__main__']
+    sys.modules['__main__'] = handhrl
+
+    blit = libtcod.console_blit
+
+    def offscreen_blit(source, x, y, width, height, destination, *args):
+        if destination != 0:
+            blit(source, x, y, width, height, destination, *args)
+
+    libtcod.console_blit = offscreen_blit
+    handhrl.con = libtcod.console_new(handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT)
+    handhrl.panel = libtcod.console_new(handhrl.SCREEN_WIDTH, handhrl.PANEL_HEIGHT)
+    handhrl.get_text_entry = lambda header, img: 'Tester'
+    # menus are dismissed without a choice, as if escape was pressed
+    handhrl.menu = lambda header, options, width: None
+    os.chdir(directory)
+
+
+def new_game(seed, hp=1000):
+    # start a new game, from the first save on, with the dice seeded. the player gets enough hit
+    # points to outlast a random walk
+    import handhrl
+    import hhtable
+    hhtable.seed_rng(seed)
+    handhrl.new_game()
+    handhrl.player.fighter.base_max_hp = handhrl.player.fighter.hp = hp
+    handhrl.render_all()
+    handhrl.save_game()
+
+
+def play(seed, turns):
+    # play up to `turns` turns of random moves, journalled as they would be in play_game
+    import handhrl
+    import libtcodpy as libtcod
+    moves = random.Random(seed)
+    mouse = libtcod.Mouse()
+    for turn in range(turns):
+        if handhrl.game_state != 'playing':
+            break
+        handhrl.check_level_up()
+        key = libtcod.Key()
+        key.vk = getattr(libtcod, moves.choice(MOVE_KEYS))
+        if turn % 37 == 0:
+            (key.vk, key.c) = (libtcod.KEY_CHAR, ord('g'))
+        handhrl.journal_key(key)
+        handhrl.play_turn(key, mouse)
+        if handhrl.journal is not None:
+            handhrl.journal.flush()
+        handhrl.render_all()
+
+
+def state():
+    # the state of the game in play, as a string that two processes can compare
+    import handhrl
+    return repr((sorted((obj.name, obj.x, obj.y, obj.fighter and obj.fighter.hp, bool(obj.ai))
+                        for obj in handhrl.objects),
+                 (handhrl.player.x, handhrl.player.y, handhrl.player.fighter.hp, handhrl.player.level),
+                 handhrl.dungeon_level, handhrl.game_turn, handhrl.game_state,
+                 [obj.name for obj in handhrl.inventory],
+                 [line for (line, color) in handhrl.game_msgs],
+                 [(room.x1, room.y1, room.x2, room.y2) for room in handhrl.rooms],
+                 sorted(handhrl.dormant), handhrl.scheduler.state(handhrl.objects),
+                 [tile.explored for column in handhrl.map for tile in column].count(True)))
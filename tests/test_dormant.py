@@ -0,0 +1,81 @@
+"""
+handhRL - dormant monster tests
+
+    python -m unittest discover tests
+"""
+
+import sys
+import unittest
+
+import headless
+
+sys.path.insert(0, headless.GAME_DIR)
+import libtcodpy as libtcod
+import handhrl
+import hhmaptool
+
+
+class DormantTest(unittest.TestCase):
+    def setUp(self):
+        # (initialize_fov clears the map console, which the game only makes once it has a window)
+        handhrl.con = libtcod.console_new(handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT)
+
+    def tearDown(self):
+        libtcod.console_delete(handhrl.con)
+        del handhrl.con
+
+    def start(self, seed, x, y):
+        # a generated level with the player at x, y and FOV worked out from there
+        hhmaptool.generate_level(seed, 4)
+        (handhrl.player.x, handhrl.player.y) = (x, y)
+        handhrl.initialize_fov()
+        libtcod.map_compute_fov(handhrl.fov_map, x, y, handhrl.TORCH_RADIUS, handhrl.FOV_LIGHT_WALLS,
+                                handhrl.FOV_ALGO)
+        handhrl.schedule_level()
+
+    def monsters(self):
+        return [obj for obj in handhrl.objects if obj.ai]
+
+    def test_rooms(self):
+        # every monster is either scheduled or lying dormant in the room it stands in
+        for seed in range(6):
+            hhmaptool.generate_level(seed, 4)
+            (x, y) = handhrl.rooms[0].center()
+            self.start(seed, x, y)
+            dormant = [(index, monster) for (index, monsters) in handhrl.dormant.items() for monster in monsters]
+            self.assertTrue(dormant, seed)
+            for (index, monster) in dormant:
+                self.assertEqual(handhrl.room_at(monster.x, monster.y), index)
+                self.assertFalse(monster in handhrl.scheduler)
+            self.assertEqual(sorted(id(monster) for (index, monster) in dormant) +
+                             sorted(id(monster) for monster in self.monsters() if monster in handhrl.scheduler),
+                             sorted(id(monster) for monster in self.monsters()))
+            for monster in self.monsters():
+                if monster in handhrl.scheduler:
+                    self.assertEqual(handhrl.room_at(monster.x, monster.y), None)
+
+    def test_waking(self):
+        # walking into a room wakes its monsters and only theirs, unless the player can see into others
+        woken = 0
+        for seed in range(6):
+            hhmaptool.generate_level(seed, 4)
+            rooms = list(handhrl.rooms)
+            for index in range(1, len(rooms)):
+                self.start(seed, *rooms[index].center())
+                if index not in handhrl.dormant:
+                    continue
+                woken += 1
+                monsters = handhrl.dormant[index]
+                others = dict(handhrl.dormant)
+                handhrl.wake_rooms()
+                self.assertFalse(index in handhrl.dormant)
+                self.assertTrue(all(monster in handhrl.scheduler for monster in monsters))
+                for (other, sleeping) in others.items():
+                    seen = (libtcod.map_is_in_fov(handhrl.fov_map, *rooms[other].center()) or
+                            any(libtcod.map_is_in_fov(handhrl.fov_map, m.x, m.y) for m in sleeping))
+                    self.assertEqual(other in handhrl.dormant, other != index and not seen, (seed, other))
+        self.assertTrue(woken > 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
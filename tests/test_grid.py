@@ -0,0 +1,207 @@
+"""
+handhRL - bitmask grid tests
+
+Each whole-map operation is checked against a plain tile-by-tile version on small random grids,
+including tiles on the left and right edges, where a shifted row would spill into the next one
+without the spare bit.
+
+    python -m unittest discover tests
+"""
+
+import collections
+import heapq
+import random
+import sys
+import unittest
+
+import headless
+
+sys.path.insert(0, headless.GAME_DIR)
+import hhgrid
+
+
+WIDTH = 9
+HEIGHT = 7
+
+
+def random_rows(rng, chance):
+    return [[rng.random() < chance for x in range(WIDTH)] for y in range(HEIGHT)]
+
+
+def tile_set(rows):
+    return set((x, y) for y in range(HEIGHT) for x in range(WIDTH) if rows[y][x])
+
+
+def mask_of(tiles):
+    mask = 0
+    for (x, y) in tiles:
+        mask |= hhgrid.bit(WIDTH, x, y)
+    return mask
+
+
+def around(x, y):
+    # the 8 neighbours of a tile that are on the map
+    return [(x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+            if (dx or dy) and 0 <= x + dx < WIDTH and 0 <= y + dy < HEIGHT]
+
+
+def steps_from(open_tiles, start):
+    # 8-way steps from the start tiles to every open tile that can be reached, by breadth-first search
+    steps = dict((tile, 0) for tile in start & open_tiles)
+    queue = collections.deque(steps)
+    while queue:
+        tile = queue.popleft()
+        for near in around(*tile):
+            if near in open_tiles and near not in steps:
+                steps[near] = steps[tile] + 1
+                queue.append(near)
+    return steps
+
+
+def costs_from(tile_costs, start):
+    # the cheapest cost from every tile that can be reached to the start tiles, by Dijkstra's algorithm.
+    # tile_costs is what stepping onto each open tile costs
+    costs = {}
+    heap = [(0, tile) for tile in start]
+    while heap:
+        (cost, tile) = heapq.heappop(heap)
+        if tile in costs:
+            continue
+        costs[tile] = cost
+        if tile not in tile_costs:
+            continue
+        for near in around(*tile):
+            if near in tile_costs and near not in costs:
+                heapq.heappush(heap, (cost + tile_costs[tile], near))
+    return costs
+
+
+def random_costs(rng):
+    # a random grid of open tiles in three cost classes, as a tile: cost dict and (cost, mask) classes
+    tile_costs = {}
+    for y in range(HEIGHT):
+        for x in range(WIDTH):
+            if rng.random() < 0.75:
+                tile_costs[(x, y)] = rng.choice((1, 1, 2, 5))
+    classes = [(cost, mask_of(tile for (tile, n) in tile_costs.items() if n == cost)) for cost in (1, 2, 5)]
+    return tile_costs, [(cost, mask) for (cost, mask) in classes if mask]
+
+
+class GridTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(29)
+
+    def test_pack(self):
+        for x in range(20):
+            rows = random_rows(self.rng, 0.5)
+            mask = hhgrid.pack(rows, WIDTH)
+            self.assertEqual(mask, mask_of(tile_set(rows)))
+            self.assertEqual(hhgrid.unpack(mask, WIDTH, HEIGHT), rows)
+            self.assertEqual(hhgrid.count(mask), len(tile_set(rows)))
+            self.assertEqual(sorted(hhgrid.tiles(mask, WIDTH)), sorted(tile_set(rows)))
+            self.assertTrue(all(hhgrid.is_set(mask, WIDTH, x, y) == rows[y][x]
+                                for y in range(HEIGHT) for x in range(WIDTH)))
+        self.assertEqual(hhgrid.full(WIDTH, HEIGHT), mask_of((x, y) for x in range(WIDTH) for y in range(HEIGHT)))
+        self.assertEqual(hhgrid.box(WIDTH, 2, 1, 3, 4), mask_of((x, y) for x in range(2, 5) for y in range(1, 5)))
+
+    def test_grow(self):
+        for x in range(20):
+            tiles = tile_set(random_rows(self.rng, 0.1))
+            grown = set(tiles)
+            for tile in tiles:
+                grown.update(around(*tile))
+            self.assertEqual(hhgrid.grow(mask_of(tiles), WIDTH, HEIGHT), mask_of(grown))
+
+    def test_flood_and_distance(self):
+        for x in range(50):
+            open_tiles = tile_set(random_rows(self.rng, 0.6))
+            if len(open_tiles) < 2:
+                continue
+            (start, goal) = self.rng.sample(sorted(open_tiles), 2)
+            steps = steps_from(open_tiles, set([start]))
+            self.assertEqual(hhgrid.flood(mask_of(open_tiles), mask_of([start]), WIDTH, HEIGHT), mask_of(steps))
+            self.assertEqual(hhgrid.distance(mask_of(open_tiles), mask_of([start]), mask_of([goal]), WIDTH, HEIGHT),
+                             steps.get(goal, -1))
+
+    def test_components(self):
+        for x in range(30):
+            open_tiles = tile_set(random_rows(self.rng, 0.45))
+            regions = []
+            remaining = set(open_tiles)
+            while remaining:
+                region = set(steps_from(open_tiles, set([min(remaining)])))
+                regions.append(region)
+                remaining -= region
+            found = hhgrid.components(mask_of(open_tiles), WIDTH, HEIGHT)
+            self.assertEqual(sorted(found), sorted(mask_of(region) for region in regions))
+            self.assertEqual([hhgrid.count(region) for region in found],
+                             sorted((len(region) for region in regions), reverse=True))
+
+    def test_neighbour_counts(self):
+        for x in range(20):
+            tiles = tile_set(random_rows(self.rng, 0.5))
+            planes = hhgrid.neighbours(mask_of(tiles), WIDTH, HEIGHT)
+            counts = dict(((x, y), sum(near in tiles for near in around(x, y)))
+                          for x in range(WIDTH) for y in range(HEIGHT))
+            self.assertEqual(dict((tile, sum(hhgrid.is_set(plane, WIDTH, tile[0], tile[1]) << i
+                                             for (i, plane) in enumerate(planes))) for tile in counts), counts)
+            for n in range(10):
+                self.assertEqual(hhgrid.at_least(planes, n, WIDTH, HEIGHT),
+                                 mask_of(tile for (tile, count) in counts.items() if count >= n), n)
+
+    def test_border_and_farthest(self):
+        self.assertEqual(hhgrid.border(WIDTH, HEIGHT),
+                         mask_of((x, y) for x in range(WIDTH) for y in range(HEIGHT)
+                                 if x in (0, WIDTH - 1) or y in (0, HEIGHT - 1)))
+        for x in range(30):
+            open_tiles = tile_set(random_rows(self.rng, 0.6))
+            if not open_tiles:
+                continue
+            start = self.rng.choice(sorted(open_tiles))
+            steps = steps_from(open_tiles, set([start]))
+            most = max(steps.values())
+            self.assertEqual(hhgrid.farthest(mask_of(open_tiles), mask_of([start]), WIDTH, HEIGHT),
+                             mask_of(tile for (tile, n) in steps.items() if n == most))
+            self.assertEqual(hhgrid.lowest(mask_of(open_tiles), WIDTH),
+                             min(open_tiles, key=lambda tile: (tile[1], tile[0])))
+
+
+    def test_weighted_distance(self):
+        for i in range(40):
+            (tile_costs, classes) = random_costs(self.rng)
+            # (a start tile may be a wall, which is reached but leads nowhere)
+            start = self.rng.sample([(x, y) for x in range(WIDTH) for y in range(HEIGHT)], self.rng.randint(1, 3))
+            costs = costs_from(tile_costs, start)
+            rings = hhgrid.weighted_distance(classes, mask_of(start), WIDTH, HEIGHT)
+            expected = [mask_of(tile for (tile, cost) in costs.items() if cost == d)
+                        for d in range(max(costs.values()) + 1)]
+            while rings and not rings[-1]:
+                rings.pop()
+            self.assertEqual(rings, expected)
+
+    def test_downhill(self):
+        # every route is made of steps to neighbours, costs what weighted_distance says, and ends on a
+        # start tile; its first `limit` steps are the start of the whole route
+        for i in range(30):
+            (tile_costs, classes) = random_costs(self.rng)
+            start = self.rng.sample(sorted(tile_costs), 2)
+            costs = costs_from(tile_costs, start)
+            rings = hhgrid.weighted_distance(classes, mask_of(start), WIDTH, HEIGHT)
+            for y in range(HEIGHT):
+                for x in range(WIDTH):
+                    route = hhgrid.downhill(rings, classes, x, y, WIDTH, HEIGHT)
+                    if (x, y) not in costs or (x, y) in start:
+                        self.assertEqual(route, [])
+                        continue
+                    here = (x, y)
+                    for step in reversed(route):
+                        self.assertTrue(step in around(*here) and step in tile_costs)
+                        here = step
+                    self.assertTrue(route[0] in start)
+                    self.assertEqual(sum(tile_costs[step] for step in route), costs[(x, y)])
+                    for limit in (1, 2, 3):
+                        self.assertEqual(hhgrid.downhill(rings, classes, x, y, WIDTH, HEIGHT, limit),
+                                         route[-limit:])
+
+if __name__ == '__main__':
+    unittest.main()
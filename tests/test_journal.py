@@ -0,0 +1,73 @@
+"""
+handhRL - action journal tests
+
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import headless
+
+sys.path.insert(0, headless.GAME_DIR)
+import hhjournal
+
+
+class Key:
+    # the fields of a libtcod key that the journal keeps
+    def __init__(self, vk, c, lalt=False):
+        (self.vk, self.c, self.lalt) = (vk, c, lalt)
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self):
+        journal = hhjournal.Journal(self.path, 4000000000, 17)
+        journal.record_key(123, Key(14, 0))
+        journal.record_menu(2)
+        journal.record_menu(None)
+        journal.record_key(2 ** 32 - 1, Key(65, ord('g'), True))
+        journal.record_target(5, 40)
+        journal.record_target(None, None)
+        journal.close()
+        return [(b'K', (123, 14, 0, 0)), (b'M', (2,)), (b'M', (-1,)), (b'K', (2 ** 32 - 1, 65, ord('g'), 1)),
+                (b'T', (5, 40)), (b'T', (-1, -1))]
+
+    def test_round_trip(self):
+        entries = self.write()
+        self.assertEqual(hhjournal.read_journal(self.path, 4000000000), (17, entries))
+
+    def test_torn_entry(self):
+        # a crash part way through writing an entry leaves the ones before it
+        entries = self.write()
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        last = 1 + hhjournal.ENTRIES[b'T'].size
+        for cut in range(1, last + 1):
+            with open(self.path, 'wb') as f:
+                f.write(data[:-cut])
+            self.assertEqual(hhjournal.read_journal(self.path, 4000000000), (17, entries[:-1]), cut)
+
+    def test_other_journals(self):
+        # no journal, one that follows on from another save, and one cut short in its header
+        self.assertEqual(hhjournal.read_journal(self.path, 1), None)
+        self.write()
+        self.assertEqual(hhjournal.read_journal(self.path, 1), None)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(data[:hhjournal.HEADER.size - 1])
+        self.assertEqual(hhjournal.read_journal(self.path, 4000000000), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+"""
+handhRL - level generation tests
+
+    python -m unittest discover tests
+"""
+
+import sys
+import unittest
+
+import headless
+
+sys.path.insert(0, headless.GAME_DIR)
+import libtcodpy as libtcod
+import handhrl
+import hhgrid
+import hhmaptool
+import hhtable
+
+
+class LevelTest(unittest.TestCase):
+    def setUp(self):
+        self.settings = (handhrl.MAP_GENERATOR, handhrl.TERRAIN_LAYER)
+
+    def tearDown(self):
+        (handhrl.MAP_GENERATOR, handhrl.TERRAIN_LAYER) = self.settings
+
+    def test_stairs_behind_monsters(self):
+        # a level whose stairs are walled in by monsters passes the room check but not the stairs check
+        hhmaptool.generate_level(3, 2)
+        self.assertEqual(handhrl.check_map(), [])
+        stairs = handhrl.stairs
+        for (x, y) in hhgrid.tiles(hhgrid.grow(hhgrid.bit(handhrl.MAP_WIDTH, stairs.x, stairs.y), handhrl.MAP_WIDTH,
+                                               handhrl.MAP_HEIGHT), handhrl.MAP_WIDTH):
+            if (x, y) != (stairs.x, stairs.y) and not handhrl.is_blocked(x, y):
+                handhrl.objects.append(handhrl.Object(x, y, 'r', 'rat', libtcod.red, blocks=True))
+        self.assertEqual(handhrl.check_map(), ['stairs cannot be reached'])
+
+    def test_cut_off_room(self):
+        # a room dug into solid rock is reported, and repair tunnels it back to the rest of the level
+        hhmaptool.generate_level(5, 1)
+        rock = ~handhrl.map_mask() & hhgrid.full(handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT)
+        for (x, y) in hhgrid.tiles(rock, handhrl.MAP_WIDTH):
+            box = hhgrid.box(handhrl.MAP_WIDTH, x, y, 6, 6)
+            if x + 6 <= handhrl.MAP_WIDTH and y + 6 <= handhrl.MAP_HEIGHT and box & rock == box:
+                break
+        room = handhrl.Rect(x, y, 5, 5)
+        handhrl.create_room(room)
+        handhrl.rooms.append(room)
+        self.assertEqual(handhrl.check_map(), ['room at {0},{1} is cut off'.format(*room.center())])
+        self.assertEqual(handhrl.check_map(repair=True), [])
+        self.assertEqual(handhrl.check_map(), [])
+
+    def test_levels_pass_the_check(self):
+        for seed in range(5):
+            hhmaptool.generate_level(seed, 1 + seed * 3)
+            self.assertEqual(handhrl.check_map(), [], seed)
+
+    def test_bsp_rooms(self):
+        # every room gets its own leaf, inside the map's outer wall, and the level passes the check
+        # without repairs at larger sizes too
+        saved = (handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT)
+        handhrl.MAP_GENERATOR = 'bsp'
+        try:
+            for (width, height) in ((80, 43), (160, 86)):
+                (handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT) = (width, height)
+                for seed in range(4):
+                    hhmaptool.generate_level(seed, 2, validate=False)
+                    self.assertEqual(handhrl.check_map(), [], (width, seed))
+                    rooms = handhrl.rooms
+                    interiors = [set((x, y) for x in range(room.x1 + 1, room.x2) for y in range(room.y1 + 1, room.y2))
+                                 for room in rooms]
+                    self.assertEqual(sum(len(tiles) for tiles in interiors), len(set.union(*interiors)))
+                    self.assertTrue(all(0 < x < width - 1 and 0 < y < height - 1 for (x, y) in set.union(*interiors)))
+                    self.assertEqual((handhrl.player.x, handhrl.player.y), rooms[0].center())
+                    self.assertEqual((handhrl.stairs.x, handhrl.stairs.y), rooms[-1].center())
+        finally:
+            (handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT) = saved
+
+    def test_caves(self):
+        # one connected cave, with a zone for every block of it that has floor, at an uneven size too
+        saved = (handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT)
+        handhrl.MAP_GENERATOR = 'caves'
+        try:
+            for (width, height) in ((80, 43), (97, 51)):
+                (handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT) = (width, height)
+                for seed in range(4):
+                    hhmaptool.generate_level(seed, 5, validate=False)
+                    self.assertEqual(handhrl.check_map(), [], (width, seed))
+                    floor = handhrl.map_mask()
+                    self.assertEqual(len(hhgrid.components(floor, width, height)), 1)
+                    self.assertFalse(floor & hhgrid.border(width, height))
+                    zones = []
+                    for x in range(0, width - 2, handhrl.CAVE_ZONE_SIZE):
+                        for y in range(0, height - 2, handhrl.CAVE_ZONE_SIZE):
+                            (x2, y2) = (min(x + handhrl.CAVE_ZONE_SIZE, width - 1),
+                                        min(y + handhrl.CAVE_ZONE_SIZE, height - 1))
+                            if any(not handhrl.map[i][j].blocked for i in range(x + 1, x2) for j in range(y + 1, y2)):
+                                zones.append((x, y, x2, y2))
+                    self.assertEqual([(room.x1, room.y1, room.x2, room.y2) for room in handhrl.rooms], zones)
+                    for obj in handhrl.objects:
+                        self.assertFalse(handhrl.map[obj.x][obj.y].blocked, obj.name)
+        finally:
+            (handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT) = saved
+
+    def test_terrain_field(self):
+        # the field copied out in one slice is the heightmap tile for tile, normalized to 0-1
+        hhtable.seed_rng(6)
+        field = handhrl.make_terrain()
+        hhtable.seed_rng(6)
+        noise = libtcod.noise_new(2)
+        hm = libtcod.heightmap_new(handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT)
+        libtcod.heightmap_add_fbm(hm, noise, float(handhrl.MAP_WIDTH) / handhrl.TERRAIN_FEATURE_SIZE,
+                                  float(handhrl.MAP_HEIGHT) / handhrl.TERRAIN_FEATURE_SIZE, 0, 0,
+                                  handhrl.TERRAIN_OCTAVES, 0, 1)
+        libtcod.heightmap_normalize(hm)
+        self.assertEqual(field, [libtcod.heightmap_get_value(hm, x, y)
+                                 for y in range(handhrl.MAP_HEIGHT) for x in range(handhrl.MAP_WIDTH)])
+        libtcod.heightmap_delete(hm)
+        libtcod.noise_delete(noise)
+        self.assertEqual((min(field), max(field)), (0.0, 1.0))
+
+    def test_terrain_layer(self):
+        # tints follow the field everywhere, and rubble lies on exactly the floor above RUBBLE_LEVEL
+        handhrl.TERRAIN_LAYER = True
+        for generator in ('rooms', 'caves'):
+            handhrl.MAP_GENERATOR = generator
+            hhmaptool.generate_level(7, 6)
+            field = handhrl.terrain
+            for x in range(handhrl.MAP_WIDTH):
+                for y in range(handhrl.MAP_HEIGHT):
+                    tile = handhrl.map[x][y]
+                    height = field[y * handhrl.MAP_WIDTH + x]
+                    self.assertEqual(tile.tint, min(int(height * handhrl.TINT_LEVELS), handhrl.TINT_LEVELS - 1))
+                    self.assertEqual(tile.rubble, not tile.blocked and height > handhrl.RUBBLE_LEVEL)
+            self.assertTrue(any(tile.rubble for column in handhrl.map for tile in column), generator)
+
+    def test_generators_are_seeded(self):
+        for generator in ('rooms', 'bsp', 'caves'):
+            handhrl.MAP_GENERATOR = generator
+            levels = []
+            for x in range(2):
+                hhmaptool.generate_level(8, 4)
+                levels.append((handhrl.map_mask(), [(obj.name, obj.x, obj.y) for obj in handhrl.objects]))
+            self.assertEqual(levels[0], levels[1], generator)
+
+    def test_bench(self):
+        lines = hhmaptool.bench([(60, 30)], 2, generators=('rooms', 'bsp')).splitlines()
+        self.assertEqual([line.split()[:2] for line in lines[1:]], [['60x30', 'rooms'], ['60x30', 'bsp']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""
+handhRL - level generation tool tests
+
+    python -m unittest discover tests
+"""
+
+import array
+import collections
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import headless
+
+sys.path.insert(0, headless.GAME_DIR)
+import handhrl
+import hhmaptool
+
+
+class MapToolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_columns_round_trip(self):
+        columns = collections.OrderedDict((name, array.array(typecode, [3, 1, 2]))
+                                          for (name, typecode) in hhmaptool.STATS_COLUMNS)
+        path = os.path.join(self.directory, 'levels.hhc')
+        hhmaptool.write_columns(path, columns)
+        self.assertEqual(hhmaptool.read_columns(path), columns)
+        self.assertEqual(list(hhmaptool.read_columns(path, ['rooms', 'items']).items()),
+                         [('rooms', columns['rooms']), ('items', columns['items'])])
+
+    def test_stats_are_seeded(self):
+        first = hhmaptool.stats_chunk((2, [11, 12]))
+        again = hhmaptool.stats_chunk((2, [11, 12]))
+        del first['generate_ms'], again['generate_ms']
+        self.assertEqual(first, again)
+        self.assertEqual(first['seed'], [11, 12])
+
+    def test_measure_level(self):
+        hhmaptool.generate_level(4, 3)
+        row = hhmaptool.measure_level()
+        floor = [(x, y) for x in range(handhrl.MAP_WIDTH) for y in range(handhrl.MAP_HEIGHT)
+                 if not handhrl.map[x][y].blocked]
+        self.assertEqual(row['floor'], len(floor))
+        self.assertEqual(row['rooms'], len(handhrl.rooms))
+        self.assertAlmostEqual(row['coverage'], len(floor) / float(handhrl.MAP_WIDTH * handhrl.MAP_HEIGHT))
+        self.assertTrue(0 < row['corridor'] < row['floor'])
+        # the stairs are reachable, and at least as many steps away as the larger of dx and dy
+        stairs = handhrl.stairs
+        self.assertTrue(row['stairs_distance'] >= max(abs(stairs.x - handhrl.player.x),
+                                                      abs(stairs.y - handhrl.player.y)))
+
+    def test_tasks(self):
+        self.assertEqual([(level, list(seeds)) for (level, seeds) in hhmaptool.make_tasks([1, 2], 60, 10)],
+                         [(1, list(range(10, 60))), (1, list(range(60, 70))),
+                          (2, list(range(10, 60))), (2, list(range(60, 70)))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,347 @@
+"""
+handhRL - monster turn tests
+
+    python -m unittest discover tests
+"""
+
+import sys
+import unittest
+
+import headless
+
+sys.path.insert(0, headless.GAME_DIR)
+import libtcodpy as libtcod
+import handhrl
+import hhgrid
+import hhmaptool
+import hhpath
+import hhsched
+
+
+class MonsterTest(unittest.TestCase):
+    def setUp(self):
+        # (initialize_fov clears the map console, which the game only makes once it has a window)
+        handhrl.con = libtcod.console_new(handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT)
+        self.settings = (handhrl.TERRAIN_LAYER, handhrl.MAP_GENERATOR)
+
+    def tearDown(self):
+        (handhrl.TERRAIN_LAYER, handhrl.MAP_GENERATOR) = self.settings
+        libtcod.console_delete(handhrl.con)
+        del handhrl.con
+
+    def start(self, seed, dungeon_level=4):
+        # a generated level with the player in the first room, FOV worked out from there and nothing
+        # else on it
+        hhmaptool.generate_level(seed, dungeon_level)
+        (handhrl.player.x, handhrl.player.y) = handhrl.rooms[0].center()
+        handhrl.objects = [handhrl.player]
+        handhrl.game_turn = 0
+        handhrl.initialize_fov()
+        self.compute_fov()
+        handhrl.schedule_level()
+
+    def compute_fov(self):
+        libtcod.map_compute_fov(handhrl.fov_map, handhrl.player.x, handhrl.player.y, handhrl.TORCH_RADIUS,
+                                handhrl.FOV_LIGHT_WALLS, handhrl.FOV_ALGO)
+
+    def steps_to_player(self, x, y):
+        width = handhrl.MAP_WIDTH
+        return hhgrid.distance(handhrl.map_mask(), hhgrid.bit(width, x, y),
+                               hhgrid.bit(width, handhrl.player.x, handhrl.player.y), width, handhrl.MAP_HEIGHT)
+
+    def far_tiles(self):
+        # floor tiles out of LOD_DISTANCE, farthest first
+        player = handhrl.player
+        tiles = [(x, y) for (x, y) in hhgrid.tiles(handhrl.map_mask(), handhrl.MAP_WIDTH)
+                 if player.distance(x, y) > handhrl.LOD_DISTANCE + handhrl.LOD_INTERVAL]
+        return sorted(tiles, key=lambda tile: -player.distance(*tile))
+
+    def add_monster(self, x, y, seen_player=True):
+        monster = handhrl.get_monster_from_hitdice(x, y, 'rat', (1, 4), libtcod.red)
+        monster.seen_player = seen_player
+        handhrl.objects.append(monster)
+        handhrl.scheduler.add(monster)
+        return monster
+
+    def count_routes(self):
+        # wrap find_route to count the routes worked out afresh, until the test is over
+        calls = []
+        find_route = handhrl.find_route
+
+        def counted(*request):
+            calls.append(request)
+            return find_route(*request)
+        handhrl.find_route = counted
+        self.addCleanup(setattr, handhrl, 'find_route', find_route)
+        return calls
+
+    def test_route_kept(self):
+        # a monster following the player keeps its route from step to step, shortens it when the
+        # target comes along it, and only works it out again once the target moves off it
+        handhrl.TERRAIN_LAYER = False
+        for seed in range(3):
+            self.start(seed)
+            calls = self.count_routes()
+            target = handhrl.rooms[0].center()
+            monster = self.add_monster(*handhrl.rooms[-1].center())
+            monster.move_towards(*target)
+            self.assertEqual(len(calls), 1)
+            route = list(monster.route)
+            self.assertEqual(route[0], target)
+            self.assertTrue(len(route) > 4, seed)
+            # (each step taken is the one planned, and the rest of the route is kept)
+            for step in range(2):
+                monster.move_towards(*target)
+                self.assertEqual((monster.x, monster.y), route[-1 - step])
+                self.assertEqual(monster.route, route[:-1 - step])
+            self.assertEqual(len(calls), 1)
+
+            # the target comes part of the way along the route
+            nearer = route[len(route) // 2]
+            monster.move_towards(*nearer)
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(monster.route, route[len(route) // 2:-3])
+            self.assertEqual(monster.route[0], nearer)
+
+            # and moves off it, to a tile the monster can still reach
+            (x, y) = handhrl.rooms[1].center()
+            self.assertFalse((x, y) in monster.route)
+            monster.move_towards(x, y)
+            self.assertEqual(len(calls), 2)
+            self.assertEqual(calls[-1][2:], (x, y))
+            self.assertEqual(monster.route[0], (x, y))
+
+    def test_route_blocked(self):
+        # a route whose next step is no longer walkable, or that a monster was pushed off, is worked
+        # out again
+        handhrl.TERRAIN_LAYER = False
+        self.start(1)
+        calls = self.count_routes()
+        target = handhrl.rooms[0].center()
+        monster = self.add_monster(*handhrl.rooms[-1].center())
+        monster.move_towards(*target)
+        (x, y) = monster.route[-1]
+        (monster.x, monster.y) = (x + 2, y)
+        self.assertFalse(monster.route_usable(*target))
+        (monster.x, monster.y) = monster.route.pop()
+        monster.move_towards(*target)
+        self.assertEqual(len(calls), 1)
+
+        (x, y) = monster.route[-1]
+        libtcod.map_set_properties(handhrl.fov_map, x, y, False, False)
+        self.assertFalse(monster.route_usable(*target))
+        monster.move_towards(*target)
+        self.assertEqual(len(calls), 2)
+        self.assertFalse((x, y) in monster.route)
+
+    def test_path_pool(self):
+        # routes worked out on the pathfinding threads are the ones a single path object finds, in the
+        # order they were asked for
+        handhrl.TERRAIN_LAYER = False
+        self.start(0)
+        tiles = list(hhgrid.tiles(handhrl.map_mask(), handhrl.MAP_WIDTH))
+        requests = [tiles[i] + tiles[-1 - i * 7] for i in range(0, len(tiles) // 8, 5)]
+        # (and a target inside a wall, which has no route)
+        requests.append(tiles[0] + (0, 0))
+        pool = hhpath.PathPool(handhrl.fov_map, handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT, workers=3)
+        try:
+            expected = [handhrl.find_route(*request) for request in requests]
+            self.assertTrue(all(expected[:-1]) and expected[-1] == [])
+            for x in range(2):
+                self.assertEqual(pool.routes(requests), expected)
+            self.assertEqual(pool.routes([]), [])
+        finally:
+            pool.close()
+        self.assertFalse(any(thread.is_alive() for thread in pool.threads))
+
+    def test_routes_planned_together(self):
+        # monsters about to act that want new routes get them from the pool when there are enough of
+        # them, and their routes are the ones they would have worked out for themselves
+        handhrl.TERRAIN_LAYER = False
+        self.start(3)
+        player = handhrl.player
+        tiles = [(x, y) for (x, y) in hhgrid.tiles(handhrl.map_mask(), handhrl.MAP_WIDTH)
+                 if 3 <= player.distance(x, y) <= 10 and self.steps_to_player(x, y) < 20]
+        monsters = [self.add_monster(*tile) for tile in tiles[::len(tiles) // (handhrl.PATH_BATCH * 2)]]
+        self.assertTrue(len(monsters) >= handhrl.PATH_BATCH)
+        (workers, hhpath.WORKERS) = (hhpath.WORKERS, 2)
+        try:
+            handhrl.plan_routes(monsters)
+        finally:
+            hhpath.WORKERS = workers
+        self.assertTrue(handhrl.path_pool[0] is handhrl.fov_map)
+        handhrl.path_pool[1].close()
+        handhrl.path_pool = None
+        for monster in monsters:
+            route = handhrl.find_route(monster.x, monster.y, player.x, player.y)
+            # (the first step may be a sidestep round another monster)
+            self.assertEqual(monster.route[:-1], route[:-1])
+            (x, y) = monster.route[-1]
+            self.assertEqual(max(abs(x - monster.x), abs(y - monster.y)), 1)
+
+    def crowd(self, seed, nearest_first):
+        # a crowd of monsters 3 to 5 steps from the player, all after the player
+        self.start(seed)
+        player = handhrl.player
+        tiles = [(x, y) for (x, y) in hhgrid.tiles(handhrl.map_mask(), handhrl.MAP_WIDTH)
+                 if 2 <= player.distance(x, y) and max(abs(x - player.x), abs(y - player.y)) <= 5 and
+                 3 <= self.steps_to_player(x, y) <= 5]
+        tiles.sort(key=lambda tile: self.steps_to_player(*tile), reverse=not nearest_first)
+        return [self.add_monster(*tile) for tile in tiles[:10]]
+
+    def test_planned_steps(self):
+        # no two monsters plan a step onto the same tile, or onto one another is standing on when they
+        # move. one whose next step is taken sidesteps to a free tile next to the step after it, so
+        # more of a crowd moves than would without the plans
+        handhrl.TERRAIN_LAYER = False
+        (sidesteps, moved, moved_unplanned) = (0, 0, 0)
+        for seed in range(4):
+            for nearest_first in (False, True):
+                monsters = self.crowd(seed, nearest_first)
+                unplanned = 0
+                for monster in monsters:
+                    before = (monster.x, monster.y)
+                    monster.move_towards(handhrl.player.x, handhrl.player.y)
+                    unplanned += (monster.x, monster.y) != before
+
+                monsters = self.crowd(seed, nearest_first)
+                routes = [handhrl.find_route(monster.x, monster.y, handhrl.player.x, handhrl.player.y)
+                          for monster in monsters]
+                handhrl.plan_routes(monsters)
+                planned = set()
+                for (monster, route) in zip(monsters, routes):
+                    (x, y) = monster.route[-1]
+                    self.assertEqual(monster.route[:-1], route[:-1])
+                    self.assertEqual(max(abs(x - monster.x), abs(y - monster.y)), 1)
+                    self.assertFalse(handhrl.map[x][y].blocked)
+                    if (x, y) != route[-1]:
+                        # (only round a monster in the way, and onto a tile as far along the route)
+                        sidesteps += 1
+                        self.assertTrue(handhrl.is_blocked(*route[-1]))
+                        self.assertEqual(max(abs(x - route[-2][0]), abs(y - route[-2][1])), 1)
+                    free = not handhrl.is_blocked(x, y)
+                    if free:
+                        self.assertFalse((x, y) in planned)
+                        planned.add((x, y))
+                    monster.move_towards(handhrl.player.x, handhrl.player.y)
+                    self.assertEqual((monster.x, monster.y) == (x, y), free)
+                self.assertTrue(len(planned) >= unplanned, (seed, nearest_first))
+                (moved, moved_unplanned) = (moved + len(planned), moved_unplanned + unplanned)
+        self.assertTrue(sidesteps > 0 and moved > moved_unplanned)
+
+    def in_view(self, near, far):
+        # floor tiles in the player's view between near and far steps from it
+        return [(x, y) for (x, y) in hhgrid.tiles(handhrl.map_mask(), handhrl.MAP_WIDTH)
+                if libtcod.map_is_in_fov(handhrl.fov_map, x, y) and near <= self.steps_to_player(x, y) <= far]
+
+    def add_summon(self, x, y):
+        summon = handhrl.get_monster_from_hitdice(x, y, 'TED-3', (2, 8), libtcod.green, friendly=True)
+        handhrl.objects.append(summon)
+        handhrl.scheduler.add(summon)
+        return summon
+
+    def test_summon_fields(self):
+        # the hostile monsters in the player's view, confused ones included, and the rings to them and to
+        # the player, worked out once a turn
+        handhrl.TERRAIN_LAYER = False
+        self.start(1)
+        tiles = self.in_view(2, 6)
+        hostiles = [self.add_monster(*tile) for tile in tiles[:3]]
+        hostiles[2].ai = handhrl.ConfusedMonster(hostiles[2].ai)
+        hostiles[2].ai.owner = hostiles[2]
+        self.add_summon(*tiles[3])
+        self.add_monster(*self.far_tiles()[0])
+        fields = handhrl.summon_fields()
+        self.assertEqual(fields[0], dict(((monster.x, monster.y), monster) for monster in hostiles))
+        (costs, width, height, player) = (handhrl.field_costs(), handhrl.MAP_WIDTH, handhrl.MAP_HEIGHT, handhrl.player)
+        start = sum(hhgrid.bit(width, *tile) for tile in tiles[:3])
+        self.assertEqual(fields[1], hhgrid.weighted_distance(costs, start, width, height))
+        start = hhgrid.bit(width, player.x, player.y)
+        self.assertEqual(fields[2], hhgrid.weighted_distance(costs, start, width, height))
+        again = handhrl.summon_fields()
+        self.assertTrue(all(field is field_again for (field, field_again) in zip(fields, again)))
+        handhrl.game_turn += 1
+        self.assertFalse(handhrl.summon_fields()[1] is fields[1])
+
+    def test_summon_turn(self):
+        # a summon goes for a hostile monster in view, or attacks one next to it, and otherwise follows
+        # the player. other summons are left alone
+        handhrl.TERRAIN_LAYER = False
+        for seed in range(3):
+            self.start(seed)
+            player = handhrl.player
+            handhrl.game_msgs = []
+            follower = self.add_summon(*self.in_view(5, 5)[0])
+            self.add_summon(*self.in_view(2, 2)[0])
+            follower.ai.take_turn()
+            self.assertEqual(self.steps_to_player(follower.x, follower.y), 4, seed)
+            self.assertEqual(handhrl.game_msgs, [])
+
+            # (the player is moved out of the way once its view is worked out)
+            start = (player.x, player.y)
+            view = self.in_view(1, 4)
+            (player.x, player.y) = self.far_tiles()[0]
+            handhrl.objects = [player]
+            handhrl.game_turn += 1
+            (summon, hostile) = (self.add_summon(*start), self.add_monster(*view[-1]))
+            width = handhrl.MAP_WIDTH
+            mask = handhrl.map_mask()
+
+            def steps():
+                return hhgrid.distance(mask, hhgrid.bit(width, summon.x, summon.y),
+                                       hhgrid.bit(width, hostile.x, hostile.y), width, handhrl.MAP_HEIGHT)
+            before = steps()
+            self.assertTrue(before >= 2, seed)
+            summon.ai.take_turn()
+            self.assertEqual(steps(), before - 1, seed)
+
+            (hostile.x, hostile.y) = [tile for tile in view
+                                      if max(abs(tile[0] - summon.x), abs(tile[1] - summon.y)) == 1][0]
+            attacks = []
+            summon.fighter.attack = attacks.append
+            at = (summon.x, summon.y)
+            handhrl.game_turn += 1
+            summon.ai.take_turn()
+            self.assertEqual((attacks, (summon.x, summon.y)), ([hostile], at), seed)
+
+    def test_far_turn(self):
+        # a distant monster that has seen the player walks LOD_INTERVAL steps nearer at once, then
+        # waits LOD_INTERVAL actions; one that hasn't stays where it is
+        for seed in range(4):
+            for terrain in (False, True):
+                handhrl.TERRAIN_LAYER = terrain
+                self.start(seed)
+                tiles = self.far_tiles()
+                (chaser, idler) = (self.add_monster(*tiles[0]), self.add_monster(*tiles[-1], seen_player=False))
+                before = self.steps_to_player(chaser.x, chaser.y)
+                idle_at = (idler.x, idler.y)
+                for monster in (chaser, idler):
+                    handhrl.far_turn(monster)
+                    self.assertEqual(handhrl.scheduler.state([monster]),
+                                     (0, [(hhsched.action_delay(monster) * handhrl.LOD_INTERVAL, 0)]))
+                self.assertEqual((idler.x, idler.y), idle_at)
+                after = self.steps_to_player(chaser.x, chaser.y)
+                if terrain:
+                    # (it may go round rubble, but never ends up further away)
+                    self.assertTrue(before - handhrl.LOD_INTERVAL <= after < before, (seed, before, after))
+                else:
+                    self.assertEqual(after, before - handhrl.LOD_INTERVAL, seed)
+
+    def test_far_monsters_in_the_phase(self):
+        # in the monster phase, monsters beyond LOD_DISTANCE get far turns and nearer ones full turns
+        self.start(2)
+        tiles = self.far_tiles()
+        far = self.add_monster(*tiles[0])
+        calls = []
+        (far_turn, handhrl.far_turn) = (handhrl.far_turn, lambda monster: calls.append(monster))
+        try:
+            for x in range(3):
+                list(handhrl.monster_phase())
+        finally:
+            handhrl.far_turn = far_turn
+        self.assertEqual(calls, [far] * 3)
+        self.assertEqual(handhrl.game_turn, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
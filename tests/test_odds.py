@@ -0,0 +1,108 @@
+"""
+handhRL - combat odds tests
+
+The odds tables are checked against every outcome of the dice, counted one by one the way
+Fighter.attack rolls them.
+
+    python -m unittest discover tests
+"""
+
+import itertools
+import sys
+import unittest
+
+import headless
+
+sys.path.insert(0, headless.GAME_DIR)
+import hhodds
+
+
+def attack_outcomes(to_hit, armor_class, damage_roll, damage, damage_resistance):
+    # the damage of one attack, as a dict of damage: chance, from every 1d20 roll and damage roll
+    num, sides = damage_roll[:2]
+    highest = damage_roll[2] if len(damage_roll) > 2 else 0
+    rolls = list(itertools.product(range(1, sides + 1), repeat=num))
+    outcomes = {}
+    for d20 in range(1, 21):
+        for roll in rolls:
+            if d20 >= hhodds.to_hit_target(to_hit, armor_class):
+                dealt = 0
+            else:
+                total = sum(sorted(roll, reverse=True)[:highest]) if highest else sum(roll)
+                dealt = max(0, total + damage - damage_resistance)
+            outcomes[dealt] = outcomes.get(dealt, 0) + 1
+    return dict((dealt, count / float(20 * len(rolls))) for (dealt, count) in outcomes.items())
+
+
+def kill_chance(outcomes, hp, attacks):
+    # the chance that `attacks` attacks take hp to 0 or below, from every sequence of outcomes
+    chance = 0.0
+    for sequence in itertools.product(outcomes.items(), repeat=attacks):
+        if sum(dealt for (dealt, p) in sequence) >= hp:
+            p = 1.0
+            for (dealt, q) in sequence:
+                p *= q
+            chance += p
+    return chance
+
+
+class OddsTest(unittest.TestCase):
+    MATCHUPS = [(0, 0, (1, 6), 0, 0),
+                (2, 4, (2, 4), 1, 0),
+                (-3, 1, (1, 8), 0, 2),
+                (10, 10, (1, 4), 0, 0),
+                (-8, 2, (1, 6), 0, 0),
+                (1, 3, [3, 6, 2], 2, 1),
+                (0, 2, (2, 6), -1, 3)]
+
+    def assertDistribution(self, expected, actual):
+        self.assertEqual(sorted(d for (d, p) in expected.items() if p), sorted(d for (d, p) in actual.items() if p))
+        for (dealt, p) in expected.items():
+            self.assertAlmostEqual(p, actual.get(dealt, 0.0), places=12)
+
+    def test_to_hit_target(self):
+        # capped at 20, and a target of 1 (which nothing could roll under) is raised to 2
+        self.assertEqual(hhodds.to_hit_target(10, 10), 20)
+        self.assertEqual(hhodds.to_hit_target(-4, 0), 2)
+        self.assertEqual(hhodds.to_hit_target(-5, 0), 0)
+        self.assertEqual(hhodds.to_hit_target(1, 2), 8)
+
+    def test_roll_distribution(self):
+        for (num, sides, highest) in [(1, 20, 0), (3, 6, 0), (4, 6, 3), (3, 6, 2), (2, 12, 1)]:
+            rolls = list(itertools.product(range(1, sides + 1), repeat=num))
+            counts = {}
+            for roll in rolls:
+                total = sum(sorted(roll, reverse=True)[:highest]) if highest else sum(roll)
+                counts[total] = counts.get(total, 0) + 1
+            self.assertDistribution(dict((total, count / float(len(rolls))) for (total, count) in counts.items()),
+                                    hhodds.roll_distribution(num, sides, highest))
+
+    def test_attack_odds(self):
+        for matchup in self.MATCHUPS:
+            outcomes = attack_outcomes(*matchup)
+            odds = hhodds.get_odds(*matchup)
+            self.assertDistribution(outcomes, odds['damage'])
+            self.assertAlmostEqual(sum(dealt * p for (dealt, p) in outcomes.items()), odds['expected_damage'],
+                                   places=12)
+            self.assertAlmostEqual(odds['hit_chance'],
+                                   max(0, hhodds.to_hit_target(*matchup[:2]) - 1) / 20.0, places=12)
+
+    def test_kill_odds(self):
+        for matchup in self.MATCHUPS:
+            outcomes = attack_outcomes(*matchup)
+            for hp in (1, 4, 7):
+                kill = hhodds.get_kill_odds(hhodds.get_odds(*matchup), hp)
+                if not any(p for (dealt, p) in outcomes.items() if dealt > 0):
+                    self.assertEqual((kill['by_turn'], kill['expected_turns']), ([0.0], None))
+                    continue
+                for attacks in range(1, 4):
+                    self.assertAlmostEqual(kill['by_turn'][attacks - 1], kill_chance(outcomes, hp, attacks),
+                                           places=9)
+
+    def test_dead_target(self):
+        kill = hhodds.get_kill_odds(hhodds.get_odds(0, 0, (1, 6)), 0)
+        self.assertEqual((kill['by_turn'], kill['expected_turns'], kill['median_turns']), ([], 0.0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
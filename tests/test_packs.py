@@ -0,0 +1,76 @@
+"""
+handhRL - level pack tests
+
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import headless
+
+sys.path.insert(0, headless.GAME_DIR)
+import handhrl
+import hhmaptool
+import hhpack
+
+
+def level_state():
+    # everything about the level in handhrl's globals that a pack has to bring back
+    return ([[(tile.blocked, tile.block_sight, tile.rubble, tile.tint) for tile in column] for column in handhrl.map],
+            sorted((obj.name, obj.x, obj.y, obj.fighter and obj.fighter.hp) for obj in handhrl.objects),
+            (handhrl.stairs.x, handhrl.stairs.y), (handhrl.player.x, handhrl.player.y),
+            [(room.x1, room.y1, room.x2, room.y2) for room in handhrl.rooms])
+
+
+class PackTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'levels.hhp')
+        self.settings = (handhrl.TERRAIN_LAYER, handhrl.MAP_GENERATOR)
+
+    def tearDown(self):
+        (handhrl.TERRAIN_LAYER, handhrl.MAP_GENERATOR) = self.settings
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        # a level loaded from the pack is the level the generator makes for its seed
+        handhrl.TERRAIN_LAYER = True
+        for generator in ('rooms', 'caves'):
+            handhrl.MAP_GENERATOR = generator
+            self.assertEqual(hhmaptool.build_pack(self.path, [1, 4], 3, 20, processes=1), 6)
+            pack = hhpack.LevelPack(self.path)
+            try:
+                self.assertEqual((pack.levels(), pack.count(1), pack.count(4), pack.count(2)), ([1, 4], 3, 3, 0))
+                for (dungeon_level, seed) in [(1, 20), (4, 22)]:
+                    hhmaptool.generate_level(seed, dungeon_level)
+                    generated = level_state()
+                    handhrl.dungeon_level = dungeon_level
+                    self.assertTrue(handhrl.load_pack_level(pack.read(dungeon_level, vars(handhrl), seed)))
+                    self.assertEqual(level_state(), generated)
+                    self.assertEqual(handhrl.level_seed, seed)
+                self.assertEqual(pack.read(1, vars(handhrl), 23), None)
+                self.assertEqual(pack.read(2, vars(handhrl)), None)
+                self.assertTrue(pack.read(4, vars(handhrl))['seed'] in (20, 21, 22))
+            finally:
+                pack.close()
+
+    def test_not_a_pack(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'HHS2' + b'\0' * 16)
+        self.assertRaises(ValueError, hhpack.LevelPack, self.path)
+
+    def test_other_map_size(self):
+        # a record for another map size is left for the generator
+        hhmaptool.generate_level(3, 2)
+        record = hhpack.decode_level(hhpack.encode_level(3, 2, handhrl.map, handhrl.objects, handhrl.player,
+                                                         handhrl.stairs, handhrl.rooms), vars(handhrl))
+        record['size'] = (handhrl.MAP_WIDTH + 1, handhrl.MAP_HEIGHT)
+        self.assertFalse(handhrl.load_pack_level(record))
+
+
+if __name__ == '__main__':
+    unittest.main()
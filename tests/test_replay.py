@@ -0,0 +1,106 @@
+"""
+handhRL - journal replay tests
+
+A game is saved, played on with its journal written as it goes, then left without saving, as if it
+crashed. Loading it in a fresh process plays the journal back, which has to end in the same state.
+
+    python -m unittest discover tests
+"""
+
+import shutil
+import tempfile
+import textwrap
+import unittest
+
+import headless
+
+
+# awake monsters put far from the player, so they walk the coarse routes of distant monsters
+FAR_MONSTERS = """
+import random
+spots = random.Random({seed})
+added = 0
+while added < 12:
+    (x, y) = (spots.randint(1, handhrl.MAP_WIDTH - 2), spots.randint(1, handhrl.MAP_HEIGHT - 2))
+    if not handhrl.is_blocked(x, y) and handhrl.player.distance(x, y) > handhrl.LOD_DISTANCE:
+        monster = handhrl.get_monster_from_hitdice(x, y, 'rat', (1, 4), libtcod.red)
+        (monster.seen_player, monster.fighter.hp) = (True, 1000)
+        handhrl.objects.append(monster)
+        handhrl.scheduler.add(monster)
+        added += 1
+"""
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def replay(self, seed, **settings):
+        # play a game with the given game settings and far monsters, then check its replay
+        setup = ''.join('handhrl.{0} = {1!r}\n'.format(name, value) for (name, value) in sorted(settings.items()))
+        played = headless.run(setup + 'headless.new_game({0}, 10 ** 6)\n'.format(seed) +
+                              FAR_MONSTERS.format(seed=seed) +
+                              'handhrl.save_game()\n'
+                              'headless.play({0}, 120)\n'
+                              'print(headless.state())\n'.format(seed), self.directory)
+        replayed = headless.run(setup + 'handhrl.load_game()\n'
+                                        'print(headless.state())\n', self.directory)
+        self.assertEqual(played, replayed)
+
+    def test_far_monsters(self):
+        for seed in (1, 2, 3):
+            self.replay(seed)
+
+    def test_far_monsters_on_terrain(self):
+        for seed in (1, 2, 3):
+            self.replay(seed, TERRAIN_LAYER=True)
+        for seed in (4, 5, 6):
+            self.replay(seed, TERRAIN_LAYER=True, MAP_GENERATOR='caves')
+
+    def test_sliced_turns(self):
+        # a monster phase spread over many frames, with the screen drawn between them as play_game
+        # does, comes out the same as one played all at once
+        script = ('headless.new_game(9, 10 ** 6)\n' + FAR_MONSTERS.format(seed=9) + textwrap.dedent("""
+            moves = random.Random(9)
+            mouse = libtcod.Mouse()
+            frames = 0
+            for turn in range(60):
+                key = libtcod.Key()
+                key.vk = getattr(libtcod, moves.choice(headless.MOVE_KEYS))
+                handhrl.journal_key(key)
+                handhrl.play_turn(key, mouse, {budget})
+                while handhrl.ai_work is not None:
+                    handhrl.render_all(fov=False)
+                    handhrl.run_ai({budget})
+                    frames += 1
+                handhrl.render_all()
+            print(frames > 60)
+            print(headless.state())
+            """))
+        (whole, sliced) = (headless.run(script.format(budget=budget), self.directory) for budget in (None, 0))
+        self.assertEqual(whole.splitlines()[1:], sliced.splitlines()[1:])
+        self.assertEqual((whole.splitlines()[0], sliced.splitlines()[0]), ('False', 'True'))
+
+    def test_torn_journal(self):
+        # a crash part way through writing a key press: the game comes back as it was before it
+        played = headless.run("""
+            headless.new_game(7)
+            headless.play(7, 50)
+            print(headless.state())
+            handhrl.journal.write(b'K', 1, 2, 3, 0)
+            handhrl.journal.close()
+            with open(handhrl.JOURNAL_FILE, 'rb+') as f:
+                f.truncate(len(f.read()) - 2)
+            """, self.directory)
+        replayed = headless.run("""
+            handhrl.load_game()
+            print(headless.state())
+            """, self.directory)
+        self.assertEqual(played, replayed)
+
+
+if __name__ == '__main__':
+    unittest.main()
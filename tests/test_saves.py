@@ -0,0 +1,236 @@
+"""
+handhRL - save tests
+
+Each game is saved in one process and loaded in another, so nothing the saving game left in memory
+can stand in for what the save is missing.
+
+    python -m unittest discover tests
+"""
+
+import glob
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import headless
+
+sys.path.insert(0, headless.GAME_DIR)
+import hhsave
+
+
+class SaveTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_full_save(self):
+        # a save of the whole level, rather than its seed and changes
+        saved = headless.run("""
+            handhrl.SAVE_ENCODING = 'full'
+            headless.new_game(5)
+            headless.play(5, 60)
+            handhrl.save_game()
+            print(headless.state())
+            """, self.directory)
+        loaded = headless.run("""
+            import hhsave
+            print('map' in hhsave.open_save('savegame'))
+            handhrl.load_game()
+            print(headless.state())
+            """, self.directory)
+        self.assertEqual('True\n' + saved, loaded)
+
+    def test_delta_save(self):
+        # a level saved as its seed and changes, terrain included. a tile whose tint changed since the
+        # level was generated keeps it
+        saved = headless.run("""
+            handhrl.TERRAIN_LAYER = True
+            headless.new_game(6)
+            headless.play(6, 60)
+            handhrl.map[1][1].tint = (handhrl.map[1][1].tint + 1) % handhrl.TINT_LEVELS
+            handhrl.save_game()
+            print(headless.state())
+            print(handhrl.tile_tints() == handhrl.level_baseline()[0][3])
+            print(repr(handhrl.tile_tints()))
+            """, self.directory)
+        loaded = headless.run("""
+            import hhsave
+            handhrl.TERRAIN_LAYER = True
+            print('map' in hhsave.open_save('savegame'))
+            handhrl.load_game()
+            print(headless.state())
+            print(repr(handhrl.tile_tints()))
+            """, self.directory)
+        (state, same, tints) = saved.splitlines()
+        self.assertEqual(same, 'False')
+        self.assertEqual(loaded.splitlines(), ['False', state, tints])
+
+    def test_level_mismatch(self):
+        # a level generated from the saved seed with different tints is not the level that was saved
+        headless.run("""
+            handhrl.TERRAIN_LAYER = True
+            headless.new_game(7)
+            handhrl.save_game()
+            """, self.directory)
+        loaded = headless.run("""
+            handhrl.TERRAIN_LAYER = True
+            handhrl.TINT_LEVELS -= 1
+            try:
+                handhrl.load_game()
+            except ValueError as e:
+                print(e)
+            """, self.directory)
+        self.assertEqual(loaded, 'saved level does not match the level generated from its seed\n')
+
+    def test_play_on_while_saving(self):
+        # the save is of the game as it was when it was made, however far play has gone on before the
+        # writer gets to it
+        saved = headless.run("""
+            import hhsave
+            headless.new_game(8)
+            headless.play(8, 40)
+            with hhsave._lock:
+                handhrl.save_game()
+                print(headless.state())
+                headless.play(9, 40)
+            """, self.directory)
+        loaded = headless.run("""
+            # (without the journal of the turns played since)
+            import os
+            os.remove(handhrl.JOURNAL_FILE)
+            handhrl.load_game()
+            print(headless.state())
+            """, self.directory)
+        self.assertEqual(saved, loaded)
+
+    def test_old_save(self):
+        # a shelve save written by the game before saves were reworked (in dumbdbm format, which every
+        # python can read): a confused monster, no level seed, rooms, schedule or terrain
+        for path in glob.glob(os.path.join(headless.DATA_DIR, 'baseline', 'savegame.*')):
+            shutil.copy(path, self.directory)
+        saved = headless.run("""
+            handhrl.load_game()
+            print('%s %s %s' % (handhrl.player.name, handhrl.dungeon_level, handhrl.level_seed))
+            handhrl.player.fighter.base_max_hp = handhrl.player.fighter.hp = 1000
+            headless.play(3, 40)
+            handhrl.next_level()
+            headless.play(4, 40)
+            handhrl.save_game()
+            print(headless.state())
+            """, self.directory)
+        loaded = headless.run("""
+            handhrl.load_game()
+            print(headless.state())
+            headless.play(5, 40)
+            """, self.directory)
+        self.assertEqual(saved.splitlines()[0], 'Berry 1 None')
+        self.assertEqual(saved.splitlines()[1:], loaded.splitlines())
+
+
+class WriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'savegame')
+        self.built = []
+
+    def tearDown(self):
+        hhsave.wait()
+        shutil.rmtree(self.directory)
+
+    def build(self, entries, files=(), done=None):
+        # a build function for hhsave.save that notes which thread it ran on
+        def build():
+            self.built.append((entries, threading.current_thread().name))
+            if entries is None:
+                raise ValueError('no entries')
+            return entries, list(files), done
+        return build
+
+    def read(self):
+        save = hhsave.open_save(self.path)
+        try:
+            return dict((name, save[name]) for name in save.names())
+        finally:
+            save.close()
+
+    def test_round_trip(self):
+        entries = {'map': [[1, 2]] * 30, 'game_msgs': [('hello', 3)], 'game_turn': 12}
+        other = os.path.join(self.directory, 'levels', '1.hhl')
+        finished = []
+        hhsave.save(self.path, self.build(entries, [(other, b'level')], lambda: finished.append(True)))
+        hhsave.wait()
+        self.assertEqual(self.read(), entries)
+        self.assertEqual(self.built, [(entries, 'save writer')])
+        self.assertEqual(finished, [True])
+        with open(other, 'rb') as f:
+            self.assertEqual(f.read(), b'level')
+
+    def test_newest_save_wins(self):
+        # a save queued while another is still waiting replaces it
+        with hhsave._lock:
+            hhsave.save(self.path, self.build({'turn': 1}))
+            hhsave.save(self.path, self.build({'turn': 2}))
+        hhsave.wait()
+        self.assertEqual(self.read(), {'turn': 2})
+        self.assertEqual([entries for (entries, thread) in self.built], [{'turn': 2}])
+
+    def test_failed_save(self):
+        # a save that can't be built is reported, and the one before it stays in place
+        hhsave.save(self.path, self.build({'turn': 1}))
+        hhsave.wait()
+        hhsave.save(self.path, self.build(None))
+        hhsave.wait()
+        self.assertEqual(hhsave.pop_error(), self.path + ': no entries')
+        self.assertEqual(hhsave.pop_error(), None)
+        self.assertEqual(self.read(), {'turn': 1})
+
+
+class ChunkTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'savegame')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_chunks(self):
+        # each entry is a chunk of its own, compressed unless that gains nothing, and read only when
+        # asked for
+        entries = {'map': [[True, False] * 40] * 40, 'game_turn': 3}
+        hhsave.write_atomic(self.path, hhsave.snapshot(entries))
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        save = hhsave.open_save(self.path)
+        try:
+            self.assertEqual(save.names(), ['game_turn', 'map'])
+            self.assertEqual((save.chunks['map'][0], save.chunks['game_turn'][0]), (b'z', b'-'))
+            self.assertTrue(save.chunks['map'][3] < save.chunks['map'][2])
+            self.assertEqual(save['map'], entries['map'])
+            self.assertEqual(save.read('game_turn'), hhsave.snapshot(entries)['game_turn'])
+            self.assertTrue('map' in save and 'objects' not in save)
+        finally:
+            save.close()
+
+    def test_cut_short(self):
+        hhsave.write_atomic(self.path, hhsave.snapshot({'map': list(range(1000)), 'game_turn': 3}))
+        with open(self.path, 'rb+') as f:
+            f.truncate(len(f.read()) - 1)
+        self.assertRaises(IOError, hhsave.open_save, self.path)
+
+    def test_old_format(self):
+        # a save in the single pickle format that came before chunks
+        with open(self.path, 'wb') as f:
+            f.write(hhsave.OLD_SAVE_MAGIC + pickle.dumps(hhsave.snapshot({'game_turn': 9}), 2))
+        save = hhsave.open_save(self.path)
+        self.assertTrue('game_turn' in save)
+        self.assertEqual(save['game_turn'], 9)
+        self.assertEqual(hhsave.open_save(os.path.join(self.directory, 'missing')), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
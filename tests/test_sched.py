@@ -0,0 +1,97 @@
+"""
+handhRL - turn scheduler tests
+
+    python -m unittest discover tests
+"""
+
+import random
+import sys
+import unittest
+
+import headless
+
+sys.path.insert(0, headless.GAME_DIR)
+import hhsched
+
+
+class Actor:
+    def __init__(self, name, speed):
+        (self.name, self.speed, self.ai) = (name, speed, True)
+
+
+def reference(actors, turns):
+    # who acts on each player action, for actors scheduled a full action from 0, worked out the slow way:
+    # every time, look through all of them for the one due soonest, taking the one scheduled first
+    # on a tie
+    pending = [[hhsched.action_delay(actor), i, actor] for (i, actor) in enumerate(actors)]
+    sequence = len(actors)
+    (now, turns_acted) = (0, [])
+    for turn in range(turns):
+        now += hhsched.ACTION_TIME
+        names = []
+        while any(entry[0] <= now for entry in pending):
+            entry = min(entry for entry in pending if entry[0] <= now)
+            names.append(entry[2].name)
+            sequence += 1
+            entry[:2] = [entry[0] + hhsched.action_delay(entry[2]), sequence]
+        turns_acted.append(names)
+    return turns_acted
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.actors = [Actor('slow', 50), Actor('normal', 100), Actor('quick', 150), Actor('fast', 200),
+                       Actor('slug', 30), Actor('other normal', 100)]
+
+    def play(self, scheduler, turns):
+        # [(clock, [actor names in the order they acted])] for each player action
+        played = []
+        for turn in range(turns):
+            names = [actor.name for actor in scheduler.advance()]
+            played.append((scheduler.now, names))
+        return played
+
+    def test_speeds(self):
+        # each actor acts whenever its own time comes round: soonest first, and in the order they were
+        # scheduled when they are due together
+        scheduler = hhsched.Scheduler()
+        for actor in self.actors:
+            scheduler.add(actor)
+        turns = 60
+        played = self.play(scheduler, turns)
+        self.assertEqual([names for (now, names) in played], reference(self.actors, turns))
+        self.assertEqual([now for (now, names) in played], [hhsched.ACTION_TIME * (turn + 1) for turn in range(turns)])
+        acted = sum((names for (now, names) in played), [])
+        self.assertEqual([acted.count(actor.name) for actor in self.actors],
+                         [turns * actor.speed // hhsched.NORMAL_SPEED for actor in self.actors])
+
+    def test_remove_and_reschedule(self):
+        scheduler = hhsched.Scheduler()
+        (slow, normal, quick, fast, slug, other) = self.actors
+        for actor in self.actors:
+            scheduler.add(actor)
+        scheduler.remove(quick)
+        scheduler.add(slow, 10)
+        slug.ai = None
+        self.assertEqual(self.play(scheduler, 1), [(100, ['slow', 'fast', 'normal', 'other normal', 'fast'])])
+        # (an actor with no ai is dropped once its time comes)
+        self.assertEqual((quick in scheduler, slug in scheduler, len(scheduler)), (False, True, 5))
+        self.assertFalse('slug' in sum((names for (now, names) in self.play(scheduler, 3)), []))
+        self.assertEqual((slug in scheduler, len(scheduler)), (False, 4))
+
+    def test_save_and_restore(self):
+        # a scheduler restored from its state carries on exactly as the one it was taken from
+        rng = random.Random(41)
+        scheduler = hhsched.Scheduler()
+        for actor in self.actors:
+            scheduler.add(actor, rng.randint(0, 300))
+        self.play(scheduler, 7)
+        scheduler.remove(self.actors[2])
+        copies = [Actor(actor.name, actor.speed) for actor in self.actors]
+        restored = hhsched.restore(scheduler.state(self.actors), copies)
+        self.assertEqual(restored.now, scheduler.now)
+        self.assertEqual(self.play(restored, 30), self.play(scheduler, 30))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+"""
+handhRL - score tests
+
+    python -m unittest discover tests
+"""
+
+import os
+import random
+import shelve
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import headless
+
+sys.path.insert(0, headless.GAME_DIR)
+import hhleader
+import hhscore
+
+
+class ScoreTest(unittest.TestCase):
+    def setUp(self):
+        self.start = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        hhleader.close()
+        os.chdir(self.start)
+        shutil.rmtree(self.directory)
+
+    def test_no_cause_of_death(self):
+        # a run with no killer is recorded the same way in the ledger and the leaderboard database
+        score_data = [12, 'Tester', None, '3']
+        self.assertEqual(hhleader.record(score_data), None)
+        hhscore.add_score(score_data)
+        hhscore.add_score([20, 'Tester', 'skeletal', '4'])
+
+        self.assertEqual([list(map(str, entry)) for entry in hhscore.top_scores(11)],
+                         [['20', 'Tester', 'skeletal', '4'], ['12', 'Tester', 'unknown', '3']])
+        self.assertEqual(hhleader.common_killers(hhleader.connect()), [('unknown', 1)])
+
+    def test_leaderboard(self):
+        # the running totals the triggers keep, against the same figures worked out from every run
+        rng = random.Random(40)
+        runs = [[rng.randint(0, 300), rng.choice(['Ann', 'Bo', 'Cy']), rng.choice(['rat', 'orc', None]),
+                 str(rng.randint(1, 5))] for i in range(60)]
+        # (a new database starts with the runs already in the ledger)
+        for score_data in runs[:20]:
+            hhscore.add_score(score_data)
+        for score_data in runs[20:]:
+            self.assertEqual(hhleader.record(score_data), None)
+        db = hhleader.connect()
+        self.assertTrue(hhleader.connect() is db)
+
+        rows = [(score, name, killed_by or 'unknown', int(level)) for (score, name, killed_by, level) in runs]
+        levels = sorted(set(row[3] for row in rows))
+        self.assertEqual([row[:2] + (round(row[2], 6),) + row[3:] for row in hhleader.deaths_by_level(db)],
+                         [(level, len([row for row in rows if row[3] == level]),
+                           round(sum(row[0] for row in rows if row[3] == level) /
+                                 float(len([row for row in rows if row[3] == level])), 6),
+                           max(row[0] for row in rows if row[3] == level)) for level in levels])
+        killers = dict((killer, len([row for row in rows if row[2] == killer])) for killer in ('rat', 'orc', 'unknown'))
+        self.assertEqual(sorted(hhleader.common_killers(db)), sorted(killers.items()))
+        for (name, count, best, level) in hhleader.player_bests(db):
+            theirs = [row for row in rows if row[1] == name]
+            self.assertEqual((count, best), (len(theirs), max(row[0] for row in theirs)))
+            self.assertTrue((best, level) in [(row[0], row[3]) for row in theirs])
+        self.assertEqual([run[0] for run in hhleader.player_runs(db, 'Bo', 5)],
+                         sorted((row[0] for row in rows if row[1] == 'Bo'), reverse=True)[:5])
+        self.assertEqual([run[0] for run in hhleader.top_runs(db, 7)],
+                         sorted((row[0] for row in rows), reverse=True)[:7])
+
+        # and they are still there once the database is opened again
+        hhleader.close()
+        self.assertEqual(len(hhleader.top_runs(hhleader.connect(), 100)), len(runs))
+
+    def best(self, scores, count):
+        # the best of a list of score_data by brute force, ties in the order they were added
+        order = sorted(range(len(scores)), key=lambda i: (-scores[i][0], i))
+        return [scores[i] for i in order[:count]]
+
+    def ledger(self):
+        return [list(map(str, entry)) for entry in hhscore.all_scores()]
+
+    def test_top_scores(self):
+        rng = random.Random(39)
+        scores = [[rng.randint(0, 50), 'Tester', 'rat', str(i)] for i in range(hhscore.TOP_SCORES + 30)]
+        for (i, score_data) in enumerate(scores):
+            hhscore.add_score(score_data)
+            if i % 40 == 0:
+                self.assertEqual(hhscore.top_scores(11), self.best(scores[:i + 1], 11))
+        self.assertEqual(hhscore.top_scores(hhscore.TOP_SCORES), self.best(scores, hhscore.TOP_SCORES))
+        self.assertEqual(self.ledger(), [list(map(str, entry)) for entry in scores])
+
+    def test_index_recovery(self):
+        # a lost, damaged or out of date index is rebuilt from the ledger
+        rng = random.Random(40)
+        scores = [[rng.randint(0, 1000), 'Tester', 'rat', '1'] for i in range(30)]
+        for score_data in scores[:20]:
+            hhscore.add_score(score_data)
+        with open(hhscore.INDEX_FILE, 'rb') as f:
+            old_index = f.read()
+        for score_data in scores[20:]:
+            hhscore.add_score(score_data)
+        for index in (None, b'HHT1' + b'\0' * 5, old_index):
+            os.remove(hhscore.INDEX_FILE)
+            if index is not None:
+                with open(hhscore.INDEX_FILE, 'wb') as f:
+                    f.write(index)
+            self.assertEqual(hhscore.top_scores(11), self.best(scores, 11))
+        self.assertEqual(hhscore.load_index()[0], os.path.getsize(hhscore.LEDGER_FILE))
+
+    def test_torn_entry(self):
+        # an entry a crash cut short is passed over, and the scores added after it are kept
+        scores = [[100, 'First', 'rat', '1'], [200, 'Second', 'rat', '2']]
+        entry = hhscore.encode_entry([300, 'Torn', 'rat', '3'])
+        for cut in range(1, len(entry)):
+            self.tearDown()
+            self.setUp()
+            hhscore.add_score(scores[0])
+            with open(hhscore.LEDGER_FILE, 'ab') as f:
+                f.write(entry[:cut])
+            self.assertEqual(hhscore.top_scores(11), scores[:1])
+            self.assertEqual(self.ledger(), [['100', 'First', 'rat', '1']])
+            hhscore.add_score(scores[1])
+            self.assertEqual(hhscore.top_scores(11), scores[::-1], cut)
+            os.remove(hhscore.INDEX_FILE)
+            self.assertEqual(hhscore.top_scores(11), scores[::-1], cut)
+            self.assertEqual(self.ledger(), [['100', 'First', 'rat', '1'], ['200', 'Second', 'rat', '2']])
+
+    def test_runs_at_once(self):
+        # games adding scores at the same time each get theirs in the ledger and the index
+        script = ('import sys\nsys.path.insert(0, {0!r})\nimport hhscore\n'
+                  'for i in range(25):\n    hhscore.add_score([int(sys.argv[1]) * 100 + i, "Tester", "rat", "1"])\n'
+                  .format(headless.GAME_DIR))
+        runs = [subprocess.Popen([sys.executable, '-c', script, str(n)]) for n in range(4)]
+        self.assertEqual([run.wait() for run in runs], [0] * 4)
+        scores = sorted(score for (score, name, killed_by, level) in hhscore.all_scores())
+        self.assertEqual(scores, sorted(n * 100 + i for n in range(4) for i in range(25)))
+        self.assertEqual([entry[0] for entry in hhscore.top_scores(hhscore.TOP_SCORES)], scores[::-1])
+
+    def test_migrate(self):
+        # scores kept in the old shelve move to the ledger the first time the scores are looked at
+        old = shelve.open(hhscore.OLD_SCORE_FILE)
+        old['scores'] = [[5, 'Old', 'rat', '1'], [9, 'Older', 'orc', '2']]
+        old.close()
+        self.assertEqual(hhscore.top_scores(11), [[9, 'Older', 'orc', '2'], [5, 'Old', 'rat', '1']])
+        hhscore.add_score([7, 'New', 'rat', '1'])
+        self.assertEqual(len(self.ledger()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
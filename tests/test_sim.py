@@ -0,0 +1,54 @@
+"""
+handhRL - combat simulator tests
+
+    python -m unittest discover tests
+"""
+
+import sys
+import unittest
+
+import headless
+
+sys.path.insert(0, headless.GAME_DIR)
+import hhsim
+
+
+class SimTest(unittest.TestCase):
+    def setUp(self):
+        self.chunk_size = hhsim.CHUNK_SIZE
+        # small batches, so each level is split across several workers
+        hhsim.CHUNK_SIZE = 120
+
+    def tearDown(self):
+        hhsim.CHUNK_SIZE = self.chunk_size
+
+    def test_batches_are_seeded(self):
+        self.assertEqual(hhsim.run_chunk((3, 3, 7, 200)), hhsim.run_chunk((3, 3, 7, 200)))
+        (dungeon_level, tally) = hhsim.run_chunk((3, 3, 7, 200))
+        self.assertEqual(dungeon_level, 3)
+        self.assertEqual(sum(entry['win'] + entry['loss'] + entry['draw'] for entry in tally.values()), 200)
+        for entry in tally.values():
+            self.assertTrue(entry['win_rounds'] <= entry['rounds'])
+
+    def test_pool_matches_one_process(self):
+        # the pool hands out the batches in any order, and the totals don't depend on it
+        totals = {}
+        for (dungeon_level, seeds) in [(1, (5, 6, 7)), (2, (8, 9, 10))]:
+            for (seed, count) in zip(seeds, (120, 120, 60)):
+                hhsim.merge(totals, *hhsim.run_chunk((dungeon_level, dungeon_level, seed, count)))
+        self.assertEqual(hhsim.simulate([1, 2], 300, seed=5, processes=2), totals)
+        self.assertEqual([hhsim.summarize(totals[level].values())['fights'] for level in (1, 2)], [300, 300])
+
+    def test_summarize(self):
+        entries = [{'win': 3, 'loss': 1, 'draw': 0, 'rounds': 10, 'win_rounds': 6},
+                   {'win': 1, 'loss': 0, 'draw': 1, 'rounds': 9, 'win_rounds': 2}]
+        self.assertEqual(hhsim.summarize(entries), {'fights': 6, 'win_rate': 4 / 6.0, 'loss_rate': 1 / 6.0,
+                                                    'mean_rounds': 19 / 6.0, 'mean_win_rounds': 2.0})
+        self.assertEqual(hhsim.summarize([])['win_rate'], 0.0)
+
+    def test_parse_levels(self):
+        self.assertEqual(hhsim.parse_levels('1-4,7,9-10'), [1, 2, 3, 4, 7, 9, 10])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+"""
+handhRL - level store tests
+
+    python -m unittest discover tests
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+import zlib
+
+import headless
+
+sys.path.insert(0, headless.GAME_DIR)
+import hhsave
+import hhstore
+
+
+def level_data(key):
+    # a level's worth of data that doesn't compress to nothing
+    rng = random.Random(key)
+    return b''.join(bytes(bytearray([rng.randrange(256)])) for x in range(3000))
+
+
+class StoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'levels')
+        # room for about two levels
+        self.budget = 7000
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def spill_files(self):
+        if not os.path.isdir(self.path):
+            return set()
+        return set(name for name in os.listdir(self.path) if name.endswith(hhstore.STORE_SUFFIX))
+
+    def save(self, store, tag):
+        # what save_entries and the writer do with the store, up to the point the save is in place
+        (writes, manifest, stale) = store.commit(tag)
+        for (path, blob) in writes:
+            hhsave.write_file(path, blob)
+        return writes, manifest, stale
+
+    def test_round_trip(self):
+        store = hhstore.LevelStore(self.path, self.budget, {})
+        for key in range(1, 8):
+            store.put(key, level_data(key))
+            self.assertTrue(store.used <= self.budget)
+        self.assertTrue(all(key in store for key in range(1, 8)))
+        self.assertFalse(8 in store)
+        for key in (1, 7, 4, 2):
+            self.assertEqual(store.take(key), level_data(key))
+            self.assertFalse(key in store)
+        self.assertEqual(store.take(1), None)
+
+    def test_budget_between_saves(self):
+        # levels departed since the last save are spilled to files of their own rather than kept in
+        # memory, and a spill file taken back before any save lists it is deleted at once
+        store = hhstore.LevelStore(self.path, self.budget, {})
+        for key in range(1, 6):
+            store.put(key, level_data(key))
+        self.assertTrue(store.used <= self.budget)
+        spilled = self.spill_files()
+        self.assertEqual(len(spilled), 5 - len(store.memory))
+        self.assertEqual(store.take(1), level_data(1))
+        self.assertEqual(len(self.spill_files()), len(spilled) - 1)
+
+    def test_save_and_load(self):
+        store = hhstore.LevelStore(self.path, self.budget, {})
+        for key in range(1, 6):
+            store.put(key, level_data(key))
+        (writes, manifest, stale) = self.save(store, 77)
+        self.assertEqual(sorted(manifest), [1, 2, 3, 4, 5])
+        self.assertEqual(sorted(os.path.basename(path) for (path, blob) in writes),
+                         sorted(name for name in manifest.values() if '.77.' in name))
+        # levels being written stay in memory until they are on disk
+        self.assertEqual(len(store.memory), len(writes))
+        store.written(writes)
+        self.assertTrue(store.used <= self.budget)
+        self.assertEqual(set(manifest.values()), self.spill_files())
+
+        loaded = hhstore.LevelStore(self.path, self.budget, manifest)
+        self.assertEqual([loaded.take(key) for key in range(1, 6)], [level_data(key) for key in range(1, 6)])
+
+    def test_crash_after_save(self):
+        # a level left again after the save goes to a new file; the files the save lists are untouched,
+        # and after a crash the store loads the levels as they were saved and drops the newer file
+        store = hhstore.LevelStore(self.path, self.budget, {})
+        for key in range(1, 5):
+            store.put(key, level_data(key))
+        (writes, manifest, stale) = self.save(store, 5)
+        store.written(writes)
+        saved = self.spill_files()
+        store.take(1)
+        for key in range(5, 8):
+            store.put(key, level_data(key))
+        store.put(1, level_data(100))
+        self.assertTrue(store.used <= self.budget)
+        self.assertTrue(saved < self.spill_files())
+
+        loaded = hhstore.LevelStore(self.path, self.budget, manifest)
+        self.assertFalse(5 in loaded)
+        self.assertEqual(loaded.take(1), level_data(1))
+        (writes, manifest, stale) = self.save(loaded, 6)
+        self.assertTrue(self.spill_files() - saved <= set(os.path.basename(path) for path in stale))
+        hhstore.remove_files(stale)
+        loaded.written(writes)
+        self.assertEqual(self.spill_files(), set(manifest.values()))
+
+    def test_new_game_keeps_old_files(self):
+        # a new game leaves the old save's files until its own first save is in place
+        old = hhstore.LevelStore(self.path, self.budget, {})
+        for key in range(1, 5):
+            old.put(key, level_data(key))
+        (writes, manifest, stale) = self.save(old, 9)
+        old.written(writes)
+        old_files = self.spill_files()
+
+        store = hhstore.LevelStore(self.path, self.budget, {})
+        self.assertEqual(self.spill_files(), old_files)
+        for key in range(1, 4):
+            store.put(key, level_data(key + 10))
+        self.assertTrue(old_files <= self.spill_files())
+        self.assertEqual(hhstore.LevelStore(self.path, self.budget, manifest).take(2), level_data(2))
+
+        (writes, manifest, stale) = self.save(store, 10)
+        self.assertTrue(old_files <= set(os.path.basename(path) for path in stale))
+        hhstore.remove_files(stale)
+        store.written(writes)
+        self.assertEqual(self.spill_files(), set(manifest.values()))
+
+    def test_untagged_files(self):
+        # a save from before the files were listed used every untagged file in the directory
+        hhsave.write_file(os.path.join(self.path, '3' + hhstore.STORE_SUFFIX), zlib.compress(level_data(3)))
+        store = hhstore.LevelStore(self.path, self.budget)
+        self.assertEqual(store.take(3), level_data(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+handhRL - timer wheel tests
+
+    python -m unittest discover tests
+"""
+
+import random
+import sys
+import unittest
+
+import headless
+
+sys.path.insert(0, headless.GAME_DIR)
+import hhtimer
+
+
+class TimerTest(unittest.TestCase):
+    def test_wraparound(self):
+        # events far enough ahead to share a slot with earlier ones, many turns round the wheel, come
+        # due on their own turn, in the order they were scheduled
+        wheel = hhtimer.TimerWheel(now=5, slots=8)
+        events = [(6, 'a'), (14, 'b'), (6 + 8 * 5, 'c'), (14, 'd'), (13, 'e'), (30, 'f')]
+        for (turn, event) in events:
+            wheel.schedule(turn, event)
+        self.assertEqual(list(wheel.advance(13)), ['a', 'e'])
+        self.assertEqual(list(wheel.advance(14)), ['b', 'd'])
+        self.assertEqual(list(wheel.advance(45)), ['f'])
+        self.assertEqual(list(wheel.advance(46)), ['c'])
+        self.assertEqual(wheel.now, 46)
+        self.assertFalse(any(wheel.slots))
+
+    def test_past_turns(self):
+        # an event due on a turn already gone comes due on the next one
+        wheel = hhtimer.TimerWheel(now=10)
+        wheel.schedule(3, 'late')
+        wheel.schedule(10, 'now')
+        wheel.schedule(11, 'next')
+        self.assertEqual(list(wheel.advance(11)), ['late', 'now', 'next'])
+
+    def test_random_schedule(self):
+        # against a plain dict of turn: events, scheduling as the wheel goes round and advancing by one
+        # turn or many
+        rng = random.Random(42)
+        wheel = hhtimer.TimerWheel(slots=16)
+        expected = {}
+        now = 0
+        for x in range(300):
+            for y in range(rng.randint(0, 3)):
+                when = now + rng.choice([1, 2, 15, 16, 17, 40, 100])
+                event = (when, rng.random())
+                wheel.schedule(when, event)
+                expected.setdefault(when, []).append(event)
+            turn = now + rng.choice([1, 1, 1, 3, 20])
+            due = sum((expected.pop(when, []) for when in range(now + 1, turn + 1)), [])
+            self.assertEqual(list(wheel.advance(turn)), due)
+            now = turn
+
+
+if __name__ == '__main__':
+    unittest.main()